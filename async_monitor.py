@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+asyncio 监控引擎
+原始套接字以非阻塞方式注册到事件循环，每次可读时取完所有已到达的包；
+不活跃截止时间用 loop.call_at 精确调度，不需要单独的检查线程，也没有每秒轮询带来的抖动
+"""
+
+import asyncio
+import socket
+import time
+from collections import namedtuple
+
+from raw_capture import RawICMPCapture, parse_echo_request, parse_echo_reply
+from metrics import LATENCY_SAMPLE_MASK
+from expiry import DEFAULT_TIMEOUT
+from source_table import SourceTable, int_to_ip, DEFAULT_MAX_SOURCES, DEFAULT_IDLE_TIMEOUT
+from source_sketch import SourceSketch, DEFAULT_SKETCH_THRESHOLD
+from load_shedder import CHECK_INTERVAL
+
+# 更新事件的默认合并间隔（秒）
+DEFAULT_UPDATE_INTERVAL = 1.0
+# 每次唤醒最多处理的包数，避免洪泛时长时间占用事件循环
+MAX_BATCH = 1024
+# 淘汰空闲记录的间隔（秒）
+EVICT_INTERVAL = 60.0
+# 定时器比截止时间稍晚触发，避免换算误差导致提前触发后反复重新调度（秒）
+EXPIRY_SLACK = 0.001
+
+
+class MonitorEvent(namedtuple('MonitorEvent', 'kind address timestamp count summary start_time')):
+    """监控事件
+
+    kind 为 'start'(新的源或停止后重新开始ping)、'update' 或 'stop'；timestamp 为开始时间或最后活动时间；
+    count 为本次会话的请求数；summary 为 SourceStats.summary() 的结果；start_time 为开始ping的时间。
+    """
+    __slots__ = ()
+
+    @property
+    def ip(self):
+        return int_to_ip(self.address)
+
+
+class AsyncICMPMonitor:
+    """基于 asyncio 的ICMP ping监控器
+
+    用法:
+        async with AsyncICMPMonitor() as monitor:
+            async for event in monitor:
+                ...
+
+    同一个源的 'update' 事件按 update_interval 合并，每个间隔最多一个；
+    update_interval 为0或None时不产生 'update' 事件。
+    给定 sources(source_table.SourceTable，例如已从快照热启动的) 时使用它，
+    忽略 timeout/max_sources/idle_timeout/sketch_threshold/shedder。
+    """
+
+    def __init__(self, echo_filter=None, timeout=DEFAULT_TIMEOUT,
+                 max_sources=DEFAULT_MAX_SOURCES, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 update_interval=DEFAULT_UPDATE_INTERVAL, metrics=None,
+                 sketch_threshold=DEFAULT_SKETCH_THRESHOLD, replies=None, shedder=None, sources=None):
+        self.capture = RawICMPCapture(echo_filter=echo_filter)
+        # 可选的 metrics.MonitorMetrics，记录处理耗时和检查耗时
+        self.metrics = metrics
+        if sources is None:
+            # sketch_threshold 不为0时，活跃源达到该数量后切换到估算模式
+            sketch = SourceSketch(sketch_threshold) if sketch_threshold else None
+            # 可选的 load_shedder.LoadShedder，过载时只跟踪按地址哈希选中的新源
+            sources = SourceTable(max_sources, idle_timeout, timeout, sketch, shedder)
+        self.sources = sources
+        # 可选的 reply_tracker.InFlightIndex，给定时把回环接口上的Echo应答与请求配对
+        self.replies = replies
+        self.capture.replies = replies is not None
+        self.update_interval = update_interval
+        self.loop = None
+        self._queue = None
+        self._expiry_handle = None
+        self._expiry_deadline = None
+        self._flush_handle = None
+        self._evict_handle = None
+        self._updated = set()
+        self._closed = False
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self._queue.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+    def pending_events(self):
+        """队列中尚未取走的事件数"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """打开套接字并注册到当前运行的事件循环，须在协程中调用"""
+        # 在协程中 get_event_loop() 返回正在运行的事件循环（get_running_loop() 需要 Python 3.7）
+        self.loop = asyncio.get_event_loop()
+        self._queue = asyncio.Queue()
+        sock = self.capture.open()
+        sock.setblocking(False)
+        self.loop.add_reader(sock.fileno(), self._on_readable)
+        self._evict_handle = self.loop.call_later(EVICT_INTERVAL, self._evict_idle)
+        # 热启动恢复的源没有新的请求时也要按时停止
+        self._schedule_expiry()
+
+    def close(self):
+        """停止收包并结束事件迭代"""
+        if self._closed or self.loop is None:
+            return
+        self._closed = True
+        if self.capture.sock is not None:
+            self.loop.remove_reader(self.capture.sock.fileno())
+            self.capture.close()
+        for handle in (self._expiry_handle, self._flush_handle, self._evict_handle):
+            if handle is not None:
+                handle.cancel()
+        self._flush_updates()
+        self._queue.put_nowait(None)
+
+    def _on_readable(self):
+        """套接字可读: 取完已到达的包（最多 MAX_BATCH 个）
+
+        每个包使用 capture.receive() 给出的内核时间戳，每次唤醒按最后一个包报告一次积压。
+        """
+        capture = self.capture
+        receive = capture.receive
+        sources = self.sources
+        metrics = self.metrics
+        replies = self.replies
+        perf_counter = time.perf_counter
+        timestamp = None
+        with memoryview(capture.buffer) as view:
+            for _ in range(MAX_BATCH):
+                try:
+                    length, timestamp = receive()
+                except (BlockingIOError, InterruptedError, socket.timeout):
+                    break
+                capture.packets_seen += 1
+                echo = parse_echo_request(view, length)
+                if echo is None:
+                    if replies is not None:
+                        reply = parse_echo_reply(view, length)
+                        if reply is not None:
+                            dst, ident, seq = reply
+                            replies.match(dst, ident, seq, timestamp)
+                    continue
+                capture.packets_matched += 1
+                timed = False
+                if metrics is not None:
+                    handled = metrics.handled = metrics.handled + 1
+                    timed = not handled & LATENCY_SAMPLE_MASK
+                    if timed:
+                        started = perf_counter()
+                src, ident, seq, size = echo
+                record, started = sources.touch(src, timestamp)
+                # 估算模式下没有记录的源只计入估算，record 为None
+                if record is not None:
+                    record.stats.update(timestamp, ident, seq, size)
+                    if replies is not None:
+                        replies.add(src, ident, seq, timestamp, record.stats)
+                    if started:
+                        self._queue.put_nowait(MonitorEvent('start', src, timestamp, 1, None,
+                                                            timestamp))
+                    elif self.update_interval:
+                        self._updated.add(src)
+                if timed:
+                    metrics.handler_latency.observe(perf_counter() - started)
+        if timestamp is not None:
+            lag = sources.record_lag(timestamp, time.time())
+            if metrics is not None:
+                metrics.capture_lag.observe(lag)
+        if self._updated and self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.update_interval, self._flush_updates)
+        self._schedule_expiry()
+
+    def _flush_updates(self):
+        """为合并间隔内有活动的源各发出一个 'update' 事件"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        updated, self._updated = self._updated, set()
+        now = time.time()
+        for src in updated:
+            record = self.sources.get(src)
+            if record is not None and record.deadline is not None:
+                self._queue.put_nowait(MonitorEvent('update', src, record.last_time, record.count,
+                                                    record.stats.summary(now), record.start_time))
+
+    def _schedule_expiry(self):
+        """按最早的截止时间设置定时器，已有更早的定时器时保持不变"""
+        deadline = self.sources.expiry.next_deadline()
+        if deadline is None:
+            if self.sources.sampling_rate == 1:
+                return
+            # 采样期间没有活跃源时也定期检查，没有请求后恢复全量处理
+            deadline = self.sources.clock(time.time()) + CHECK_INTERVAL
+        if self._expiry_handle is not None:
+            if self._expiry_deadline <= deadline:
+                return
+            self._expiry_handle.cancel()
+        self._expiry_deadline = deadline
+        # 截止时间按包的时间戳计，扣除积压后换算为事件循环的单调时钟
+        when = self.loop.time() + (deadline - self.sources.clock(time.time())) + EXPIRY_SLACK
+        self._expiry_handle = self.loop.call_at(when, self._on_expiry)
+
+    def _on_expiry(self):
+        """截止时间到达: 发出停止事件，并按新的最早截止时间重新调度"""
+        self._expiry_handle = None
+        now = time.time()
+        started = time.perf_counter()
+        expired = self.sources.expire(now)
+        if expired:
+            # 先发出待发送的更新，保证停止事件排在其后
+            self._flush_updates()
+        for record in expired:
+            self._queue.put_nowait(MonitorEvent('stop', record.address, record.last_time,
+                                                record.count, record.stats.summary(),
+                                                record.start_time))
+        if self.metrics is not None:
+            self.metrics.expiry_tick.observe(time.perf_counter() - started)
+        self._schedule_expiry()
+
+    def _evict_idle(self):
+        self.sources.evict_idle(time.time())
+        self._evict_handle = self.loop.call_later(EVICT_INTERVAL, self._evict_idle)
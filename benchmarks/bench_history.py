@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+会话历史基准测试
+通过 SessionHistory 的后台写入线程写入大量会话，测量写入速度和 record() 的耗时，
+再测量按时间、按单个地址和按网段查询的耗时
+
+    python benchmarks/bench_history.py --sessions 2000000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_history import SessionHistory, query_sessions, parse_address_range  # noqa: E402
+from source_table import int_to_ip  # noqa: E402
+
+BASE_ADDRESS = 0x0A000000  # 10.0.0.0
+# (速率, 间隔P50/P95/P99, 载荷P50, 序号缺失, 乱序, 应答P50/P95, 未应答比例)
+SUMMARY = (1.0, 1000.0, 1010.0, 1020.0, 56, 0, 0, 0.2, 0.4, 0.0)
+
+
+def fill(path, sessions, sources, span):
+    """写入 sessions 个会话，源地址从 sources 个中随机选取，结束时间均匀分布在最近 span 秒内
+
+    返回 (record() 总耗时, 包括等待写入完成的总耗时)。
+    """
+    history = SessionHistory(path)
+    rng = random.Random(1)
+    now = time.time()
+    started = time.perf_counter()
+    record_time = 0.0
+    for index in range(sessions):
+        end = now - span + span * index / sessions
+        src = BASE_ADDRESS + rng.randrange(sources)
+        before = time.perf_counter()
+        history.record(src, end - 30.0, end, 30, SUMMARY)
+        record_time += time.perf_counter() - before
+        # 模拟检查线程的节奏，避免待写入列表超过上限
+        if history.pending() >= history.max_pending // 2:
+            time.sleep(0.01)
+    history.close()
+    if history.dropped:
+        print(f"警告: 丢弃了 {history.dropped} 个会话 ({history.error})", file=sys.stderr)
+    return record_time, time.perf_counter() - started
+
+
+def time_query(path, repeat, **options):
+    """返回 (查询耗时中位数秒, 返回的会话数)"""
+    times = []
+    rows = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = query_sessions(path, **options)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times), len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="会话历史写入和查询基准测试")
+    parser.add_argument('--sessions', type=int, default=1000000, help="写入的会话数（默认1000000）")
+    parser.add_argument('--sources', type=int, default=65536, help="不同源地址数量（默认65536）")
+    parser.add_argument('--repeat', type=int, default=20, help="每个查询运行的次数（默认20）")
+    parser.add_argument('--db', help="数据库路径（默认使用临时文件，结束后删除）")
+    args = parser.parse_args()
+
+    directory = None
+    path = args.db
+    if path is None:
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, 'history.db')
+    span = 30 * 86400
+    record_time, total_time = fill(path, args.sessions, args.sources, span)
+    size = os.path.getsize(path)
+    print(f"写入 {args.sessions} 个会话: {total_time:.2f} 秒 ({args.sessions / total_time:,.0f} 个/秒)，"
+          f"record() 平均 {record_time / args.sessions * 1e6:.2f} 微秒，数据库 {size / 1048576:.1f} MB")
+
+    now = time.time()
+    one = int_to_ip(BASE_ADDRESS + 12345 % args.sources)
+    cases = [
+        ("最近100个会话", {}),
+        ("最近1小时", {'since': now - 3600}),
+        (f"单个地址 {one}", {'address_range': parse_address_range(one)}),
+        (f"单个地址 {one}，最近1天", {'address_range': parse_address_range(one), 'since': now - 86400}),
+        ("网段 10.0.16.0/20，最近1天", {'address_range': parse_address_range('10.0.16.0/20'),
+                                      'since': now - 86400}),
+        ("7天前的1小时", {'since': now - 7 * 86400 - 3600, 'until': now - 7 * 86400}),
+    ]
+    for name, options in cases:
+        elapsed, count = time_query(path, args.repeat, **options)
+        print(f"{name:32s} {elapsed * 1000:8.2f} 毫秒  {count} 个会话")
+    if directory is not None:
+        directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+源状态存储内存基准测试
+对比原来的 defaultdict(dict)+defaultdict(float)+set 组合与 SourceTable 在大量不同源时的内存占用
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source_table import SourceTable, int_to_ip, DEFAULT_MAX_SOURCES  # noqa: E402
+
+BASE_ADDRESS = 0x0A000000  # 10.0.0.0
+# 每插入多少个源调用一次 expire()，模拟检查线程取出被淘汰的活跃源
+EXPIRE_EVERY = 10000
+
+
+def fill_legacy(count):
+    """原实现：IP字符串为键的三个容器"""
+    ping_records = defaultdict(dict)
+    last_update = defaultdict(float)
+    active_ips = set()
+    timestamp = time.time()
+    for i in range(count):
+        src_ip = int_to_ip(BASE_ADDRESS + i)
+        ping_records[src_ip]['start_time'] = timestamp
+        last_update[src_ip] = timestamp
+        active_ips.add(src_ip)
+    return ping_records, last_update, active_ips
+
+
+def fill_table(count, max_size=0):
+    """SourceTable：整数地址为键的 __slots__ 记录，含活跃源的超时堆"""
+    table = SourceTable(max_size=max_size)
+    timestamp = time.time()
+    for i in range(count):
+        record, _ = table.touch(BASE_ADDRESS + i, timestamp)
+        # 与收包路径相同，每个源记录一个请求的统计
+        record.stats.update(timestamp, 0, 0, 56)
+        if not i % EXPIRE_EVERY:
+            table.expire(timestamp)
+    return table
+
+
+def fill_bounded(count):
+    """SourceTable 使用默认容量上限"""
+    return fill_table(count, DEFAULT_MAX_SOURCES)
+
+
+def measure(fill, count):
+    """返回 (峰值内存字节数, 耗时秒)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fill(count)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="源状态存储内存基准测试（所有源都处于活跃状态）")
+    parser.add_argument('--sources', type=int, default=1000000, help="不同源地址数量")
+    args = parser.parse_args()
+
+    legacy_peak, legacy_time = measure(fill_legacy, args.sources)
+    table_peak, table_time = measure(fill_table, args.sources)
+    bounded_peak, bounded_time = measure(fill_bounded, args.sources)
+
+    print(f"源地址数: {args.sources}")
+    print(f"原实现(不淘汰):          {legacy_peak / 1048576:8.1f} MB  "
+          f"{legacy_peak / args.sources:6.0f} 字节/源  {legacy_time:.2f} 秒")
+    print(f"SourceTable(不限容量):   {table_peak / 1048576:8.1f} MB  "
+          f"{table_peak / args.sources:6.0f} 字节/源  {table_time:.2f} 秒")
+    print(f"SourceTable(上限{DEFAULT_MAX_SOURCES}): {bounded_peak / 1048576:8.1f} MB  "
+          f"{'':>16}  {bounded_time:.2f} 秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+源状态快照基准测试
+构造大量不活跃的源和一部分活跃的源，测量保存快照、热启动，以及热启动后新源和重新ping的源的 touch() 耗时
+
+    python benchmarks/bench_snapshot.py --sources 300000 --active 5000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source_table import SourceTable  # noqa: E402
+from state_snapshot import save_snapshot, load_snapshot  # noqa: E402
+
+BASE_ADDRESS = 0x0A000000  # 10.0.0.0
+# 乘以与 2^24 互质的常数，使地址不按插入顺序排列
+STRIDE = 7919
+
+
+def fill(sources, active, now):
+    """前 sources - active 个源在很久以前ping过，已经停止；其余的源正在ping"""
+    table = SourceTable(max_size=0)
+    for i in range(sources - active):
+        record, _ = table.touch(BASE_ADDRESS + i * STRIDE % (1 << 24), now - 600)
+        record.stats.update(now - 600, 1, i & 0xFFFF, 56)
+    table.expire(now)
+    for i in range(sources - active, sources):
+        record, _ = table.touch(BASE_ADDRESS + i * STRIDE % (1 << 24), now)
+        record.stats.update(now, 1, i & 0xFFFF, 56)
+    return table
+
+
+def time_touch(table, addresses, now):
+    """返回每次 touch() 的平均耗时（秒）"""
+    started = time.perf_counter()
+    for address in addresses:
+        table.touch(address, now)
+    return (time.perf_counter() - started) / len(addresses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="源状态快照基准测试")
+    parser.add_argument('--sources', type=int, default=300000, help="源的总数")
+    parser.add_argument('--active', type=int, default=5000, help="其中正在ping的源数量")
+    parser.add_argument('--lookups', type=int, default=10000, help="测量 touch() 的次数")
+    args = parser.parse_args()
+
+    now = time.time()
+    table = fill(args.sources, args.active, now)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'state.bin')
+        started = time.perf_counter()
+        count = save_snapshot(table, path)
+        save_time = time.perf_counter() - started
+        size = os.path.getsize(path)
+
+        started = time.perf_counter()
+        _, records, dormant = load_snapshot(path)
+        restored = SourceTable(max_size=0)
+        restored.restore(records, dormant)
+        load_time = time.perf_counter() - started
+
+        lookups = min(args.lookups, args.sources - args.active)
+        revived = [BASE_ADDRESS + i * STRIDE % (1 << 24) for i in range(lookups)]
+        fresh = [0x0B000000 + i for i in range(lookups)]
+        fresh_time = time_touch(restored, fresh, now)
+        revive_time = time_touch(restored, revived, now)
+
+        started = time.perf_counter()
+        save_snapshot(restored, path)
+        resave_time = time.perf_counter() - started
+        del records, dormant, restored
+
+    print(f"源: {args.sources}（正在ping {args.active}）")
+    print(f"保存快照:              {save_time * 1000:8.1f} 毫秒  {count} 条记录  {size / 1048576:.1f} MB")
+    print(f"热启动:                {load_time * 1000:8.1f} 毫秒")
+    print(f"热启动后 touch 新源:     {fresh_time * 1e6:8.2f} 微秒")
+    print(f"热启动后 touch 快照中的源: {revive_time * 1e6:8.2f} 微秒")
+    print(f"热启动后再次保存:        {resave_time * 1000:8.1f} 毫秒（不活跃的源直接复制记录字节）")
+
+
+if __name__ == "__main__":
+    main()
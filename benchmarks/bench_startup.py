@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+启动时间基准测试
+在新的解释器进程中测量导入命令行版本、加载Scapy和显示图形界面窗口所需的时间，结果输出为JSON便于对比
+
+    python benchmarks/bench_startup.py --output startup.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (名称, 说明, 在新进程中执行的代码)
+CASES = [
+    ('python', "空解释器（基线）", "pass"),
+    ('cli_import', "导入命令行版本（原生引擎启动所需）", "import icmp_monitor"),
+    ('cli_scapy', "导入命令行版本并加载Scapy（scapy引擎启动所需）",
+     "import icmp_monitor, scapy_backend\n"
+     "assert scapy_backend.load_scapy() is not None"),
+    ('scapy_all', "import scapy.all（改为按需导入之前的做法）", "import scapy.all"),
+    ('gui_window', "导入图形界面版本并显示窗口",
+     "import sys\n"
+     "from gui_icmp_monitor import QApplication, MainWindow, CaptureEngine\n"
+     "app = QApplication(sys.argv[:1])\n"
+     "window = MainWindow(CaptureEngine(engine='scapy'))\n"
+     "window.show()\n"
+     "app.processEvents()"),
+]
+
+
+def measure(code, env):
+    """运行一次，返回进程从启动到退出的秒数，失败时返回None"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    return elapsed if result.returncode == 0 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动时间基准测试")
+    parser.add_argument('--repeat', type=int, default=5, help="每项运行的次数（默认5）")
+    parser.add_argument('--case', action='append', choices=[name for name, _, _ in CASES],
+                        help="只测试指定的项，可重复指定")
+    parser.add_argument('--output', help="把结果写入JSON文件（默认输出到标准输出）")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # 没有显示器时使用离屏平台，窗口显示的耗时仍然计入
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    results = []
+    for name, description, code in CASES:
+        if args.case and name not in args.case:
+            continue
+        # 先运行一次预热文件缓存和 __pycache__
+        if measure(code, env) is None:
+            results.append({'case': name, 'skipped': "运行失败（依赖不可用？）"})
+            print(f"{name:12s} 跳过: 运行失败", file=sys.stderr)
+            continue
+        times = [measure(code, env) for _ in range(args.repeat)]
+        times = [t for t in times if t is not None]
+        result = {'case': name, 'min_sec': min(times), 'median_sec': statistics.median(times),
+                  'runs': len(times)}
+        results.append(result)
+        print(f"{name:12s} 最短 {result['min_sec'] * 1000:7.0f} 毫秒  中位数 "
+              f"{result['median_sec'] * 1000:7.0f} 毫秒  {description}", file=sys.stderr)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
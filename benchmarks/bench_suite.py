@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+基准测试套件
+用合成的包流离线测试各处理路径的吞吐量、不活跃检查开销、峰值内存和界面更新延迟，结果输出为JSON便于对比
+
+    python benchmarks/bench_suite.py --output before.json
+    python benchmarks/bench_suite.py --output after.json
+    python benchmarks/bench_suite.py --compare before.json after.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import islice
+
+try:
+    import resource
+except ImportError:
+    # Windows 没有 resource 模块，不统计峰值内存
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from raw_capture import RawICMPCapture  # noqa: E402
+
+PATTERNS = ('steady', 'burst', 'spoofed')
+BACKENDS = ('raw', 'scapy', 'replay')
+BASE_ADDRESS = 0x0A000000  # 10.0.0.0
+DST_ADDRESS = 0x0A0000FE
+START_TIME = 1700000000.0
+# burst 模式下同时活跃的源占总数的比例，以及每组持续的秒数
+BURST_FRACTION = 0.1
+BURST_SECONDS = 5.0
+# Scapy 路径很慢，最多测试这么多包
+SCAPY_MAX_PACKETS = 20000
+PAYLOAD = b'\x00' * 56
+# 每次生成并处理的包数，包流按块生成，避免测试数据本身占用大量内存
+CHUNK = 65536
+# raw 路径 socketpair 的接收缓冲区大小
+SOCKET_BUFFER = 4 * 1024 * 1024
+
+# 默认测试矩阵: (模式, 源数量, 包数, 每秒包数)
+DEFAULT_SCENARIOS = [
+    ('steady', 10, 200000, 10000),
+    ('steady', 1000, 200000, 10000),
+    ('steady', 100000, 500000, 50000),
+    ('steady', 1000000, 2000000, 100000),
+    ('burst', 1000, 200000, 10000),
+    ('burst', 100000, 500000, 50000),
+    ('spoofed', 0, 500000, 50000),
+]
+QUICK_SCENARIOS = [
+    ('steady', 10, 50000, 10000),
+    ('steady', 10000, 100000, 20000),
+    ('burst', 1000, 50000, 10000),
+    ('spoofed', 0, 50000, 10000),
+]
+# 界面测试: (表格行数, 每批更新数, 批次数)
+GUI_SCENARIOS = [(100, 100, 200), (10000, 1000, 100)]
+
+
+def make_stream(pattern, sources, packets, rate, seed=1):
+    """生成合成包流，逐个产生 (源地址整数, 时间戳, identifier, sequence)
+
+    steady: 所有源轮流发送；
+    burst: 每次只有一组源活跃，BURST_SECONDS 秒后换下一组，产生大量开始/停止事件；
+    spoofed: 每个包的源地址都是随机的，模拟伪造源洪泛，sources 参数被忽略。
+    """
+    rng = random.Random(seed)
+    step = 1.0 / rate
+    if pattern == 'steady':
+        for i in range(packets):
+            yield BASE_ADDRESS + i % sources, START_TIME + i * step, 1, (i // sources) & 0xFFFF
+    elif pattern == 'burst':
+        group = max(1, int(sources * BURST_FRACTION))
+        per_burst = max(1, int(BURST_SECONDS * rate))
+        for i in range(packets):
+            first = (i // per_burst) * group
+            src = BASE_ADDRESS + (first + i % group) % sources
+            yield src, START_TIME + i * step, 1, (i // group) & 0xFFFF
+    elif pattern == 'spoofed':
+        getrandbits = rng.getrandbits
+        for i in range(packets):
+            yield getrandbits(32), START_TIME + i * step, getrandbits(16), getrandbits(16)
+    else:
+        raise ValueError(f"未知的模式: {pattern}")
+
+
+def chunks(stream):
+    """把包流切成 CHUNK 个一组的列表"""
+    while True:
+        chunk = list(islice(stream, CHUNK))
+        if not chunk:
+            return
+        yield chunk
+
+
+def build_packet(src, ident, seq):
+    """构造IPv4 ICMP Echo请求的原始字节（校验和不参与测试）"""
+    icmp = struct.pack('!BBHHH', 8, 0, 0, ident, seq) + PAYLOAD
+    return struct.pack('!BBHHHBBHII', 0x45, 0, 20 + len(icmp), 0, 0, 64, 1, 0,
+                       src, DST_ADDRESS) + icmp
+
+
+def write_pcap(path, stream):
+    """把包流写成原始IP链路层的 pcap 文件"""
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 101))
+        chunk = []
+        for src, timestamp, ident, seq in stream:
+            raw = build_packet(src, ident, seq)
+            sec = int(timestamp)
+            chunk.append(struct.pack('<IIII', sec, int((timestamp - sec) * 1e6), len(raw), len(raw)))
+            chunk.append(raw)
+            if len(chunk) >= 65536:
+                f.write(b''.join(chunk))
+                chunk = []
+        f.write(b''.join(chunk))
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为KB，macOS 为字节
+    return peak / (1048576.0 if sys.platform == 'darwin' else 1024.0)
+
+
+def send_stream(sock, stream):
+    """在子进程中逐个发送包流中的包，发送完毕后退出"""
+    try:
+        send = sock.send
+        for chunk in chunks(stream):
+            for raw in [build_packet(src, ident, seq) for src, _, ident, seq in chunk]:
+                send(raw)
+    finally:
+        os._exit(0)
+
+
+def run_session(monitor, stream, total):
+    """用 RawICMPCapture 的真实收包循环处理包流，每经过1秒包时间做一次不活跃检查
+
+    子进程把包写进 Unix 域数据报 socketpair，本进程的 RawICMPCapture.run 用 recvmsg_into
+    和 SO_TIMESTAMPNS 收包，包时间即内核时间戳。
+    返回 (处理的包数, 处理耗时, 检查耗时列表)，生成测试数据的时间在子进程中，不计入。
+    """
+    receiver, sender = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+    pid = os.fork()
+    if pid == 0:
+        receiver.close()
+        send_stream(sender, stream)
+    sender.close()
+    handle_echo = monitor.handle_echo
+    check = monitor.check_inactive_ips
+    perf_counter = time.perf_counter
+    ticks = []
+    next_tick = [0.0]
+
+    def handler(src, timestamp, ident, seq, size):
+        if timestamp >= next_tick[0]:
+            tick_start = perf_counter()
+            check(timestamp)
+            ticks.append(perf_counter() - tick_start)
+            next_tick[0] = timestamp + 1.0
+        handle_echo(src, timestamp, ident, seq, size)
+
+    capture = RawICMPCapture()
+    capture.open(receiver)
+    try:
+        start = perf_counter()
+        capture.run(handler, lambda: capture.packets_seen < total)
+        elapsed = perf_counter() - start
+    finally:
+        os.waitpid(pid, 0)
+    return capture.packets_seen, elapsed, ticks
+
+
+def bench_backend(backend, pattern, sources, packets, rate):
+    """在当前进程中测试一个处理路径，返回结果字典"""
+    import icmp_monitor
+    stream = make_stream(pattern, sources, packets, rate)
+    result = {'pattern': pattern, 'sources': sources, 'packets': packets, 'rate': rate,
+              'backend': backend}
+    # 新源和停止的源都会打印一行，测试期间丢弃输出
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        monitor = icmp_monitor.ICMPPingMonitor(engine='raw', max_sources=0)
+        if backend == 'raw':
+            if not hasattr(os, 'fork') or not hasattr(socket, 'AF_UNIX'):
+                return dict(result, skipped="需要 fork 和 Unix 域套接字")
+            processed, elapsed, ticks = run_session(monitor, stream, packets)
+        elif backend == 'scapy':
+            from scapy_backend import ScapyCapture, load_scapy
+            scapy = load_scapy()
+            if scapy is None:
+                return dict(result, skipped="Scapy不可用")
+            capture = ScapyCapture()
+            IP = scapy.IP
+            raws = [build_packet(src, ident, seq)
+                    for src, _, ident, seq in islice(stream, SCAPY_MAX_PACKETS)]
+            start = time.perf_counter()
+            for raw in raws:
+                capture.handle_packet(IP(raw), monitor.handle_echo)
+            elapsed, ticks = time.perf_counter() - start, []
+            processed = len(raws)
+        elif backend == 'replay':
+            fd, path = tempfile.mkstemp(suffix='.pcap')
+            os.close(fd)
+            try:
+                write_pcap(path, stream)
+                size = os.path.getsize(path)
+                start = time.perf_counter()
+                monitor.replay(path)
+                elapsed, ticks = time.perf_counter() - start, []
+                processed = monitor.capture.packets_seen
+            finally:
+                os.unlink(path)
+            result['mb_per_sec'] = size / elapsed / 1e6
+        else:
+            raise ValueError(f"未知的处理路径: {backend}")
+    result.update({
+        'processed': processed,
+        'elapsed_sec': elapsed,
+        'packets_per_sec': processed / elapsed if elapsed > 0 else None,
+        'ticks': len(ticks),
+        'tick_mean_us': sum(ticks) / len(ticks) * 1e6 if ticks else None,
+        'tick_max_us': max(ticks) * 1e6 if ticks else None,
+        'table_size': len(monitor.sources),
+        'peak_rss_mb': peak_rss_mb(),
+    })
+    return result
+
+
+def bench_gui(rows, batch_size, batches):
+    """在 offscreen Qt 平台上测试新增行和批量更新的界面延迟（含排序和重绘）"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    result = {'scenario': 'gui', 'rows': rows, 'batch_size': batch_size, 'batches': batches}
+    try:
+        import gui_icmp_monitor as gui
+    except SystemExit:
+        return dict(result, skipped="PyQt5不可用")
+    app = gui.QApplication.instance() or gui.QApplication([])
+    window = gui.MainWindow(gui.CaptureEngine(engine='raw'))
+    window.show()
+    app.processEvents()
+    ips = [socket.inet_ntoa(struct.pack('!I', BASE_ADDRESS + i)) for i in range(rows)]
+    perf_counter = time.perf_counter
+
+    start = perf_counter()
+    for index, ip in enumerate(ips):
+        window.on_new_ping(ip, START_TIME + index * 1e-3)
+    app.processEvents()
+    add_elapsed = perf_counter() - start
+
+    rng = random.Random(1)
+    summary = (1.0, 1000.0, 1000.0, 1000.0, 56, 0, 0, None, None, None)
+    latencies = []
+    for index in range(batches):
+        timestamp = START_TIME + rows + index
+        batch = {ip: (timestamp, 1, summary) for ip in rng.sample(ips, min(batch_size, rows))}
+        start = perf_counter()
+        window.on_batch_update(batch)
+        app.processEvents()
+        latencies.append(perf_counter() - start)
+    window.close()
+    latencies.sort()
+    result.update({
+        'add_rows_per_sec': rows / add_elapsed,
+        'batch_p50_ms': latencies[len(latencies) // 2] * 1000,
+        'batch_p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'batch_max_ms': latencies[-1] * 1000,
+        'peak_rss_mb': peak_rss_mb(),
+    })
+    return result
+
+
+def run_isolated(args):
+    """在子进程中运行单个测试，使峰值内存互不影响"""
+    command = [sys.executable, os.path.abspath(__file__), '--one'] + [str(a) for a in args]
+    completed = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True)
+    if completed.returncode != 0:
+        return {'args': list(args), 'error': f"退出码 {completed.returncode}"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def scenario_key(result):
+    """结果的唯一标识，用于对比两次运行"""
+    if result.get('scenario') == 'gui':
+        return f"gui/{result['rows']}/{result['batch_size']}"
+    return f"{result['backend']}/{result['pattern']}/{result['sources']}/{result['packets']}/{result['rate']}"
+
+
+def format_mb(result):
+    peak = result.get('peak_rss_mb')
+    return '-' if peak is None else f"{peak:.0f} MB"
+
+
+def describe(result):
+    """单个结果的一行摘要"""
+    key = scenario_key(result)
+    if 'skipped' in result or 'error' in result:
+        return f"{key:<40} {result.get('skipped') or result.get('error')}"
+    if result.get('scenario') == 'gui':
+        return (f"{key:<40} 新增 {result['add_rows_per_sec']:>10,.0f} 行/秒  "
+                f"批次 P50 {result['batch_p50_ms']:.2f} / P99 {result['batch_p99_ms']:.2f} 毫秒  "
+                f"{format_mb(result)}")
+    tick = result['tick_mean_us']
+    tick_text = f"检查 {tick:8.0f} 微秒" if tick is not None else f"{'':14}"
+    return f"{key:<40} {result['packets_per_sec']:>10,.0f} 包/秒  {tick_text}  {format_mb(result)}"
+
+
+# 对比时关注的指标及其方向（True 表示越大越好）
+COMPARE_METRICS = (
+    ('packets_per_sec', True), ('tick_mean_us', False), ('peak_rss_mb', False),
+    ('add_rows_per_sec', True), ('batch_p99_ms', False),
+)
+
+
+def compare(base_path, new_path):
+    """打印两次运行结果的变化百分比"""
+    with open(base_path) as f:
+        base = {scenario_key(r): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    for result in new:
+        key = scenario_key(result)
+        old = base.get(key)
+        if old is None:
+            print(f"{key:<40} （基准中没有）")
+            continue
+        parts = []
+        for metric, higher_better in COMPARE_METRICS:
+            before, after = old.get(metric), result.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            better = change > 0 if higher_better else change < 0
+            parts.append(f"{metric} {change:+.1f}%{'' if abs(change) < 5 else (' ↑' if better else ' ↓')}")
+        print(f"{key:<40} {'  '.join(parts)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基准测试套件（离线、合成包流）")
+    parser.add_argument('--quick', action='store_true', help="使用较小的测试矩阵")
+    parser.add_argument('--backend', action='append', choices=BACKENDS,
+                        help="只测试指定的处理路径，可重复指定")
+    parser.add_argument('--no-gui', action='store_true', help="跳过界面延迟测试")
+    parser.add_argument('--output', help="把结果写入JSON文件（默认输出到标准输出）")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help="对比两个结果文件")
+    parser.add_argument('--one', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.one:
+        if args.one[0] == 'gui':
+            result = bench_gui(*(int(v) for v in args.one[1:]))
+        else:
+            backend, pattern = args.one[:2]
+            result = bench_backend(backend, pattern, *(int(v) for v in args.one[2:]))
+        print(json.dumps(result))
+        return
+
+    backends = args.backend or BACKENDS
+    results = []
+    for pattern, sources, packets, rate in (QUICK_SCENARIOS if args.quick else DEFAULT_SCENARIOS):
+        for backend in backends:
+            result = run_isolated((backend, pattern, sources, packets, rate))
+            results.append(result)
+            print(describe(result), file=sys.stderr)
+    if not args.no_gui:
+        for rows, batch_size, batches in GUI_SCENARIOS[:1] if args.quick else GUI_SCENARIOS:
+            result = run_isolated(('gui', rows, batch_size, batches))
+            results.append(result)
+            print(describe(result), file=sys.stderr)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
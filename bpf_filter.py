@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+内核态ICMP过滤
+生成并挂载经典BPF程序，只放行发往本机地址的ICMP Echo请求（配对应答时另外放行本机发出的Echo应答），
+其余包在内核中直接丢弃
+"""
+
+import argparse
+import ctypes
+import ipaddress
+import os
+import platform
+import socket
+import struct
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl
+    fcntl = None
+
+# setsockopt 常量（Linux）
+SO_ATTACH_FILTER = 26
+SO_BINDTODEVICE = 25
+SIOCGIFADDR = 0x8915
+
+# netlink 常量（Linux），用 RTM_GETADDR 列出全部IPv4地址
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+_NLMSGHDR = struct.Struct('=IHHII')
+_IFADDRMSG = struct.Struct('=BBBBI')
+_RTATTR = struct.Struct('=HH')
+
+# 经典BPF指令编码
+BPF_LD_W_ABS = 0x20
+BPF_LD_H_ABS = 0x28
+BPF_LD_B_ABS = 0x30
+BPF_LD_B_IND = 0x50
+BPF_LDX_B_MSH = 0xb1
+BPF_ALU_AND_K = 0x54
+BPF_ALU_MUL_K = 0x24
+BPF_ALU_RSH_K = 0x74
+BPF_ALU_MOD_K = 0x94
+BPF_JMP_JA = 0x05
+BPF_JMP_JEQ_K = 0x15
+BPF_JMP_JSET_K = 0x45
+BPF_RET_K = 0x06
+BPF_RET_A = 0x16
+# 加上此偏移的绝对/间接读取相对于网络层头（IP头）计算，与包前面有没有链路层头无关
+SKF_NET_OFF = -0x100000
+
+# 放行时截取的最大字节数
+ACCEPT_SNAPLEN = 0x40000
+# 条件跳转偏移只有8位，地址和网段总数需要受限
+MAX_MATCH_ENTRIES = 100
+MAX_JUMP_OFFSET = 255
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
+def interface_address(name):
+    """通过 SIOCGIFADDR 获取网卡的IPv4地址，没有地址时返回None"""
+    if fcntl is None:
+        return None
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        ifreq = struct.pack('256s', name.encode()[:15])
+        result = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, ifreq)
+        return socket.inet_ntoa(result[20:24])
+    except OSError:
+        return None
+    finally:
+        sock.close()
+
+
+def _netlink_align(length):
+    return (length + 3) & ~3
+
+
+def parse_address_messages(data):
+    """解析一次 recv 得到的 RTM_GETADDR 应答，返回 ([(网卡序号, 地址)], 是否已结束)
+
+    点对点网卡的 IFA_ADDRESS 是对端地址，优先取 IFA_LOCAL。内核返回错误时抛出 OSError。
+    """
+    addresses = []
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, kind, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            break
+        end = offset + length
+        if kind == NLMSG_DONE:
+            return addresses, True
+        if kind == NLMSG_ERROR:
+            error = -struct.unpack_from('=i', data, offset + _NLMSGHDR.size)[0]
+            raise OSError(error, os.strerror(error))
+        if kind == RTM_NEWADDR:
+            family, _, _, _, index = _IFADDRMSG.unpack_from(data, offset + _NLMSGHDR.size)
+            found = {}
+            position = offset + _NLMSGHDR.size + _IFADDRMSG.size
+            while position + _RTATTR.size <= end:
+                size, attribute = _RTATTR.unpack_from(data, position)
+                if size < _RTATTR.size:
+                    break
+                if attribute in (IFA_ADDRESS, IFA_LOCAL) and size == _RTATTR.size + 4:
+                    found[attribute] = socket.inet_ntoa(data[position + 4:position + 8])
+                position += _netlink_align(size)
+            address = found.get(IFA_LOCAL) or found.get(IFA_ADDRESS)
+            if family == socket.AF_INET and address:
+                addresses.append((index, address))
+        offset += _netlink_align(length)
+    return addresses, False
+
+
+def netlink_ipv4_addresses():
+    """通过 netlink RTM_GETADDR 列出所有网卡的全部IPv4地址（包括从地址和别名），返回 [(网卡序号, 地址)]
+
+    不支持 netlink 时返回None。
+    """
+    if not hasattr(socket, 'AF_NETLINK'):
+        return None
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    except OSError:
+        return None
+    try:
+        sock.settimeout(1.0)
+        sock.bind((0, 0))
+        request = _IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+        sock.send(_NLMSGHDR.pack(_NLMSGHDR.size + len(request), RTM_GETADDR,
+                                 NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + request)
+        addresses = []
+        done = False
+        while not done:
+            batch, done = parse_address_messages(sock.recv(65536))
+            addresses.extend(batch)
+        return addresses
+    except OSError:
+        return None
+    finally:
+        sock.close()
+
+
+def local_ipv4_addresses(interface=None):
+    """获取本机IPv4地址列表，指定 interface 时只返回该网卡的地址
+
+    Linux 下通过 netlink 取得每个网卡的全部地址；netlink 不可用时退回 SIOCGIFADDR，只能取得每个网卡的主地址。
+    """
+    if platform.system() != 'Linux':
+        try:
+            return sorted(set(socket.gethostbyname_ex(socket.gethostname())[2]))
+        except OSError:
+            return []
+    entries = netlink_ipv4_addresses()
+    if entries is not None:
+        try:
+            wanted = socket.if_nametoindex(interface) if interface else None
+        except OSError:
+            return []
+        addresses = []
+        for index, address in entries:
+            if (wanted is None or index == wanted) and address not in addresses:
+                addresses.append(address)
+        return addresses
+    names = [interface] if interface else [name for _, name in socket.if_nameindex()]
+    addresses = []
+    for name in names:
+        address = interface_address(name)
+        if address and address not in addresses:
+            addresses.append(address)
+    return addresses
+
+
+def parse_network(text):
+    """解析命令行的 --src-net，无效时抛出 argparse.ArgumentTypeError，由 argparse 给出错误提示"""
+    try:
+        network = ipaddress.ip_network(text, strict=False)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的网段: {text}（应为 CIDR，例如 10.0.0.0/8）") from None
+    if network.version != 4:
+        raise argparse.ArgumentTypeError(f"只支持IPv4网段: {text}")
+    return network
+
+
+def parse_networks(cidrs):
+    """把CIDR字符串（或 IPv4Network）列表解析为 IPv4Network 列表"""
+    networks = []
+    for cidr in cidrs or ():
+        network = ipaddress.ip_network(cidr, strict=False)
+        if network.version != 4:
+            raise ValueError(f"只支持IPv4网段: {cidr}")
+        networks.append(network)
+    return networks
+
+
+def _address_checks(name, local_addresses, src_networks, local_offset, peer_offset):
+    """生成检查本机地址和对端网段的带标签指令，以放行结束，不匹配时跳到 'drop'
+
+    local_offset/peer_offset 为本机地址和对端地址在IP头中的偏移（请求为目的/源，应答相反）。
+    """
+    program = []
+    if local_addresses:
+        program.append((BPF_LD_W_ABS, None, None, local_offset))
+        for index, address in enumerate(local_addresses):
+            last = index == len(local_addresses) - 1
+            value = struct.unpack('!I', socket.inet_aton(address))[0]
+            program.append((BPF_JMP_JEQ_K, name + '_peer', 'drop' if last else None, value))
+    program.append(('label', name + '_peer'))
+    for index, network in enumerate(src_networks):
+        last = index == len(src_networks) - 1
+        program.append((BPF_LD_W_ABS, None, None, peer_offset))
+        program.append((BPF_ALU_AND_K, None, None, int(network.netmask)))
+        program.append((BPF_JMP_JEQ_K, name + '_accept', 'drop' if last else None,
+                        int(network.network_address)))
+    program.append(('label', name + '_accept'))
+    program.append((BPF_RET_K, None, None, ACCEPT_SNAPLEN))
+    return program
+
+
+def build_echo_filter(local_addresses=(), src_networks=(), replies=False):
+    """生成只放行ICMP Echo请求的BPF程序
+
+    程序从IP头开始计算偏移（AF_INET原始套接字和SOCK_DGRAM包套接字均如此）。
+    local_addresses 非空时只放行目的地址属于本机的包，
+    src_networks 非空时只放行源地址落在这些网段内的包。
+    replies 为True时另外放行Echo应答，条件相反: 源地址属于本机、目的地址落在 src_networks 内。
+    返回 (code, jt, jf, k) 元组列表。
+    """
+    local_addresses = list(local_addresses)
+    src_networks = list(src_networks)
+    if len(local_addresses) + len(src_networks) > MAX_MATCH_ENTRIES:
+        raise ValueError(f"本机地址和源网段总数不能超过 {MAX_MATCH_ENTRIES}")
+
+    # 先生成带标签的指令，最后统一计算跳转偏移
+    program = [
+        (BPF_LD_B_ABS, None, None, 9),                # A = IP协议号
+        (BPF_JMP_JEQ_K, None, 'drop', socket.IPPROTO_ICMP),
+        (BPF_LD_H_ABS, None, None, 6),                # A = 分片标志和偏移
+        (BPF_JMP_JSET_K, 'drop', None, 0x1fff),       # 非首片没有ICMP头
+        (BPF_LDX_B_MSH, None, None, 0),               # X = IP头长度
+        (BPF_LD_B_IND, None, None, 0),                # A = ICMP类型
+        (BPF_JMP_JEQ_K, None, 'reply' if replies else 'drop', ICMP_ECHO_REQUEST),
+    ]
+    # 请求: 目的地址(16)为本机，源地址(12)在源网段内
+    program.extend(_address_checks('request', local_addresses, src_networks, 16, 12))
+    if replies:
+        program.append(('label', 'reply'))
+        program.append((BPF_JMP_JEQ_K, None, 'drop', ICMP_ECHO_REPLY))
+        program.extend(_address_checks('reply', local_addresses, src_networks, 12, 16))
+    program.append(('label', 'drop'))
+    program.append((BPF_RET_K, None, None, 0))
+
+    # 计算标签位置
+    labels = {}
+    instructions = []
+    for item in program:
+        if item[0] == 'label':
+            labels[item[1]] = len(instructions)
+        else:
+            instructions.append(item)
+
+    compiled = []
+    for pc, (code, jt, jf, k) in enumerate(instructions):
+        jt = labels[jt] - pc - 1 if jt else 0
+        jf = labels[jf] - pc - 1 if jf else 0
+        if max(jt, jf) > MAX_JUMP_OFFSET:
+            raise ValueError("本机地址和源网段过多，BPF条件跳转超出范围")
+        compiled.append((code, jt, jf, k))
+    return compiled
+
+
+def build_source_hash_program(buckets):
+    """生成按对端地址分桶的BPF程序，返回值为 0 ~ buckets-1，用于 PACKET_FANOUT_CBPF
+
+    Echo应答取目的地址，其余包取源地址，同一个源的请求和本机给它的应答落在同一个桶。
+    地址先乘以黄金分割常数再取高位，使连续网段也能均匀分布到各个桶。
+    分发程序在包套接字调整数据起点之前运行，本机发出的包前面还有链路层头，收到的包没有，
+    因此所有读取都相对于 SKF_NET_OFF。
+    """
+    return [
+        (BPF_LDX_B_MSH, 0, 0, SKF_NET_OFF),       # X = IP头长度
+        (BPF_LD_B_IND, 0, 0, SKF_NET_OFF),        # A = ICMP类型
+        (BPF_JMP_JEQ_K, 2, 0, ICMP_ECHO_REPLY),
+        (BPF_LD_W_ABS, 0, 0, SKF_NET_OFF + 12),   # A = 源地址
+        (BPF_JMP_JA, 0, 0, 1),
+        (BPF_LD_W_ABS, 0, 0, SKF_NET_OFF + 16),   # A = 目的地址
+        (BPF_ALU_MUL_K, 0, 0, 0x9E3779B1),
+        (BPF_ALU_RSH_K, 0, 0, 16),
+        (BPF_ALU_MOD_K, 0, 0, buckets),
+        (BPF_RET_A, 0, 0, 0),
+    ]
+
+
+def pack_program(program):
+    """把BPF程序打包为 struct sock_fprog，返回 (fprog字节, 指令缓冲区)
+
+    指令缓冲区需要在 setsockopt 返回之前保持存活。
+    """
+    # 负的偏移（SKF_NET_OFF 等）按32位补码保存
+    raw = b''.join(struct.pack('HBBI', code, jt, jf, k & 0xFFFFFFFF) for code, jt, jf, k in program)
+    buffer = ctypes.create_string_buffer(raw, len(raw))
+    return struct.pack('HL', len(program), ctypes.addressof(buffer)), buffer
+
+
+def attach_filter(sock, program):
+    """通过 SO_ATTACH_FILTER 把BPF程序挂载到套接字上"""
+    fprog, buffer = pack_program(program)
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+    del buffer
+
+
+def bind_to_device(sock, interface):
+    """把套接字限定到指定网卡"""
+    sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, interface.encode())
+
+
+def read_icmp_in_msgs(path='/proc/net/snmp'):
+    """读取内核统计的入站ICMP报文总数，不支持时返回None"""
+    try:
+        with open(path) as f:
+            lines = [line.split() for line in f if line.startswith('Icmp:')]
+    except OSError:
+        return None
+    if len(lines) < 2:
+        return None
+    header, values = lines[0], lines[1]
+    try:
+        return int(values[header.index('InMsgs')])
+    except (ValueError, IndexError):
+        return None
+
+
+class EchoRequestFilter:
+    """Echo请求的内核过滤配置，供各抓包引擎共用
+
+    interface 限定网卡，src_cidrs 限定源网段。
+    同时提供BPF程序（原始套接字引擎）和pcap过滤表达式（Scapy引擎）两种形式。
+    """
+
+    def __init__(self, interface=None, src_cidrs=()):
+        self.interface = interface
+        self.src_networks = parse_networks(src_cidrs)
+        self.local_addresses = local_ipv4_addresses(interface)
+        # 启动时的入站ICMP计数，用于估算被内核过滤掉的包数
+        self.baseline_in_msgs = None
+
+    def bpf_program(self, replies=False):
+        """生成BPF程序，replies 为True时同时放行本机发出的Echo应答"""
+        return build_echo_filter(self.local_addresses, self.src_networks, replies)
+
+    def pcap_expression(self, replies=False):
+        """生成等价的pcap过滤表达式"""
+        expression = self._pcap_terms("icmp-echo", "dst", "src")
+        if replies:
+            expression = (f"({expression}) or "
+                          f"({self._pcap_terms('icmp-echoreply', 'src', 'dst')})")
+        return expression
+
+    def _pcap_terms(self, icmp_type, local_direction, peer_direction):
+        parts = [f"icmp[icmptype] == {icmp_type}"]
+        if self.local_addresses:
+            parts.append("(" + " or ".join(f"{local_direction} host {a}"
+                                           for a in self.local_addresses) + ")")
+        if self.src_networks:
+            parts.append("(" + " or ".join(f"{peer_direction} net {n}"
+                                           for n in self.src_networks) + ")")
+        return " and ".join(parts)
+
+    def apply(self, sock, replies=False):
+        """挂载到套接字，并记录入站ICMP计数基线"""
+        if self.interface:
+            bind_to_device(sock, self.interface)
+        attach_filter(sock, self.bpf_program(replies))
+        self.start_counting()
+
+    def start_counting(self):
+        """记录入站ICMP计数基线"""
+        self.baseline_in_msgs = read_icmp_in_msgs()
+
+    def rejected_count(self, accepted):
+        """估算内核过滤丢弃的包数: 期间入站ICMP总数 - 送达处理函数的包数
+
+        内核不提供过滤器丢包计数，这里用 /proc/net/snmp 的 InMsgs 差值估算，
+        不支持时返回None。
+        """
+        if self.baseline_in_msgs is None:
+            return None
+        current = read_icmp_in_msgs()
+        if current is None:
+            return None
+        return max(0, current - self.baseline_in_msgs - accepted)
+
+    def describe(self):
+        """过滤条件的简短描述"""
+        desc = f"本机地址 {', '.join(self.local_addresses) or '任意'}"
+        if self.interface:
+            desc += f", 网卡 {self.interface}"
+        if self.src_networks:
+            desc += f", 源网段 {', '.join(str(n) for n in self.src_networks)}"
+        return desc
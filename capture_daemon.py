@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ICMP Ping 抓包守护进程
+在独立的进程中抓包和检测会话，通过Unix域套接字把增量帧（delta_protocol）发送给任意多个图形界面；
+界面(gui_icmp_monitor.py --connect)可以随时连接、断开和重连，不影响抓包，
+界面重绘也不会和抓包争抢同一个进程的GIL
+"""
+
+import argparse
+import functools
+import os
+import select
+import signal
+import socket
+import sqlite3
+import stat
+import sys
+import threading
+import time
+
+from capture_engine import CaptureEngine, add_capture_arguments, capture_arguments_error, engine_options
+from event_output import EventOutput
+from delta_protocol import (DaemonStats, encode_hello, encode_start, encode_updates, encode_stop,
+                            encode_snapshot, encode_sweep, encode_stats, encode_error,
+                            DEFAULT_SOCKET_PATH)
+from session_history import SessionHistory
+from state_snapshot import StateSnapshots
+from metrics import start_exporters
+
+# 套接字文件的默认权限，同组的用户可以运行界面连接
+DEFAULT_SOCKET_MODE = 0o660
+# 每个界面待发送数据的上限（字节），界面跟不上时断开它，重连后重新获得快照，抓包不会因此阻塞
+DEFAULT_MAX_CLIENT_BUFFER = 8 * 1024 * 1024
+# 发送抓包统计的间隔（秒）
+STATS_INTERVAL = 1.0
+# 每次最多发送的字节数
+SEND_CHUNK = 256 * 1024
+
+
+class _Client:
+    """一个已连接的界面"""
+    __slots__ = ('sock', 'buffer', 'pending', 'snapshot', 'overflowed')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        # 快照生成期间发布的帧先暂存，快照之后再发送
+        self.pending = []
+        # buffer 开头尚未发出的 HELLO 和快照的字节数，不计入 max_buffer
+        self.snapshot = 0
+        self.overflowed = False
+
+    def backlog(self):
+        """快照之后积压的字节数"""
+        return len(self.buffer) - self.snapshot
+
+
+class DeltaPublisher:
+    """通过Unix域套接字把帧发送给所有已连接的界面
+
+    publish() 只把帧追加到每个界面的发送缓冲区，由 serve() 所在的线程用非阻塞套接字发送，
+    多个线程可以同时调用。新的界面连接时先发送 HELLO 和 snapshot() 返回的帧；
+    某个界面快照之后积压的数据超过 max_buffer 字节时断开它，不影响其他界面和抓包；
+    快照本身不受限制，活跃源很多时新界面不会因为快照太大而反复断开重连。
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, snapshot=None, stats=None, mode=DEFAULT_SOCKET_MODE,
+                 max_buffer=DEFAULT_MAX_CLIENT_BUFFER, log=print):
+        self.path = path
+        # 返回当前状态的帧列表，以及返回 DaemonStats 的回调
+        self.snapshot = snapshot
+        self.stats = stats
+        self.mode = mode
+        self.max_buffer = max_buffer
+        self.log = log
+        self.started = time.time()
+        self.clients_connected = 0
+        self.clients_dropped = 0
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._closing = False
+        self._listener = None
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._wake_writer.setblocking(False)
+
+    def open(self):
+        """在 path 上监听，已有守护进程在监听时抛出 OSError"""
+        if os.path.exists(self.path):
+            if not stat.S_ISSOCK(os.stat(self.path).st_mode):
+                raise OSError(f"{self.path} 已存在且不是套接字")
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                # 上次异常退出留下的套接字文件
+                os.unlink(self.path)
+            else:
+                raise OSError(f"已有守护进程在 {self.path} 上监听")
+            finally:
+                probe.close()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self.path)
+            os.chmod(self.path, self.mode)
+            listener.listen(16)
+        except OSError:
+            listener.close()
+            raise
+        listener.setblocking(False)
+        self._listener = listener
+
+    @property
+    def client_count(self):
+        return len(self._clients)
+
+    def publish(self, frame):
+        """把一帧发送给所有界面"""
+        if not self._clients:
+            return
+        wake = False
+        with self._lock:
+            for client in self._clients.values():
+                if client.overflowed:
+                    continue
+                if client.pending is not None:
+                    client.pending.append(frame)
+                    continue
+                wake = wake or not client.buffer
+                client.buffer += frame
+                if client.backlog() > self.max_buffer:
+                    client.overflowed = True
+                    wake = True
+        if wake:
+            self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_writer.send(b'\0')
+        except BlockingIOError:
+            # 已有未处理的唤醒
+            pass
+
+    def serve(self):
+        """处理连接和发送，直到 close()，返回前断开所有界面并删除套接字文件"""
+        try:
+            self._serve()
+        finally:
+            self._shutdown()
+
+    def _serve(self):
+        next_stats = time.monotonic()
+        while not self._closing:
+            now = time.monotonic()
+            if now >= next_stats:
+                next_stats = now + STATS_INTERVAL
+                if self.stats is not None:
+                    self.publish(encode_stats(self.stats()))
+            with self._lock:
+                clients = list(self._clients.values())
+            readers = [self._listener, self._wake_reader] + [client.sock for client in clients]
+            writers = [client.sock for client in clients if client.buffer]
+            readable, writable, _ = select.select(readers, writers, [], max(0.0, next_stats - now))
+            if self._wake_reader in readable:
+                self._wake_reader.recv(4096)
+            if self._listener in readable:
+                self._accept()
+            for client in clients:
+                if client.overflowed:
+                    self.clients_dropped += 1
+                    self._disconnect(client, f"界面处理不过来，待发送数据超过 {self.max_buffer} 字节")
+                elif client.sock in readable:
+                    self._read(client)
+                elif client.sock in writable:
+                    self._write(client)
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except OSError:
+            return
+        sock.setblocking(False)
+        client = _Client(sock)
+        # 先登记再生成快照，生成期间发布的帧暂存在 pending 中，不会遗漏；
+        # 帧都是覆盖式的状态更新，快照之后重复发送它们也没有问题
+        with self._lock:
+            self._clients[sock.fileno()] = client
+        frames = [encode_hello(self.started)]
+        if self.snapshot is not None:
+            frames.extend(self.snapshot())
+        with self._lock:
+            client.buffer += b''.join(frames)
+            client.snapshot = len(client.buffer)
+            client.buffer += b''.join(client.pending)
+            client.pending = None
+            client.overflowed = client.backlog() > self.max_buffer
+        self.clients_connected += 1
+        self.log(f"界面已连接，当前 {len(self._clients)} 个")
+
+    def _read(self, client):
+        # 协议是单向的，界面发来的数据直接丢弃，读到EOF表示界面已断开
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._disconnect(client, str(e))
+            return
+        if not data:
+            self._disconnect(client, None)
+
+    def _write(self, client):
+        with self._lock:
+            data = bytes(client.buffer[:SEND_CHUNK])
+        try:
+            sent = client.sock.send(data)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._disconnect(client, str(e))
+            return
+        with self._lock:
+            del client.buffer[:sent]
+            client.snapshot = max(0, client.snapshot - sent)
+
+    def _disconnect(self, client, reason):
+        with self._lock:
+            self._clients.pop(client.sock.fileno(), None)
+        client.sock.close()
+        message = f"界面已断开，当前 {len(self._clients)} 个"
+        self.log(f"{message} ({reason})" if reason else message)
+
+    def close(self):
+        """让 serve() 返回，可以在其他线程或信号处理函数中调用"""
+        self._closing = True
+        self._wake()
+
+    def _shutdown(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.sock.close()
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        self._wake_reader.close()
+        self._wake_writer.close()
+
+
+class DaemonWorker:
+    """不显示界面的抓包前端: 把抓包引擎(capture_engine.CaptureEngine)的事件编码为增量帧交给 DeltaPublisher
+
+    以 coalesce 策略订阅事件总线，发送跟不上时队列中相邻的更新批次合并为一批，开始/停止和扫描事件不丢弃，
+    否则各界面的表格会与引擎不一致；跟不上的界面由 DeltaPublisher 断开后重新按快照同步。不依赖Qt，事件在总线的分发线程中编码和发布。
+    """
+
+    def __init__(self, engine, log=print):
+        self.engine = engine
+        self.log = log
+        self.publisher = None
+        self.subscription = engine.bus.subscribe('daemon', {
+            'start': self._publish_start,
+            'stop': self._publish_stop,
+            'updates': self._publish_updates,
+            'sweep_start': self._publish_sweep,
+            'sweep': self._publish_sweep,
+            'sweep_stop': self._publish_sweep,
+            'sampling': self._log_sampling,
+            'error': self._publish_error,
+        }, policy='coalesce')
+
+    def _publish(self, frame):
+        if self.publisher is not None:
+            self.publisher.publish(frame)
+
+    def _publish_start(self, src, timestamp):
+        self._publish(encode_start(src, timestamp))
+
+    def _publish_stop(self, src, start_time, last_time, count, summary):
+        self._publish(encode_stop(src, start_time, last_time, count, summary))
+
+    def _publish_updates(self, batch):
+        # 帧中是累计请求数，不是刷新间隔内合并的请求数
+        self._publish(encode_updates([(src, timestamp, total, summary)
+                                      for src, (timestamp, _, total, summary) in batch.items()]))
+
+    def _publish_sweep(self, sweep):
+        self._publish(encode_sweep(sweep))
+
+    def _publish_error(self, message):
+        print(f"错误: {message}", file=sys.stderr)
+        self._publish(encode_error(message))
+
+    def _log_sampling(self, rate, previous, busy=None, lag=None):
+        # 界面通过每秒的统计帧得知当前的采样倍数，这里只打印日志
+        load = f"（收包线程占用 {busy:.0%}，积压 {lag:.2f} 秒）" if rate > previous and busy is not None else ""
+        self.log(f"过载采样: 1/{previous} -> 1/{rate}{load}")
+
+    def snapshot(self):
+        """新界面连接时发送的帧: 正在ping本机的源（扫描中未单独显示的除外）和进行中的扫描"""
+        engine = self.engine
+        records = engine.active_sessions()
+        sweeps = []
+        rollup = engine.rollup
+        if rollup is not None:
+            with rollup.lock:
+                members = rollup.members
+                records = [record for record in records
+                           if record.address not in members
+                           or record.address in members[record.address].reported]
+                sweeps = [sweep.copy() for sweep in rollup.sweeps.values()]
+        sessions = [(record.address, record.start_time, record.last_time, record.count,
+                     record.stats.summary()) for record in records]
+        return [encode_snapshot(sessions)] + [encode_sweep(sweep) for sweep in sweeps]
+
+    def daemon_stats(self):
+        engine = self.engine
+        rejected, received = engine.filter_stats()
+        replies = engine.reply_counts()
+        matched, in_flight = (replies[0], replies[2]) if replies is not None else (None, None)
+        return DaemonStats(received, rejected, engine.kernel_drops(), matched, in_flight,
+                           engine.updates_merged, engine.kernel_filtered(), engine.sketch_threshold,
+                           engine.sketch_summary() if engine.sketch_threshold else None,
+                           engine.sampling_counts())
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(
+        description="ICMP Ping 抓包守护进程，用 gui_icmp_monitor.py --connect 连接查看")
+    add_capture_arguments(parser)
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, metavar='PATH',
+                        help=f"监听的Unix域套接字路径（默认 {DEFAULT_SOCKET_PATH}）")
+    parser.add_argument('--socket-mode', type=functools.partial(int, base=8), default=DEFAULT_SOCKET_MODE,
+                        metavar='MODE', help=f"套接字文件的权限，八进制（默认 {DEFAULT_SOCKET_MODE:o}）")
+    parser.add_argument('--max-client-buffer', type=int, default=DEFAULT_MAX_CLIENT_BUFFER, metavar='BYTES',
+                        help="每个界面待发送数据的上限，超过时断开该界面，界面会自动重连"
+                             f"（默认 {DEFAULT_MAX_CLIENT_BUFFER}）")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    log = functools.partial(print, flush=True)
+    if not hasattr(socket, 'AF_UNIX'):
+        log("错误: 当前系统不支持Unix域套接字")
+        return
+    error = capture_arguments_error(args)
+    if error is not None:
+        log(f"错误: {error}")
+        return
+    engine = CaptureEngine(**engine_options(args))
+    worker = DaemonWorker(engine, log)
+    history = None
+    output = None
+
+    def close_sinks():
+        # 各订阅者处理完队列中的事件后才能关闭会话历史和输出
+        engine.close()
+        if history is not None:
+            history.close()
+        if output is not None:
+            output.close()
+
+    try:
+        if args.db:
+            history = SessionHistory(args.db)
+            engine.add_history(history)
+        if args.jsonl:
+            # 与界面共用一次抓包的 JSON Lines 输出
+            output = EventOutput('jsonl', args.jsonl)
+            engine.add_output(output)
+    except sqlite3.Error as e:
+        log(f"无法打开会话历史数据库 {args.db}: {e}")
+        close_sinks()
+        return
+    except OSError as e:
+        log(f"无法打开事件输出 {args.jsonl}: {e}")
+        close_sinks()
+        return
+    state = StateSnapshots(args.state, args.state_interval) if args.state else None
+    if state is not None:
+        engine.add_state(state)
+    publisher = DeltaPublisher(args.socket, worker.snapshot, worker.daemon_stats, args.socket_mode,
+                               args.max_client_buffer, log)
+    try:
+        publisher.open()
+    except OSError as e:
+        log(f"无法监听 {args.socket}: {e}")
+        close_sinks()
+        return
+    worker.publisher = publisher
+    try:
+        exporters = start_exporters(engine.metrics, args.metrics_port, args.stats_interval)
+    except OSError as e:
+        log(f"无法启动指标服务: {e}")
+        exporters = []
+    if state is not None:
+        if args.warm_start:
+            log(state.warm_start(engine.sources))
+        state.start(engine.sources)
+    log(f"抓包守护进程已启动 (引擎: {engine.engine})，在 {args.socket} 上等待界面连接，按 Ctrl+C 停止")
+
+    def capture():
+        engine.run_reporting_errors()
+        # 抓包出错结束时守护进程随之退出
+        if engine.is_running:
+            publisher.close()
+
+    # 由 systemd 等停止时同样清理套接字文件并保存会话
+    signal.signal(signal.SIGTERM, lambda signum, frame: publisher.close())
+    threading.Thread(target=capture, daemon=True).start()
+    try:
+        publisher.serve()
+    except KeyboardInterrupt:
+        log("\n停止抓包守护进程")
+    finally:
+        engine.stop()
+        for exporter in exporters:
+            exporter.close()
+        if state is not None:
+            if state.close():
+                log(f"源状态快照: 已保存 {state.records} 个源到 {args.state}")
+            else:
+                log(f"无法保存源状态快照 {args.state}: {state.error}")
+        engine.save_active_sessions()
+        close_sinks()
+        if history is not None:
+            log(f"会话历史: 已写入 {history.written} 个会话到 {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,675 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+抓包引擎
+抓包、解析和会话跟踪（源状态表、停止检测、应答配对、网段汇总、估算模式和过载采样）只做一次，
+结果作为事件发布到进程内的事件总线(event_bus.EventBus)；命令行、图形界面和抓包守护进程都只是订阅者，
+终端、JSON Lines、指标和会话历史也各是一个订阅者，增加一个输出不增加抓包和解析的开销
+"""
+
+import asyncio
+import threading
+import time
+
+from raw_capture import RawICMPCapture
+from scapy_backend import ScapyCapture, load_scapy
+from ring_capture import RingCapture
+from fanout_capture import FanoutMonitor
+from async_monitor import AsyncICMPMonitor
+from event_bus import EventBus
+from metrics import MonitorMetrics, SessionCounters, LATENCY_SAMPLE_MASK
+from bpf_filter import EchoRequestFilter, parse_network
+from expiry import DEFAULT_TIMEOUT
+from source_table import SourceTable, DEFAULT_MAX_SOURCES, DEFAULT_IDLE_TIMEOUT
+from source_sketch import SourceSketch, DEFAULT_SKETCH_THRESHOLD
+from subnet_rollup import (SubnetRollup, parse_prefix_range, DEFAULT_SWEEP_THRESHOLD,
+                           DEFAULT_MIN_PREFIX, DEFAULT_MAX_PREFIX)
+from reply_tracker import InFlightIndex, DEFAULT_REPLY_TIMEOUT, DEFAULT_MAX_IN_FLIGHT
+from load_shedder import LoadShedder, parse_sampling, DEFAULT_MAX_SAMPLING, DEFAULT_MAX_LAG
+from state_snapshot import DEFAULT_SNAPSHOT_INTERVAL
+
+# 可选的抓包引擎，Scapy只在选择 scapy 引擎时才导入
+ENGINES = ('scapy', 'raw', 'ring', 'asyncio')
+# 图形界面和抓包守护进程的默认刷新频率（Hz），更新事件按此频率合并发布
+DEFAULT_REFRESH_RATE = 10.0
+
+# 引擎发布的事件类型及其参数:
+#   start(源地址, 时间戳)                                   开始ping，网段汇总时只有需要单独显示的源
+#   stop(源地址, 开始时间, 最后活动时间, 请求数, 统计摘要)     停止ping，同上
+#   session(源地址, 开始时间, 最后活动时间, 请求数, 统计摘要)  每个结束的会话，不受网段汇总影响，用于保存
+#   updates({源地址: (最后时间戳, 间隔内的请求数, 累计请求数, 统计摘要)})
+#                                                         每个更新间隔内有活动的源，只在给定 update_interval 时发布
+#   sweep_start(Sweep) / sweep(Sweep) / sweep_stop(Sweep)  网段扫描开始、有新活动、结束，参数为副本
+#   sampling(新的倍数, 原来的倍数, CPU占用, 积压秒数)         过载采样倍数变化，多进程抓包时后两项为None
+#   error(错误信息)                                        抓包出错
+EVENT_KINDS = ('start', 'stop', 'session', 'updates', 'sweep_start', 'sweep', 'sweep_stop',
+               'sampling', 'error')
+
+
+def sink_handlers(sink, kinds=EVENT_KINDS):
+    """由对象上与事件类型同名的方法得到订阅用的 {事件类型: 回调}"""
+    handlers = {}
+    for kind in kinds:
+        handler = getattr(sink, kind, None)
+        if callable(handler):
+            handlers[kind] = handler
+    return handlers
+
+
+def merge_updates(earlier, later):
+    """合并两个 'updates' 事件的参数: 同一个源取较晚的状态，间隔内的请求数相加"""
+    merged = dict(earlier)
+    for src, (timestamp, count, total, summary) in later.items():
+        previous = merged.get(src)
+        if previous is not None:
+            count += previous[1]
+        merged[src] = (timestamp, count, total, summary)
+    return merged
+
+
+def capture_error_message(error):
+    """抓包无法开始或中途出错时显示给用户的说明"""
+    if isinstance(error, PermissionError):
+        return "权限错误：需要管理员权限来捕获数据包，请以管理员身份运行此程序"
+    if "winpcap is not installed" in str(error):
+        return "需要安装npcap或winpcap来捕获数据包，请访问https://nmap.org/npcap/下载安装"
+    return f"发生错误: {error}"
+
+
+class CaptureEngine:
+    """抓包和会话跟踪，事件发布到 bus
+
+    run() 在调用线程中抓包，直到 stop() 或 Ctrl+C，停止后可以再次调用。scapy/raw/ring 引擎另有检查线程
+    按截止时间检测停止，asyncio 引擎在事件循环中调度，workers 大于1时由 PACKET_FANOUT 工作进程各自检测。
+    给定 update_interval 且有订阅者订阅 'updates' 时，每个间隔把有活动的源合并为一个 'updates' 事件。
+    """
+
+    def __init__(self, engine='scapy', echo_filter=None, timeout=DEFAULT_TIMEOUT,
+                 max_sources=DEFAULT_MAX_SOURCES, idle_timeout=DEFAULT_IDLE_TIMEOUT, workers=1,
+                 update_interval=None, sweep_threshold=DEFAULT_SWEEP_THRESHOLD,
+                 sweep_prefixes=(DEFAULT_MIN_PREFIX, DEFAULT_MAX_PREFIX),
+                 sketch_threshold=DEFAULT_SKETCH_THRESHOLD, replies=False,
+                 reply_timeout=DEFAULT_REPLY_TIMEOUT, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 max_sampling=DEFAULT_MAX_SAMPLING, max_lag=DEFAULT_MAX_LAG, bus=None):
+        # 抓包引擎: scapy、raw(原始套接字快速路径)、ring(TPACKET_V3环形缓冲区) 或 asyncio
+        self.engine = engine
+        # 大于1时启动多个 PACKET_FANOUT 工作进程分片抓包（ring引擎）
+        self.workers = workers
+        # 内核过滤配置(bpf_filter.EchoRequestFilter)，为None时只按"icmp"过滤
+        self.echo_filter = echo_filter
+        # 抓包器，各引擎共用；多进程抓包时为 FanoutMonitor
+        self.capture = None
+        # 事件总线，同类型相邻的 'updates' 事件可以合并
+        self.bus = bus if bus is not None else EventBus()
+        self.bus.coalesce('updates', merge_updates)
+        self.publish = self.bus.publish
+        # 过载时按源地址哈希采样(load_shedder.LoadShedder)的最大倍数，1为不采样
+        self.max_sampling = max_sampling
+        self.max_lag = max_lag
+        shedder = None
+        if max_sampling > 1:
+            shedder = LoadShedder(max_sampling, max_lag, self._on_sampling)
+        # 存储每个IP的ping信息，限制最大条目数并淘汰长时间空闲的源，
+        # 同时按超时截止时间跟踪活跃状态，用于检测ping是否停止
+        self.sources = SourceTable(max_sources, idle_timeout, timeout,
+                                   SourceSketch(sketch_threshold) if sketch_threshold else None,
+                                   shedder)
+        # 活跃源达到该数量后切换到估算模式(source_sketch.SourceSketch)，0为不切换
+        self.sketch_threshold = sketch_threshold
+        # 在途请求索引(reply_tracker.InFlightIndex)，为None时不配对应答
+        self.replies = InFlightIndex(reply_timeout, max_in_flight) if replies else None
+        self.reply_timeout = reply_timeout
+        self.max_in_flight = max_in_flight
+        # 网段汇总(subnet_rollup.SubnetRollup)，同一网段内同时活跃的源达到阈值时合并为一次扫描
+        self.rollup = None
+        if sweep_threshold:
+            self.rollup = SubnetRollup(self._publish_start, self._publish_stop, self._publish_sweep_start,
+                                       self._publish_sweep_stop, sweep_threshold, *sweep_prefixes)
+        # 合并更新的间隔（秒），为None时不发布 'updates' 事件
+        self.update_interval = update_interval
+        self._updates = False
+        self._pending = {}  # 源地址 -> [最后时间戳, 请求数]
+        self._pending_lock = threading.Lock()
+        self.updates_merged = 0
+        # 会话历史(session_history.SessionHistory)、源状态快照(state_snapshot.StateSnapshots)
+        # 和事件输出(event_output.EventOutput)，由 add_history()/add_state()/add_output() 添加
+        self.history = None
+        self.state = None
+        self.outputs = []
+        # asyncio引擎的监控器及其事件循环，用于从其他线程停止
+        self.async_monitor = None
+        self._loop = None
+        self.is_running = False
+        # 本次 run() 结束时设置，检查线程随之退出
+        self._stopped = threading.Event()
+        # 时间戳是否为实时收包的时间，回放时为False，不记录积压
+        self.live = True
+        # 运行指标，处理耗时和检查耗时常驻记录；结束的会话数和会话时长由订阅者统计
+        self.metrics = MonitorMetrics()
+        self.register_metrics()
+        self.counters = SessionCounters(self.metrics)
+        self.bus.subscribe('metrics', sink_handlers(self.counters))
+
+    def register_metrics(self):
+        """注册通过回调读取的计数器和仪表值"""
+        add = self.metrics.add
+        add('icmp_monitor_packets_seen_total', 'counter', "送达处理函数的包数", self.packets_seen)
+        add('icmp_monitor_filter_rejected_total', 'counter', "内核过滤丢弃的ICMP包数（估算）",
+            lambda: self.filter_stats()[0])
+        add('icmp_monitor_kernel_drops_total', 'counter', "环形缓冲区溢出导致的内核丢包数",
+            self.kernel_drops)
+        add('icmp_monitor_sources_active', 'gauge', "正在ping本机的源数量",
+            lambda: self.source_counts()[0])
+        add('icmp_monitor_sources', 'gauge', "记录中的源数量", lambda: self.source_counts()[1])
+        add('icmp_monitor_sources_evicted_total', 'counter', "因超出容量被淘汰的源记录数",
+            lambda: self.sources.evicted)
+        add('icmp_monitor_queue_depth', 'gauge', "抓包与各输出之间尚未处理的事件数", self.queue_depth)
+        add('icmp_monitor_events_dropped_total', 'counter', "因订阅者队列已满而丢弃的事件数",
+            lambda: self.bus.dropped)
+        add('icmp_monitor_events_coalesced_total', 'counter', "订阅者跟不上时合并到前一批的更新事件数",
+            lambda: self.bus.coalesced)
+        add('icmp_monitor_output_dropped_total', 'counter', "因输出目标不可用而丢弃的事件数",
+            lambda: sum(output.dropped for output in self.outputs) if self.outputs else None)
+        if self.sketch_threshold:
+            add('icmp_monitor_sketch_active', 'gauge', "是否处于估算模式",
+                lambda: int(self.sketch_summary()[0]))
+            add('icmp_monitor_sources_estimated', 'gauge', "估算模式下最近一个窗口内的不同源数量",
+                lambda: self.sketch_summary()[1])
+        if self.max_sampling > 1:
+            add('icmp_monitor_sampling_rate', 'gauge', "过载采样倍数N，只跟踪1/N的新源，1为全量处理",
+                lambda: self.sampling_counts()[0])
+            add('icmp_monitor_packets_shed_total', 'counter', "因过载采样未处理的请求数",
+                lambda: self.sampling_counts()[1])
+            add('icmp_monitor_sources_active_estimated', 'gauge', "按采样倍数放大后的活跃源数量估计",
+                lambda: self.sampling_counts()[2])
+        if self.replies is not None:
+            add('icmp_monitor_replies_matched_total', 'counter', "与请求配对成功的Echo应答数",
+                lambda: self.reply_counts()[0])
+            add('icmp_monitor_replies_unmatched_total', 'counter', "找不到对应请求或超时的Echo应答数",
+                lambda: self.reply_counts()[1])
+            add('icmp_monitor_requests_in_flight', 'gauge', "等待应答的请求数",
+                lambda: self.reply_counts()[2])
+            add('icmp_monitor_requests_unanswered_total', 'counter',
+                "超时或因在途索引已满而不再等待应答的请求数",
+                lambda: sum(self.reply_counts()[3:]))
+        if self.rollup is not None:
+            add('icmp_monitor_sweeps_active', 'gauge', "进行中的网段扫描数",
+                lambda: len(self.rollup.sweeps))
+            add('icmp_monitor_sweeps_total', 'counter', "发现的网段扫描数",
+                lambda: self.rollup.sweeps_started)
+            add('icmp_monitor_events_suppressed_total', 'counter', "汇总到扫描中而未单独输出的事件数",
+                lambda: self.rollup.suppressed)
+
+    def add_output(self, output, name='output', handlers=None):
+        """订阅事件并写到 output(event_output.EventOutput)，返回 Subscription
+
+        handlers 中的回调替换或补充 output 的同名方法，与事件在同一个分发线程中按顺序调用。
+        订阅策略为 block，事件不会因为队列满而丢失。
+        """
+        self.outputs.append(output)
+        output_handlers = sink_handlers(output)
+        if handlers:
+            output_handlers.update(handlers)
+        return self.bus.subscribe(name, output_handlers, policy='block')
+
+    def add_history(self, history):
+        """把结束的会话写入 history(session_history.SessionHistory)，订阅策略为 block"""
+        self.history = history
+        self.bus.subscribe('history', {'session': history.record}, policy='block')
+        add = self.metrics.add
+        add('icmp_monitor_history_written_total', 'counter', "写入会话历史数据库的会话数",
+            lambda: history.written)
+        add('icmp_monitor_history_dropped_total', 'counter', "因写入跟不上或写入失败而丢弃的会话数",
+            lambda: history.dropped)
+
+    def add_state(self, state):
+        """启用源状态快照(state_snapshot.StateSnapshots)，只注册指标，保存由 state 自己的线程完成"""
+        self.state = state
+        add = self.metrics.add
+        add('icmp_monitor_snapshots_written_total', 'counter', "保存源状态快照的次数",
+            lambda: state.written)
+        add('icmp_monitor_snapshot_seconds', 'gauge', "最近一次保存源状态快照的耗时",
+            lambda: state.duration)
+
+    def packets_seen(self):
+        """送达处理函数的包数"""
+        return self.capture.packets_seen if self.capture is not None else 0
+
+    def fanout(self):
+        """是否为多进程抓包"""
+        return isinstance(self.capture, FanoutMonitor)
+
+    def reply_counts(self):
+        """返回应答配对的 (配对成功数, 未配对应答数, 在途请求数, 超时请求数, 因容量淘汰的请求数)，未启用时返回None"""
+        if self.replies is None:
+            return None
+        if self.fanout():
+            return self.capture.reply_counts()
+        replies = self.replies
+        return replies.matched, replies.unmatched, len(replies), replies.expired, replies.overflowed
+
+    def sampling_counts(self):
+        """返回过载采样的 (当前采样倍数, 未处理的请求数, 放大后的活跃源数估计)，未启用时返回None"""
+        if self.max_sampling <= 1:
+            return None
+        if self.fanout():
+            return self.capture.sampling_counts()
+        sources = self.sources
+        shed = sources.shedder.shed if sources.shedder is not None else 0
+        return sources.sampling_rate, shed, sources.estimated_active
+
+    def source_counts(self):
+        """返回 (活跃源数, 记录数)"""
+        if self.fanout():
+            return self.capture.active_count, len(self.capture)
+        return self.sources.active_count, len(self.sources)
+
+    def sketch_summary(self, now=None):
+        """估算模式的 (是否处于估算模式, 不同源估计值, 请求最多的源)，未启用时返回None"""
+        if now is None:
+            now = time.time()
+        if self.fanout():
+            return self.capture.sketch_summary(now)
+        return self.sources.sketch_summary(now)
+
+    def queue_depth(self):
+        """各订阅者尚未处理的事件数，加上尚未发布的合并更新和引擎内部队列中的事件"""
+        depth = self.bus.depth() + len(self._pending)
+        if self.async_monitor is not None:
+            depth += self.async_monitor.pending_events()
+        elif self.fanout():
+            depth += self.capture.queue_depth() or 0
+        return depth
+
+    def filter_stats(self):
+        """返回 (内核过滤丢弃数, 送达处理函数的包数)，丢弃数未知时为None"""
+        received = self.packets_seen()
+        if self.echo_filter is None:
+            return None, received
+        return self.echo_filter.rejected_count(received), received
+
+    def kernel_filtered(self):
+        """是否启用了内核过滤"""
+        return self.echo_filter is not None
+
+    def kernel_drops(self):
+        """返回环形缓冲区溢出导致的内核丢包数，引擎不支持时为None"""
+        stats = self.capture.kernel_stats() if self.capture is not None else None
+        return stats[1] if stats else None
+
+    def handle_echo(self, src, timestamp, ident=0, seq=0, size=0):
+        """记录一次来自 src(32位整数地址) 的Echo请求，各抓包引擎共用"""
+        metrics = self.metrics
+        handled = metrics.handled = metrics.handled + 1
+        timed = not handled & LATENCY_SAMPLE_MASK
+        if timed:
+            started = time.perf_counter()
+        record, started = self.sources.touch(src, timestamp)
+        # 估算模式下没有记录的源只计入估算，record 为None
+        if record is not None:
+            record.stats.update(timestamp, ident, seq, size)
+            if self.replies is not None:
+                self.replies.add(src, ident, seq, timestamp, record.stats)
+            # 新的源，或停止后重新开始ping的源
+            if started:
+                self.report_start(src, timestamp)
+            else:
+                if self._updates:
+                    # 更新最后活动时间，先合并到待发布的批次中
+                    with self._pending_lock:
+                        entry = self._pending.get(src)
+                        if entry is None:
+                            self._pending[src] = [timestamp, 1]
+                        else:
+                            entry[0] = timestamp
+                            entry[1] += 1
+        if timed:
+            metrics.handler_latency.observe(time.perf_counter() - started)
+            if self.live:
+                metrics.capture_lag.observe(self.sources.record_lag(timestamp, time.time()))
+
+    def handle_reply(self, dst, timestamp, ident=0, seq=0):
+        """本机向 dst 发出了Echo应答，与在途的请求配对"""
+        self.replies.match(dst, ident, seq, timestamp)
+
+    def reply_handler(self):
+        """传给抓包器的应答回调，未启用应答配对时为None"""
+        return self.handle_reply if self.replies is not None else None
+
+    def report_start(self, src, timestamp):
+        """发布开始事件，启用网段汇总时可能合并到扫描中"""
+        if self.rollup is not None:
+            self.rollup.start(src, timestamp)
+        else:
+            self.publish('start', src, timestamp)
+
+    def report_stop(self, src, start_time, last_time, count, summary):
+        """发布会话和停止事件，启用网段汇总时停止事件可能合并到扫描中，会话事件不受影响"""
+        self.publish('session', src, start_time, last_time, count, summary)
+        if self.rollup is not None:
+            self.rollup.stop(src, start_time, last_time, count, summary)
+        else:
+            self.publish('stop', src, start_time, last_time, count, summary)
+
+    def _report_fanout_stop(self, src, last_time, count, summary, start_time):
+        # FanoutMonitor 的停止事件参数顺序不同
+        self.report_stop(src, start_time, last_time, count, summary)
+
+    def _publish_start(self, src, timestamp):
+        self.publish('start', src, timestamp)
+
+    def _publish_stop(self, src, start_time, last_time, count, summary):
+        self.publish('stop', src, start_time, last_time, count, summary)
+
+    def _publish_sweep_start(self, sweep):
+        # 在汇总器的锁内调用，订阅者在其他线程中读取，发布副本
+        self.publish('sweep_start', sweep.copy())
+
+    def _publish_sweep_stop(self, sweep):
+        self.publish('sweep_stop', sweep.copy())
+
+    def _on_sampling(self, rate, previous, busy=None, lag=None):
+        self.publish('sampling', rate, previous, busy, lag)
+
+    def save_active_sessions(self):
+        """退出时把仍在ping的源作为会话发布，写入会话历史
+
+        多进程抓包时这些记录在工作进程中，不发布；启用状态快照时这些会话保存在快照中，热启动后在真正结束时才发布。
+        """
+        if self.history is None or self.state is not None or self.fanout():
+            return
+        for record in self.sources.records():
+            if record.deadline is not None:
+                self.publish('session', record.address, record.start_time, record.last_time,
+                             record.count, record.stats.summary())
+
+    def active_sessions(self):
+        """正在ping本机的源的记录(source_table.SourceRecord)列表"""
+        return [record for record in self.sources.records() if record.deadline is not None]
+
+    def flush_updates(self):
+        """把合并间隔内有活动的源发布为一个 'updates' 事件，扫描中的源合并为扫描的一次 'sweep' 事件"""
+        with self._pending_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+        batch = {}
+        sweeps = {}
+        requests = 0
+        for src, (timestamp, count) in pending.items():
+            requests += count
+            sweep = self.rollup.sweep_of(src) if self.rollup is not None else None
+            if sweep is not None:
+                sweeps[sweep.id] = sweep
+                continue
+            record = self.sources.get(src)
+            if record is None:
+                batch[src] = (timestamp, count, count, None)
+            else:
+                batch[src] = (timestamp, count, record.count, record.stats.summary())
+        self.updates_merged += requests - len(batch) - len(sweeps)
+        if batch:
+            self.publish('updates', batch)
+        self.publish_sweeps(sweeps)
+
+    def publish_sweeps(self, sweeps):
+        """把有新活动的扫描各发布一次副本，sweeps 为 {扫描ID: Sweep}"""
+        if not sweeps:
+            return
+        with self.rollup.lock:
+            snapshots = [sweep.copy() for sweep in sweeps.values() if not sweep.ended]
+        for snapshot in snapshots:
+            self.publish('sweep', snapshot)
+
+    def check_inactive_ips(self, now=None):
+        """检查不活跃的IP并发布停止事件，now 默认为当前时间，回放时为包时间"""
+        # 先发布待发布的更新，保证停止事件排在其后
+        self.flush_updates()
+        if now is None:
+            now = time.time()
+        started = time.perf_counter()
+        # 只取出超时没有活动的IP
+        for record in self.sources.expire(now):
+            self.report_stop(record.address, record.start_time, record.last_time, record.count,
+                             record.stats.summary())
+        # 淘汰长时间空闲的源记录，限制内存占用
+        self.sources.evict_idle(now)
+        self.metrics.expiry_tick.observe(time.perf_counter() - started)
+
+    def run(self):
+        """在当前线程抓包，直到 stop()；抓包出错和 KeyboardInterrupt 原样抛出"""
+        self.is_running = True
+        self._stopped = stopped = threading.Event()
+        # 没有人订阅 'updates' 时收包热路径不合并更新
+        self._updates = self.update_interval is not None and self.bus.wants('updates')
+        try:
+            if self.workers > 1:
+                self._run_fanout()
+                return
+            if self.engine == 'asyncio':
+                # 事件循环内收包、合并更新并按截止时间检测停止，不需要检查线程；
+                # 每次运行使用新的事件循环，相当于 Python 3.7 的 asyncio.run()
+                loop = asyncio.new_event_loop()
+                task = loop.create_task(self._run_async())
+                try:
+                    loop.run_until_complete(task)
+                finally:
+                    # Ctrl+C 时协程停在中途，先取消并等它关闭监控器，再关闭事件循环
+                    if not task.done():
+                        task.cancel()
+                        try:
+                            loop.run_until_complete(task)
+                        except asyncio.CancelledError:
+                            pass
+                    loop.close()
+                return
+
+            # 在后台线程中按截止时间检查不活跃的IP
+            threading.Thread(target=self._check_loop, args=(stopped,), daemon=True).start()
+            if self.engine == 'raw':
+                # 原始套接字快速路径，不经过Scapy解析
+                self.capture = RawICMPCapture(echo_filter=self.echo_filter)
+            elif self.engine == 'ring':
+                # TPACKET_V3环形缓冲区，按块批量处理
+                self.capture = RingCapture(echo_filter=self.echo_filter)
+            else:
+                # 此时才导入Scapy，停止后在下一个包到达时退出
+                self.capture = ScapyCapture(echo_filter=self.echo_filter)
+            self.capture.run(self.handle_echo, lambda: self.is_running, self.reply_handler())
+        finally:
+            stopped.set()
+
+    def run_reporting_errors(self):
+        """运行 run()，无法开始抓包或抓包出错时发布 'error' 事件而不是抛出，图形界面和抓包守护进程使用"""
+        if self.engine == 'scapy' and self.workers <= 1 and load_scapy() is None:
+            self.publish('error', "Scapy库不可用，请安装Scapy库")
+            return
+        try:
+            self.run()
+        except Exception as e:
+            self.publish('error', capture_error_message(e))
+
+    def _run_fanout(self):
+        """多进程抓包: 各工作进程自行检测不活跃的源，这里只把事件交给网段汇总并发布"""
+        if self.echo_filter is not None:
+            self.echo_filter.start_counting()
+        self.capture = FanoutMonitor(self.workers, echo_filter=self.echo_filter,
+                                     timeout=self.sources.expiry.timeout,
+                                     max_sources=self.sources.max_size,
+                                     idle_timeout=self.sources.idle_timeout,
+                                     metrics=self.metrics,
+                                     sketch_threshold=self.sketch_threshold,
+                                     replies=self.replies is not None,
+                                     reply_timeout=self.reply_timeout,
+                                     max_in_flight=self.max_in_flight,
+                                     max_sampling=self.max_sampling,
+                                     max_lag=self.max_lag,
+                                     on_sampling=self._on_sampling)
+        try:
+            self.capture.run(self.report_start, self._report_fanout_stop)
+        finally:
+            for error in self.capture.errors:
+                self.publish('error', f"发生错误: {error}")
+
+    async def _run_async(self):
+        """asyncio引擎: 把 AsyncICMPMonitor 的事件交给网段汇总并发布"""
+        monitor = AsyncICMPMonitor(echo_filter=self.echo_filter,
+                                   update_interval=self.update_interval if self._updates else None,
+                                   metrics=self.metrics, replies=self.replies, sources=self.sources)
+        self.capture = monitor.capture
+        batch = {}
+        sweeps = {}
+        async with monitor:
+            self.async_monitor = monitor
+            self._loop = monitor.loop
+            if not self.is_running:
+                monitor.close()
+            async for event in monitor:
+                if event.kind == 'update':
+                    # 同一次合并产生的更新事件连续入队，取完后作为一个批次发布
+                    sweep = self.rollup.sweep_of(event.address) if self.rollup is not None else None
+                    if sweep is not None:
+                        sweeps[sweep.id] = sweep
+                    else:
+                        batch[event.address] = (event.timestamp, 1, event.count, event.summary)
+                    if monitor.pending_events():
+                        continue
+                if batch:
+                    self.publish('updates', batch)
+                    batch = {}
+                if sweeps:
+                    self.publish_sweeps(sweeps)
+                    sweeps = {}
+                if event.kind == 'start':
+                    self.report_start(event.address, event.timestamp)
+                elif event.kind == 'stop':
+                    self.report_stop(event.address, event.start_time, event.timestamp, event.count,
+                                     event.summary)
+        self._loop = None
+
+    def _check_loop(self, stopped):
+        """按合并间隔发布更新，并在源超时时检查不活跃IP的循环，本次 run() 结束时退出"""
+        never = float('inf')
+        interval = self.update_interval if self._updates else None
+        next_flush = time.time() + interval if interval else never
+        while True:
+            now = time.time()
+            if stopped.wait(max(0.0, min(self.sources.wait_time(now), next_flush - now))):
+                return
+            now = time.time()
+            if now >= next_flush:
+                next_flush = now + interval
+                self.flush_updates()
+            self.check_inactive_ips(now)
+
+    def stop(self):
+        """停止抓包，可以在其他线程中调用；scapy/raw/ring 引擎在下一个包到达时退出"""
+        self.is_running = False
+        self._stopped.set()
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self.async_monitor.close)
+            except RuntimeError:
+                # 事件循环已经结束
+                pass
+        if self.fanout():
+            self.capture.stop()
+
+    def close(self):
+        """处理完已发布的事件后结束所有订阅者，之后才能关闭各输出和会话历史"""
+        self.bus.close()
+
+
+def add_capture_arguments(parser, refresh=True):
+    """添加抓包、会话检测和各输出的参数，命令行、图形界面和抓包守护进程共用
+
+    refresh 为False时不添加 --refresh-rate，命令行前端不合并更新。
+    """
+    parser.add_argument('--engine', choices=ENGINES, default='scapy',
+                        help="抓包引擎: scapy(默认)、raw(原始套接字快速路径，不依赖Scapy)、"
+                             "ring(Linux TPACKET_V3环形缓冲区，报告内核丢包数) "
+                             "或 asyncio(原始套接字注册到事件循环，按截止时间精确检测停止)")
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help="启动N个工作进程，通过 PACKET_FANOUT 按源地址分片抓包（Linux，隐含 --engine ring）")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help=f"超过多少秒没有收到请求视为停止ping（默认 {DEFAULT_TIMEOUT:g}）")
+    parser.add_argument('--max-sources', type=int, default=DEFAULT_MAX_SOURCES,
+                        help=f"最多记录的源IP数量，超出时淘汰最久未活动的（默认 {DEFAULT_MAX_SOURCES}，0为不限制）")
+    parser.add_argument('--idle-evict', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help=f"源IP空闲多少秒后删除其记录（默认 {DEFAULT_IDLE_TIMEOUT}）")
+    if refresh:
+        parser.add_argument('--refresh-rate', type=float, default=DEFAULT_REFRESH_RATE,
+                            help=f"界面刷新频率(Hz)，期间的更新合并为一批发送（默认 {DEFAULT_REFRESH_RATE:g}）")
+    parser.add_argument('--sweep-threshold', type=int, default=DEFAULT_SWEEP_THRESHOLD, metavar='N',
+                        help="同一网段内同时ping本机的源达到N个时合并为一次扫描，只显示扫描开始/结束"
+                             "（默认0，不合并）")
+    parser.add_argument('--sweep-prefixes', type=parse_prefix_range,
+                        default=(DEFAULT_MIN_PREFIX, DEFAULT_MAX_PREFIX), metavar='MIN-MAX',
+                        help=f"参与合并的网段前缀长度范围（默认 {DEFAULT_MIN_PREFIX}-{DEFAULT_MAX_PREFIX}），"
+                             "扫描显示为包含其全部源的最小网段")
+    parser.add_argument('--sketch-threshold', type=int, default=DEFAULT_SKETCH_THRESHOLD, metavar='N',
+                        help="活跃源达到N个时切换到估算模式: 新的源不再逐个记录，改用固定内存的 "
+                             "Count-Min Sketch/HyperLogLog 统计请求最多的源和不同源数量（默认0，不切换）")
+    parser.add_argument('--replies', action='store_true',
+                        help="把本机发出的Echo应答与请求配对，统计每个源的应答延迟和未应答比例"
+                             "（需要能看到出站包的 ring/scapy 引擎或抓包文件；原始套接字只能看到回环接口上的应答）")
+    parser.add_argument('--reply-timeout', type=float, default=DEFAULT_REPLY_TIMEOUT, metavar='SECONDS',
+                        help=f"请求等待应答的最长时间，超过后计为未应答（默认 {DEFAULT_REPLY_TIMEOUT:g}，"
+                             "应不大于 --timeout）")
+    parser.add_argument('--max-in-flight', type=int, default=DEFAULT_MAX_IN_FLIGHT, metavar='N',
+                        help=f"最多同时等待应答的请求数，超出时放弃最旧的请求（默认 {DEFAULT_MAX_IN_FLIGHT}）")
+    parser.add_argument('--max-sampling', type=parse_sampling, default=DEFAULT_MAX_SAMPLING, metavar='N',
+                        help="处理跟不上时按源地址哈希采样，只显示1/N的新源，负载回落后恢复全量处理；"
+                             "N为2的幂，是允许的最大采样倍数（默认1，不采样）")
+    parser.add_argument('--max-lag', type=float, default=DEFAULT_MAX_LAG, metavar='SECONDS',
+                        help=f"包从到达到被处理的积压超过多少秒时提高采样倍数（默认 {DEFAULT_MAX_LAG:g}）")
+    parser.add_argument('--db', metavar='PATH',
+                        help="把每次ping会话（源、开始/结束时间、请求数和统计）写入SQLite数据库，"
+                             "由后台线程批量写入，可以用 icmp_monitor.py --history 查询")
+    parser.add_argument('--state', metavar='PATH',
+                        help="定期把源状态表原子地保存到快照文件，退出时再保存一次；仍在ping的会话留在快照中，"
+                             "不在退出时写入 --db")
+    parser.add_argument('--state-interval', type=float, default=DEFAULT_SNAPSHOT_INTERVAL, metavar='SECONDS',
+                        help=f"保存快照的间隔（默认 {DEFAULT_SNAPSHOT_INTERVAL:g}）")
+    parser.add_argument('--warm-start', action='store_true',
+                        help="启动时从 --state 的快照恢复源状态表: 超时时间内仍在ping的源继续原来的会话，"
+                             "不再显示为新的ping；停机期间已经停止的源照常报告停止")
+    parser.add_argument('--jsonl', metavar='TARGET',
+                        help="同时把事件以 JSON Lines 写到文件或 unix:套接字路径，与其他输出共用一次抓包，"
+                             "不增加抓包开销")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="在 127.0.0.1:PORT/metrics 以 Prometheus 文本格式提供运行指标")
+    parser.add_argument('--stats-interval', type=float, metavar='SECONDS',
+                        help="每隔多少秒在标准错误输出一行运行指标摘要")
+    parser.add_argument('--kernel-filter', action='store_true',
+                        help="在内核中只放行发往本机地址（启动时的全部地址，包括从地址和别名）的Echo请求，"
+                             "其余ICMP包直接丢弃")
+    parser.add_argument('--iface', help="只监控指定网卡（隐含 --kernel-filter）")
+    parser.add_argument('--src-net', action='append', default=[], type=parse_network, metavar='CIDR',
+                        help="只接收来自该网段的请求，可重复指定（隐含 --kernel-filter）")
+
+
+def capture_arguments_error(args):
+    """检查 add_capture_arguments() 的参数组合，返回错误信息，没有问题时返回None"""
+    if args.warm_start and not args.state:
+        return "--warm-start 需要同时指定 --state"
+    if args.state and args.workers > 1:
+        return "--state 不能与 --workers 同时使用"
+    return None
+
+
+def engine_options(args):
+    """由 add_capture_arguments() 的参数得到 CaptureEngine 的参数"""
+    echo_filter = None
+    if args.kernel_filter or args.iface or args.src_net:
+        echo_filter = EchoRequestFilter(interface=args.iface, src_cidrs=args.src_net)
+    refresh_rate = getattr(args, 'refresh_rate', None)
+    return dict(engine='ring' if args.workers > 1 else args.engine, workers=args.workers,
+                echo_filter=echo_filter, timeout=args.timeout, max_sources=args.max_sources,
+                idle_timeout=args.idle_evict,
+                update_interval=1.0 / refresh_rate if refresh_rate else None,
+                sweep_threshold=args.sweep_threshold, sweep_prefixes=args.sweep_prefixes,
+                sketch_threshold=args.sketch_threshold, replies=args.replies,
+                reply_timeout=args.reply_timeout, max_in_flight=args.max_in_flight,
+                max_sampling=args.max_sampling, max_lag=args.max_lag)
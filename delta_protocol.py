@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+抓包守护进程与界面之间的二进制增量协议
+每帧为 1字节类型 + 4字节长度（网络字节序）+ 内容，地址为32位整数，时间戳为双精度秒，统计摘要为单精度。
+连接后守护进程先发送 HELLO、正在ping本机的源的快照和进行中的扫描，之后只发送变化；
+各帧都是覆盖式的状态更新，重复收到同一个源的 START 或 UPDATE 不会出错
+"""
+
+import math
+import struct
+from collections import namedtuple
+
+from subnet_rollup import Sweep
+
+MAGIC = b'ICMD'
+PROTOCOL_VERSION = 2
+# 默认的Unix域套接字路径
+DEFAULT_SOCKET_PATH = '/tmp/icmp_monitor.sock'
+
+# 帧类型
+FRAME_HELLO = 0  # 协议版本和守护进程的启动时间，每次连接的第一帧
+FRAME_START = 1  # 源开始ping本机
+FRAME_UPDATE = 2  # 一个刷新间隔内合并的更新，可包含多个源
+FRAME_STOP = 3  # 源停止ping本机
+FRAME_SWEEP = 4  # 网段扫描的快照
+FRAME_STATS = 5  # 抓包统计，每秒一次
+FRAME_ERROR = 6  # 守护进程的错误信息(UTF-8)
+FRAME_SNAPSHOT = 7  # 连接时正在ping本机的全部源
+
+# 单帧内容的上限，超过时认为数据流已损坏
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+_HEADER = struct.Struct('!BI')
+_HELLO = struct.Struct('!4sBd')
+_START = struct.Struct('!Id')
+# 统计摘要: 速率, 间隔P50/P95/P99(毫秒), 载荷P50(字节), 序号缺失, 乱序, 应答P50/P95(毫秒), 未应答比例
+_SUMMARY_FORMAT = 'ffffiIIfff'
+_UPDATE = struct.Struct('!IdI' + _SUMMARY_FORMAT)
+# 地址, 开始时间, 最后时间戳, 累计请求数, 统计摘要；用于 STOP 和 SNAPSHOT
+_SESSION = struct.Struct('!IddI' + _SUMMARY_FORMAT)
+_SWEEP = struct.Struct('!IIBddIIIQ?')
+# 最后三项为过载采样的倍数（0为未启用）、未处理的请求数和放大后的活跃源数，之后是估算模式的 top-k 条目
+_STATS = struct.Struct('!qqqqqq?I?qHIqq')
+_TOP_ENTRY = struct.Struct('!IQ')
+
+_NAN = float('nan')
+
+
+class DaemonStats(namedtuple('DaemonStats', 'received rejected kernel_drops replies_matched '
+                                            'in_flight updates_merged filtered sketch_threshold '
+                                            'sketch sampling')):
+    """守护进程的抓包统计
+
+    rejected 为内核过滤丢弃数，kernel_drops 为环形缓冲区丢包数，未知时为None；
+    replies_matched/in_flight 在未启用应答配对时为None；filtered 为是否启用了内核过滤；
+    sketch 为 source_sketch.SourceSketch.summary() 的结果，sketch_threshold 为0（未启用估算模式）时为None；
+    sampling 为过载采样的 (当前采样倍数, 未处理的请求数, 放大后的活跃源数估计)，未启用时为None。
+    """
+    __slots__ = ()
+
+
+def _optional(value):
+    return -1 if value is None else value
+
+
+def _float(value):
+    return _NAN if value is None else value
+
+
+def _value(value):
+    return None if math.isnan(value) else value
+
+
+def _pack_summary(summary):
+    """把 SourceStats.summary() 展开为 _SUMMARY_FORMAT 的各项，None 用 NaN 或 -1 表示"""
+    if summary is None:
+        return (_NAN, _NAN, _NAN, _NAN, -1, 0, 0, _NAN, _NAN, _NAN)
+    rate, p50, p95, p99, size_p50, gaps, reorders, reply_p50, reply_p95, unanswered = summary
+    return (rate, _float(p50), _float(p95), _float(p99), _optional(size_p50), gaps, reorders,
+            _float(reply_p50), _float(reply_p95), _float(unanswered))
+
+
+def _unpack_summary(values):
+    if math.isnan(values[0]):
+        return None
+    rate, p50, p95, p99, size_p50, gaps, reorders, reply_p50, reply_p95, unanswered = values
+    return (rate, _value(p50), _value(p95), _value(p99), None if size_p50 < 0 else size_p50,
+            gaps, reorders, _value(reply_p50), _value(reply_p95), _value(unanswered))
+
+
+def _frame(kind, payload):
+    return _HEADER.pack(kind, len(payload)) + payload
+
+
+def encode_hello(started):
+    return _frame(FRAME_HELLO, _HELLO.pack(MAGIC, PROTOCOL_VERSION, started))
+
+
+def encode_start(address, timestamp):
+    return _frame(FRAME_START, _START.pack(address, timestamp))
+
+
+def encode_updates(updates):
+    """updates 为 [(地址, 最后时间戳, 累计请求数, 统计摘要), ...]，编码为一帧"""
+    pack = _UPDATE.pack
+    payload = b''.join(pack(address, timestamp, count, *_pack_summary(summary))
+                       for address, timestamp, count, summary in updates)
+    return _frame(FRAME_UPDATE, payload)
+
+
+def encode_stop(address, start_time, last_time, count, summary):
+    return _frame(FRAME_STOP, _SESSION.pack(address, start_time, last_time, count,
+                                            *_pack_summary(summary)))
+
+
+def encode_snapshot(sessions):
+    """sessions 为 [(地址, 开始时间, 最后时间戳, 累计请求数, 统计摘要), ...]，编码为一帧"""
+    pack = _SESSION.pack
+    payload = b''.join(pack(address, start_time, last_time, count, *_pack_summary(summary))
+                       for address, start_time, last_time, count, summary in sessions)
+    return _frame(FRAME_SNAPSHOT, payload)
+
+
+def encode_sweep(sweep):
+    """sweep 为 subnet_rollup.Sweep 的快照"""
+    return _frame(FRAME_SWEEP, _SWEEP.pack(sweep.id, sweep.network, sweep.length, sweep.start_time,
+                                           sweep.last_time, sweep.active, sweep.hosts, sweep.peak,
+                                           sweep.requests, sweep.ended))
+
+
+def encode_stats(stats):
+    sketch = stats.sketch
+    if sketch is None:
+        active, distinct, top = False, None, []
+    else:
+        active, distinct, top = sketch
+    rate, shed, estimated = stats.sampling if stats.sampling is not None else (0, 0, 0)
+    payload = _STATS.pack(stats.received, _optional(stats.rejected), _optional(stats.kernel_drops),
+                          _optional(stats.replies_matched), _optional(stats.in_flight),
+                          stats.updates_merged, stats.filtered, stats.sketch_threshold, active,
+                          _optional(distinct), len(top), rate, shed, estimated)
+    payload += b''.join(_TOP_ENTRY.pack(address, count) for address, count in top)
+    return _frame(FRAME_STATS, payload)
+
+
+def encode_error(message):
+    return _frame(FRAME_ERROR, message.encode('utf-8'))
+
+
+def _decode_hello(payload):
+    magic, version, started = _HELLO.unpack(payload)
+    if magic != MAGIC:
+        raise ValueError("不是ICMP监控守护进程")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"协议版本不匹配: 守护进程为 {version}，本程序为 {PROTOCOL_VERSION}")
+    return started
+
+
+def _decode_start(payload):
+    return _START.unpack(payload)
+
+
+def _decode_updates(payload):
+    return [(values[0], values[1], values[2], _unpack_summary(values[3:]))
+            for values in _UPDATE.iter_unpack(payload)]
+
+
+def _decode_stop(payload):
+    values = _SESSION.unpack(payload)
+    return values[:4] + (_unpack_summary(values[4:]),)
+
+
+def _decode_snapshot(payload):
+    return [values[:4] + (_unpack_summary(values[4:]),) for values in _SESSION.iter_unpack(payload)]
+
+
+def _decode_sweep(payload):
+    (sweep_id, network, length, start_time, last_time, active, hosts, peak, requests,
+     ended) = _SWEEP.unpack(payload)
+    sweep = Sweep(sweep_id, network, length, start_time)
+    sweep.last_time = last_time
+    sweep.active = active
+    sweep.hosts = hosts
+    sweep.peak = peak
+    sweep.requests = requests
+    sweep.ended = ended
+    return sweep
+
+
+def _decode_stats(payload):
+    (received, rejected, drops, matched, in_flight, merged, filtered, sketch_threshold, active,
+     distinct, count, rate, shed, estimated) = _STATS.unpack_from(payload)
+    sketch = None
+    if sketch_threshold:
+        top = list(_TOP_ENTRY.iter_unpack(payload[_STATS.size:_STATS.size + count * _TOP_ENTRY.size]))
+        sketch = (active, None if distinct < 0 else distinct, top)
+    return DaemonStats(received, None if rejected < 0 else rejected, None if drops < 0 else drops,
+                       None if matched < 0 else matched, None if in_flight < 0 else in_flight,
+                       merged, filtered, sketch_threshold, sketch,
+                       (rate, shed, estimated) if rate else None)
+
+
+def _decode_error(payload):
+    return payload.decode('utf-8', 'replace')
+
+
+_DECODERS = {
+    FRAME_HELLO: _decode_hello,
+    FRAME_START: _decode_start,
+    FRAME_UPDATE: _decode_updates,
+    FRAME_STOP: _decode_stop,
+    FRAME_SWEEP: _decode_sweep,
+    FRAME_STATS: _decode_stats,
+    FRAME_ERROR: _decode_error,
+    FRAME_SNAPSHOT: _decode_snapshot,
+}
+
+
+class FrameDecoder:
+    """把从套接字读到的字节流拆成帧
+
+    feed() 返回已完整收到的 [(帧类型, 内容), ...]，内容的形式:
+    HELLO 为守护进程的启动时间；START 为 (地址, 时间戳)；UPDATE 为 [(地址, 最后时间戳, 累计请求数, 统计摘要), ...]；
+    STOP 为 (地址, 开始时间, 最后时间戳, 累计请求数, 统计摘要)，SNAPSHOT 为这样的元组的列表；
+    SWEEP 为 subnet_rollup.Sweep；STATS 为 DaemonStats；ERROR 为字符串。未知类型的帧跳过，便于以后增加帧类型。
+    数据流损坏时抛出 ValueError。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        buffer = self._buffer
+        buffer += data
+        frames = []
+        offset = 0
+        header_size = _HEADER.size
+        while len(buffer) - offset >= header_size:
+            kind, length = _HEADER.unpack_from(buffer, offset)
+            if length > MAX_FRAME_SIZE:
+                raise ValueError(f"帧过大: {length} 字节")
+            end = offset + header_size + length
+            if end > len(buffer):
+                break
+            decoder = _DECODERS.get(kind)
+            if decoder is not None:
+                try:
+                    frames.append((kind, decoder(bytes(buffer[offset + header_size:end]))))
+                except struct.error as e:
+                    raise ValueError(f"无法解析类型为 {kind} 的帧: {e}") from None
+            offset = end
+        del buffer[:offset]
+        return frames
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+进程内事件总线
+抓包引擎每个事件只发布一次，每个订阅者（终端输出、界面、JSON Lines、指标、会话历史……）各有一个有界队列和
+分发线程，处理慢的订阅者只积压自己的队列；队列满时按订阅时选择的策略丢弃最旧的事件、阻塞发布者或合并更新事件
+"""
+
+import threading
+from collections import deque
+
+# 队列满时的背压策略:
+#   drop-oldest  丢弃队列中最旧的事件，发布者从不等待
+#   block        发布者等待订阅者取走事件，事件不丢失，但订阅者卡住时抓包也会停下
+#   coalesce     新事件与队尾同类型的事件合并（只合并用 EventBus.coalesce() 注册了合并函数的类型），
+#                不能合并的事件在队列满时按 block 处理，不会丢失
+POLICIES = ('drop-oldest', 'block', 'coalesce')
+# 每个订阅者默认最多排队的事件数
+DEFAULT_QUEUE_SIZE = 10000
+
+
+class Subscription:
+    """一个订阅者: 有界队列和分发线程
+
+    handlers 为 {事件类型: 回调}，只有其中的事件类型会进入队列；分发线程每次取走队列中的全部事件，
+    按发布顺序调用 handlers[类型](*参数)。回调抛出的异常计入 errors 并保存在 error 中，不影响之后的事件。
+    """
+
+    def __init__(self, name, handlers, size=DEFAULT_QUEUE_SIZE, policy='drop-oldest', merges=None):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的背压策略: {policy}")
+        self.name = name
+        self.handlers = dict(handlers)
+        self.size = size
+        self.policy = policy
+        # 事件类型 -> merge(较早的参数, 较晚的参数)，返回合并后的参数，只用于 coalesce 策略
+        self.merges = merges if policy == 'coalesce' and merges is not None else {}
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.error = None
+        self._queue = deque()
+        self._busy = False
+        self._closing = False
+        self._lock = threading.Lock()
+        # 有新事件或要求关闭时通知分发线程；队列腾出空间或处理完时通知发布者和 flush()
+        self._ready = threading.Condition(self._lock)
+        self._drained = threading.Condition(self._lock)
+        self._thread = threading.Thread(target=self._run, name=f'bus-{name}', daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        """尚未分发的事件数"""
+        return len(self._queue)
+
+    def put(self, kind, args):
+        """把一个事件放入队列，由 EventBus.publish() 调用"""
+        with self._lock:
+            queue = self._queue
+            if queue and kind in self.merges:
+                tail_kind, tail_args = queue[-1]
+                if tail_kind == kind:
+                    # 同一个参数对象会放入多个订阅者的队列，合并函数必须返回新的对象
+                    queue[-1] = (kind, self.merges[kind](tail_args, args))
+                    self.coalesced += 1
+                    return
+            if len(queue) >= self.size:
+                if self.policy != 'drop-oldest':
+                    while len(queue) >= self.size and not self._closing:
+                        self._drained.wait()
+                else:
+                    queue.popleft()
+                    self.dropped += 1
+            queue.append((kind, args))
+            self._ready.notify()
+
+    def _run(self):
+        queue = self._queue
+        handlers = self.handlers
+        while True:
+            with self._lock:
+                while not queue:
+                    self._busy = False
+                    self._drained.notify_all()
+                    if self._closing:
+                        return
+                    self._ready.wait()
+                events = list(queue)
+                queue.clear()
+                self._busy = True
+                self._drained.notify_all()
+            for kind, args in events:
+                try:
+                    handlers[kind](*args)
+                except Exception as e:
+                    self.errors += 1
+                    self.error = e
+            self.delivered += len(events)
+
+    def flush(self):
+        """等待已放入队列的事件全部处理完；在本订阅者的回调中调用时立即返回"""
+        if threading.current_thread() is self._thread:
+            return
+        with self._lock:
+            while (self._queue or self._busy) and self._thread.is_alive():
+                self._drained.wait()
+
+    def close(self):
+        """处理完剩余的事件后结束分发线程"""
+        with self._lock:
+            self._closing = True
+            self._ready.notify()
+            self._drained.notify_all()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+class EventBus:
+    """把事件分发给订阅了该事件类型的各个订阅者
+
+    publish(类型, *参数) 只把事件放入各订阅者的队列，没有订阅者的事件类型直接返回；
+    发布者可以先用 wants() 判断，跳过构造没有人订阅的事件。多个线程可以同时发布和订阅。
+    """
+
+    def __init__(self):
+        self.subscriptions = []
+        # 事件类型 -> 订阅者元组，订阅变化时整体替换，发布时不加锁
+        self._routes = {}
+        self._merges = {}
+        self._lock = threading.Lock()
+
+    def coalesce(self, kind, merge):
+        """注册事件类型的合并函数，对之后以 coalesce 策略订阅的订阅者生效"""
+        self._merges[kind] = merge
+
+    def subscribe(self, name, handlers, size=DEFAULT_QUEUE_SIZE, policy='drop-oldest'):
+        """添加订阅者，handlers 为 {事件类型: 回调}，返回 Subscription"""
+        subscription = Subscription(name, handlers, size, policy, self._merges)
+        with self._lock:
+            self.subscriptions = self.subscriptions + [subscription]
+            self._route()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """移除订阅者，先处理完它队列中的事件"""
+        with self._lock:
+            self.subscriptions = [item for item in self.subscriptions if item is not subscription]
+            self._route()
+        subscription.close()
+
+    def _route(self):
+        routes = {}
+        for subscription in self.subscriptions:
+            for kind in subscription.handlers:
+                routes.setdefault(kind, []).append(subscription)
+        self._routes = {kind: tuple(subscriptions) for kind, subscriptions in routes.items()}
+
+    def wants(self, kind):
+        """是否有订阅者订阅了该事件类型"""
+        return kind in self._routes
+
+    def publish(self, kind, *args):
+        for subscription in self._routes.get(kind, ()):
+            subscription.put(kind, args)
+
+    def depth(self):
+        """各订阅者尚未分发的事件数之和"""
+        return sum(len(subscription) for subscription in self.subscriptions)
+
+    @property
+    def dropped(self):
+        return sum(subscription.dropped for subscription in self.subscriptions)
+
+    @property
+    def coalesced(self):
+        return sum(subscription.coalesced for subscription in self.subscriptions)
+
+    def flush(self):
+        """等待已发布的事件全部处理完"""
+        for subscription in self.subscriptions:
+            subscription.flush()
+
+    def close(self):
+        """处理完剩余的事件后移除所有订阅者"""
+        for subscription in list(self.subscriptions):
+            self.unsubscribe(subscription)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+事件输出
+把开始/停止事件格式化为文本或 JSON Lines，先追加到内存缓冲，按时间间隔或缓冲大小批量写到
+标准输出、文件或 Unix 套接字；同一秒内的时间戳只格式化一次
+"""
+
+import socket
+import sys
+import threading
+from datetime import datetime
+
+from source_stats import format_summary
+from source_table import int_to_ip
+
+# 可选的输出格式
+OUTPUT_FORMATS = ('text', 'jsonl')
+# 默认每隔多少秒写出一次缓冲
+DEFAULT_FLUSH_INTERVAL = 0.5
+# 缓冲超过这么多字符时立即写出
+DEFAULT_FLUSH_BYTES = 64 << 10
+# 输出目标以此开头时连接 Unix 套接字
+UNIX_PREFIX = 'unix:'
+
+
+class TimestampCache:
+    """按整秒缓存时间戳的格式化结果，事件密集时每秒只格式化一次
+
+    缓存的 (秒, 文本) 作为一个元组整体替换，多个线程同时调用时不会读到不配对的值。
+    """
+
+    def __init__(self, iso=False):
+        self.iso = iso
+        self._cached = (None, '')
+
+    def format(self, timestamp):
+        second = int(timestamp)
+        cached = self._cached
+        if cached[0] == second:
+            return cached[1]
+        moment = datetime.fromtimestamp(second)
+        if self.iso:
+            # 带本地时区偏移，例如 2024-01-01T08:00:00+08:00
+            text = moment.astimezone().isoformat()
+        else:
+            text = moment.strftime('%Y-%m-%d %H:%M:%S')
+        self._cached = (second, text)
+        return text
+
+
+def _sampling_note(sampling_rate):
+    return f" [采样 1/{sampling_rate}]" if sampling_rate > 1 else ""
+
+
+class TextFormatter:
+    """与原来的终端输出相同的中文文本，过载采样期间的事件末尾注明采样倍数"""
+
+    def __init__(self):
+        self.clock = TimestampCache()
+
+    def start(self, src, timestamp, sampling_rate=1):
+        return f"[{self.clock.format(timestamp)}] {int_to_ip(src)} 开始ping本机{_sampling_note(sampling_rate)}"
+
+    def stop(self, src, start_time, last_time, count, summary, sampling_rate=1):
+        return (f"[{self.clock.format(last_time)}] {int_to_ip(src)} 停止ping本机 "
+                f"(共 {count} 个请求, {format_summary(summary)}){_sampling_note(sampling_rate)}")
+
+    def session(self, src, start_time, last_time, count, summary):
+        """会话历史中的一条记录"""
+        if start_time is None:
+            period = f"? ~ {self.clock.format(last_time)}"
+        else:
+            period = (f"{self.clock.format(start_time)} ~ {self.clock.format(last_time)}, "
+                      f"持续 {last_time - start_time:.1f} 秒")
+        return f"[{period}] {int_to_ip(src)} 共 {count} 个请求, {format_summary(summary)}"
+
+    def sweep_start(self, sweep, sampling_rate=1):
+        return (f"[{self.clock.format(sweep.start_time)}] 发现来自 {sweep.cidr} 的扫描 "
+                f"({sweep.active} 个源同时ping本机，该网段之后的源合并显示){_sampling_note(sampling_rate)}")
+
+    def sweep_stop(self, sweep, sampling_rate=1):
+        return (f"[{self.clock.format(sweep.last_time)}] 来自 {sweep.cidr} 的扫描结束 "
+                f"(共 {sweep.hosts} 个源, 最多 {sweep.peak} 个同时活跃, {sweep.requests} 个请求, "
+                f"持续 {sweep.last_time - sweep.start_time:.1f} 秒){_sampling_note(sampling_rate)}")
+
+
+def _json_number(value, precision):
+    return 'null' if value is None else f"{value:.{precision}f}"
+
+
+class JsonLinesFormatter:
+    """每个事件一行JSON对象
+
+    字段都是IP、数字或格式固定的时间字符串，直接拼接，不经过 json.dumps。
+    开始事件: event, ip, start, start_ts, count；
+    停止事件另有 last, last_ts, duration, rate, interval_p50_ms/p95/p99, size_p50, seq_gaps, reorders,
+    以及应答配对的 reply_p50_ms/reply_p95_ms 和 unanswered_ratio（未启用时为null）。
+    扫描事件 sweep_start/sweep_stop 有 id, cidr, start, start_ts, active, hosts，
+    sweep_stop 另有 last, last_ts, duration, peak, count；同一次扫描的 id 相同，cidr 可能变宽。
+    实时事件另有 sampling_rate: 事件发生时的过载采样倍数N，1为全量处理，
+    大于1时每个开始事件的源约代表N个源；会话历史的记录 session 没有该字段，其余与停止事件相同。
+    *_ts 为Unix时间戳（秒），start/last 为精确到秒的本地时间。
+    """
+
+    def __init__(self):
+        self.clock = TimestampCache(iso=True)
+
+    def start(self, src, timestamp, sampling_rate=1):
+        return (f'{{"event":"start","ip":"{int_to_ip(src)}","start":"{self.clock.format(timestamp)}",'
+                f'"start_ts":{timestamp:.6f},"count":1,"sampling_rate":{sampling_rate}}}')
+
+    def stop(self, src, start_time, last_time, count, summary, sampling_rate=1, event='stop'):
+        rate, p50, p95, p99, size_p50, gaps, reorders, reply_p50, reply_p95, unanswered = summary
+        if start_time is None:
+            start_fields = '"start":null,"start_ts":null,"duration":null'
+        else:
+            start_fields = (f'"start":"{self.clock.format(start_time)}","start_ts":{start_time:.6f},'
+                            f'"duration":{last_time - start_time:.6f}')
+        return (f'{{"event":"{event}","ip":"{int_to_ip(src)}",{start_fields},'
+                f'"last":"{self.clock.format(last_time)}","last_ts":{last_time:.6f},'
+                f'"count":{count},"rate":{rate:.3f},'
+                f'"interval_p50_ms":{_json_number(p50, 3)},"interval_p95_ms":{_json_number(p95, 3)},'
+                f'"interval_p99_ms":{_json_number(p99, 3)},'
+                f'"size_p50":{"null" if size_p50 is None else size_p50},'
+                f'"seq_gaps":{gaps},"reorders":{reorders},'
+                f'"reply_p50_ms":{_json_number(reply_p50, 3)},"reply_p95_ms":{_json_number(reply_p95, 3)},'
+                f'"unanswered_ratio":{_json_number(unanswered, 4)}'
+                + ('}' if sampling_rate is None else f',"sampling_rate":{sampling_rate}}}'))
+
+    def session(self, src, start_time, last_time, count, summary):
+        return self.stop(src, start_time, last_time, count, summary, None, 'session')
+
+    def sweep_start(self, sweep, sampling_rate=1):
+        return (f'{{"event":"sweep_start","id":{sweep.id},"cidr":"{sweep.cidr}",'
+                f'"start":"{self.clock.format(sweep.start_time)}","start_ts":{sweep.start_time:.6f},'
+                f'"active":{sweep.active},"hosts":{sweep.hosts},"sampling_rate":{sampling_rate}}}')
+
+    def sweep_stop(self, sweep, sampling_rate=1):
+        return (f'{{"event":"sweep_stop","id":{sweep.id},"cidr":"{sweep.cidr}",'
+                f'"start":"{self.clock.format(sweep.start_time)}","start_ts":{sweep.start_time:.6f},'
+                f'"last":"{self.clock.format(sweep.last_time)}","last_ts":{sweep.last_time:.6f},'
+                f'"duration":{sweep.last_time - sweep.start_time:.6f},"active":{sweep.active},'
+                f'"hosts":{sweep.hosts},"peak":{sweep.peak},"count":{sweep.requests},'
+                f'"sampling_rate":{sampling_rate}}}')
+
+
+FORMATTERS = {'text': TextFormatter, 'jsonl': JsonLinesFormatter}
+
+
+class StreamSink:
+    """写到已打开的文本流（标准输出），关闭时不关闭流本身"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.dropped = 0
+
+    def write(self, text):
+        self.stream.write(text)
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+
+class FileSink(StreamSink):
+    """追加写入文件"""
+
+    def __init__(self, path):
+        super().__init__(open(path, 'a', encoding='utf-8'))
+
+    def close(self):
+        self.stream.close()
+
+
+class UnixSocketSink:
+    """写到 Unix 流套接字
+
+    对端断开时丢弃当前这一批并计入 dropped，下一次写出时重新连接，不阻塞监控。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dropped = 0
+        self.sock = None
+        # 启动时就连接，地址错误能立即报告
+        self._connect()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+    def write(self, text):
+        try:
+            if self.sock is None:
+                self._connect()
+            self.sock.sendall(text.encode('utf-8'))
+        except OSError:
+            self.dropped += text.count('\n')
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def open_sink(target=None):
+    """target 为None或 '-' 时写标准输出，'unix:路径' 连接 Unix 套接字，其余视为文件路径"""
+    if target is None or target == '-':
+        return StreamSink(sys.stdout)
+    if target.startswith(UNIX_PREFIX):
+        return UnixSocketSink(target[len(UNIX_PREFIX):])
+    return FileSink(target)
+
+
+class EventOutput:
+    """格式化并批量写出开始/停止和扫描事件
+
+    start()/stop() 只格式化一行并追加到内存列表；缓冲超过 flush_bytes 个字符时立即写出，
+    其余由后台线程每隔 flush_interval 秒写出一次，不再逐行 flush。
+    收包线程和检查线程可以同时调用，写出在锁内完成以保持事件顺序。
+    sampling_rate 为当前的过载采样倍数，由 sampling() 在倍数变化时更新，写入之后的每个事件。
+    各方法与抓包引擎(capture_engine.CaptureEngine)的事件同名，可以直接订阅事件总线。
+    """
+
+    def __init__(self, format='text', target=None, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 flush_bytes=DEFAULT_FLUSH_BYTES):
+        self.format = format
+        self.formatter = FORMATTERS[format]()
+        self.sink = open_sink(target)
+        # 结构化事件写到标准输出时，其他提示信息应改写到标准错误，以免混入事件流
+        self.owns_stdout = (format != 'text' and isinstance(self.sink, StreamSink)
+                            and self.sink.stream is sys.stdout)
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.lines_written = 0
+        self.sampling_rate = 1
+        self._lines = []
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if flush_interval:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    @property
+    def dropped(self):
+        """因输出目标不可用而丢弃的事件数"""
+        return self.sink.dropped
+
+    def start(self, src, timestamp):
+        self.write(self.formatter.start(src, timestamp, self.sampling_rate))
+
+    def stop(self, src, start_time, last_time, count, summary):
+        self.write(self.formatter.stop(src, start_time, last_time, count, summary, self.sampling_rate))
+
+    def sweep_start(self, sweep):
+        self.write(self.formatter.sweep_start(sweep, self.sampling_rate))
+
+    def sweep_stop(self, sweep):
+        self.write(self.formatter.sweep_stop(sweep, self.sampling_rate))
+
+    def sampling(self, rate, previous=1, busy=None, lag=None):
+        """过载采样倍数变化，之后的事件带上新的倍数"""
+        self.sampling_rate = rate
+
+    def write(self, line):
+        """追加一行，缓冲超过阈值时立即写出"""
+        with self._lock:
+            self._lines.append(line)
+            self._size += len(line) + 1
+            if self._size >= self.flush_bytes or not self.flush_interval:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._lines:
+            return
+        lines = self._lines
+        self._lines = []
+        self._size = 0
+        self.lines_written += len(lines)
+        lines.append('')
+        self.sink.write('\n'.join(lines))
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except (OSError, ValueError):
+                # 标准输出被关闭等情况，剩余内容在 close() 时再尝试
+                pass
+
+    def close(self):
+        """写出剩余内容并关闭输出目标"""
+        self._stop.set()
+        self.flush()
+        self.sink.close()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+不活跃检测
+用按截止时间排序的惰性删除堆代替每秒遍历全部活跃IP
+"""
+
+import heapq
+
+# 默认不活跃超时时间（秒）
+DEFAULT_TIMEOUT = 3.0
+
+
+class ExpiryHeap:
+    """按截止时间(最后活动时间 + timeout)排序的惰性删除堆
+
+    堆中的对象需要有 address、last_time 和 deadline 三个属性，
+    deadline 为该对象在堆中有效条目的截止时间，为None表示不活跃。
+    收包时只更新对象的 last_time，只有由不活跃变为活跃时才入堆；
+    expire() 只弹出已到期的条目，若期间有新活动则按新的截止时间重新入堆，否则判定为停止。
+    每次检查的开销只与到期条目数成正比，与活跃源总数无关。
+    堆中只保存地址，弹出时用 lookup(地址) 取得对象，discard() 之后的旧条目不再引用被删除的对象。
+    本类不加锁，由调用方（SourceTable）负责同步。
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, lookup=None):
+        self.timeout = timeout
+        # 地址 -> 对象，不存在时返回None
+        self.lookup = lookup if lookup is not None else {}.get
+        # (截止时间, 地址)
+        self._heap = []
+        # 当前活跃的对象数
+        self.active = 0
+        # 堆中已删除但尚未弹出的条目数
+        self.stale = 0
+
+    def __len__(self):
+        return self.active
+
+    def touch(self, item):
+        """item.last_time 更新后调用，item 由不活跃变为活跃时返回True"""
+        if item.deadline is not None:
+            return False
+        item.deadline = item.last_time + self.timeout
+        heapq.heappush(self._heap, (item.deadline, item.address))
+        self.active += 1
+        return True
+
+    def next_deadline(self):
+        """返回最早的截止时间，没有活跃源时返回None"""
+        return self._heap[0][0] if self._heap else None
+
+    def wait_time(self, now, max_wait=1.0):
+        """距离下一个截止时间的秒数，最长 max_wait，供检查线程休眠"""
+        deadline = self.next_deadline()
+        if deadline is None:
+            return max_wait
+        return min(max_wait, max(0.01, deadline - now))
+
+    def expire(self, now):
+        """弹出在 now 之前超时的对象并返回列表"""
+        expired = []
+        heap = self._heap
+        timeout = self.timeout
+        lookup = self.lookup
+        while heap and heap[0][0] < now:
+            entry_deadline, address = heapq.heappop(heap)
+            item = lookup(address)
+            if item is None or item.deadline != entry_deadline:
+                # 已删除的旧条目
+                self.stale = max(0, self.stale - 1)
+                continue
+            deadline = item.last_time + timeout
+            if deadline < now:
+                item.deadline = None
+                self.active -= 1
+                expired.append(item)
+            else:
+                # 期间有新活动，按新的截止时间重新入堆
+                item.deadline = deadline
+                heapq.heappush(heap, (deadline, address))
+        return expired
+
+    def discard(self, item):
+        """把 item 标记为不活跃，堆中的旧条目在到期时被忽略"""
+        if item.deadline is not None:
+            item.deadline = None
+            self.active -= 1
+            self.stale += 1
+            # 旧条目过多时重建堆，堆的大小不超过活跃对象数的两倍
+            if self.stale > 1024 and self.stale > self.active:
+                self._compact()
+
+    def _compact(self):
+        """去掉堆中已删除的条目"""
+        lookup = self.lookup
+        heap = []
+        for entry in self._heap:
+            item = lookup(entry[1])
+            if item is not None and item.deadline == entry[0]:
+                heap.append(entry)
+        heapq.heapify(heap)
+        self._heap = heap
+        self.stale = 0
+
+    def clear(self):
+        """清空所有活跃对象"""
+        lookup = self.lookup
+        for _, address in self._heap:
+            item = lookup(address)
+            if item is not None:
+                item.deadline = None
+        self._heap.clear()
+        self.active = 0
+        self.stale = 0
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+多进程抓包（仅Linux）
+N 个工作进程各自打开 TPACKET_V3 环形缓冲区并加入同一个 PACKET_FANOUT 组，内核按源地址分发，
+同一个源总是落到同一个进程；各进程维护自己那一份源状态表，只把开始/停止事件和定期统计发给主进程汇总
+"""
+
+import os
+import queue
+import signal
+import time
+import multiprocessing
+
+from ring_capture import RingCapture
+from metrics import MonitorMetrics, LATENCY_SAMPLE_MASK
+from expiry import DEFAULT_TIMEOUT
+from source_table import SourceTable, DEFAULT_MAX_SOURCES, DEFAULT_IDLE_TIMEOUT
+from source_sketch import SourceSketch, merge_summaries, DEFAULT_SKETCH_THRESHOLD
+from reply_tracker import InFlightIndex, DEFAULT_REPLY_TIMEOUT, DEFAULT_MAX_IN_FLIGHT
+from load_shedder import LoadShedder, DEFAULT_MAX_SAMPLING, DEFAULT_MAX_LAG
+
+# 工作进程上报统计的间隔（秒）
+STATS_INTERVAL = 1.0
+# 工作进程检查停止标志和超时源的最长间隔（毫秒）
+TICK_MS = 100
+
+
+def worker_main(index, workers, group_id, events, stop_event, echo_filter,
+                timeout, max_sources, idle_timeout, sketch_threshold=DEFAULT_SKETCH_THRESHOLD,
+                replies=False, reply_timeout=DEFAULT_REPLY_TIMEOUT, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                max_sampling=DEFAULT_MAX_SAMPLING, max_lag=DEFAULT_MAX_LAG):
+    """工作进程入口
+
+    事件按批放入 events 队列，每批是一个列表，元素为:
+    ('start', 源地址, 时间戳)     新的源或停止后重新开始ping的源开始新的会话
+    ('stop', 源地址, 最后活动时间, 请求数, 统计摘要, 开始时间)
+    ('stats', 进程序号, (处理包数, Echo请求数, 内核包数, 内核丢包数, 活跃源数, 记录数,
+                        处理耗时直方图, 检查耗时直方图, 估算摘要或None, 应答配对计数或None,
+                        (采样倍数, 未处理的请求数, 放大后的活跃源数)或None, 积压时间直方图))
+    ('error', 错误信息)
+    最后一批以 ('exit', 进程序号, 统计) 结束。
+    对端地址相同的请求和应答落在同一个进程，replies 为True时各进程分别配对。
+    max_sampling 大于1时各进程按自己的负载分别调整采样倍数。
+    """
+    # Ctrl+C 由主进程处理，再通过 stop_event 通知工作进程
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sketch = SourceSketch(sketch_threshold) if sketch_threshold else None
+    shedder = LoadShedder(max_sampling, max_lag) if max_sampling > 1 else None
+    sources = SourceTable(max_sources, idle_timeout, timeout, sketch, shedder)
+    in_flight = InFlightIndex(reply_timeout, max_in_flight) if replies else None
+    capture = RingCapture(echo_filter=echo_filter, fanout=(group_id, workers),
+                          poll_timeout_ms=TICK_MS)
+    metrics = MonitorMetrics()
+    handler_latency = metrics.handler_latency
+    capture_lag = metrics.capture_lag
+    pending = []
+    next_stats = [0.0]
+
+    def stats():
+        _, drops, _ = capture.kernel_stats()
+        return (capture.packets_seen, capture.packets_matched, capture.kernel_packets, drops,
+                sources.active_count, len(sources),
+                handler_latency.state(), metrics.expiry_tick.state(),
+                sources.sketch_summary(time.time()),
+                None if in_flight is None else (in_flight.matched, in_flight.unmatched,
+                                                len(in_flight), in_flight.expired,
+                                                in_flight.overflowed),
+                None if shedder is None else (shedder.rate, shedder.shed, sources.estimated_active),
+                capture_lag.state())
+
+    def handle_echo(src, timestamp, ident=0, seq=0, size=0):
+        timed = not capture.packets_matched & LATENCY_SAMPLE_MASK
+        if timed:
+            started = time.perf_counter()
+        record, started = sources.touch(src, timestamp)
+        if record is not None:
+            record.stats.update(timestamp, ident, seq, size)
+            if in_flight is not None:
+                in_flight.add(src, ident, seq, timestamp, record.stats)
+            if started:
+                pending.append(('start', src, timestamp))
+        if timed:
+            handler_latency.observe(time.perf_counter() - started)
+            capture_lag.observe(sources.record_lag(timestamp, time.time()))
+
+    def handle_reply(dst, timestamp, ident=0, seq=0):
+        in_flight.match(dst, ident, seq, timestamp)
+
+    def tick():
+        # 每处理完一个块或 poll 超时调用一次，expire() 的开销只与到期源数成正比
+        now = time.time()
+        started = time.perf_counter()
+        for record in sources.expire(now):
+            pending.append(('stop', record.address, record.last_time, record.count,
+                            record.stats.summary(), record.start_time))
+        metrics.expiry_tick.observe(time.perf_counter() - started)
+        if now >= next_stats[0]:
+            sources.evict_idle(now)
+            pending.append(('stats', index, stats()))
+            next_stats[0] = now + STATS_INTERVAL
+        if pending:
+            events.put(list(pending))
+            del pending[:]
+        return not stop_event.is_set()
+
+    try:
+        capture.run(handle_echo, tick, handle_reply if in_flight is not None else None)
+    except Exception as e:
+        pending.append(('error', f"工作进程 {index}: {e}"))
+    pending.append(('exit', index, stats()))
+    events.put(list(pending))
+
+
+class FanoutMonitor:
+    """启动并汇总多个 PACKET_FANOUT 工作进程
+
+    源状态表按源地址分片，每个进程最多保留 max_sources / workers 条记录，
+    活跃源达到 sketch_threshold / workers 个时各自切换到估算模式；
+    启用应答配对时每个进程最多等待 max_in_flight / workers 个请求的应答。
+    max_sampling 大于1时各进程分别采样，汇总的采样倍数取各进程中最大的，
+    变化时在分发事件的线程中调用 on_sampling(新的倍数, 原来的倍数)。
+    提供与 RingCapture 相同的 packets_seen 和 kernel_stats()，供前端统一显示统计；
+    给定 metrics 时把各进程的耗时直方图汇总到其中。
+    """
+
+    def __init__(self, workers, echo_filter=None, timeout=DEFAULT_TIMEOUT,
+                 max_sources=DEFAULT_MAX_SOURCES, idle_timeout=DEFAULT_IDLE_TIMEOUT, metrics=None,
+                 sketch_threshold=DEFAULT_SKETCH_THRESHOLD, replies=False,
+                 reply_timeout=DEFAULT_REPLY_TIMEOUT, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 max_sampling=DEFAULT_MAX_SAMPLING, max_lag=DEFAULT_MAX_LAG, on_sampling=None):
+        self.workers = workers
+        self.echo_filter = echo_filter
+        self.timeout = timeout
+        self.max_sources = -(-max_sources // workers) if max_sources else max_sources
+        self.idle_timeout = idle_timeout
+        self.sketch_threshold = -(-sketch_threshold // workers) if sketch_threshold else 0
+        self.replies = replies
+        self.reply_timeout = reply_timeout
+        self.max_in_flight = -(-max_in_flight // workers)
+        self.max_sampling = max_sampling
+        self.max_lag = max_lag
+        self.on_sampling = on_sampling
+        self._sampling_rate = 1
+        # 同一台机器上的多个实例使用不同的组ID
+        self.group_id = os.getpid() & 0xffff
+        self.events = multiprocessing.Queue()
+        self.stop_event = multiprocessing.Event()
+        self.processes = []
+        # 各工作进程最近一次上报的统计
+        self.worker_stats = {}
+        self.errors = []
+        self.metrics = metrics
+        self._exited = set()
+
+    @property
+    def packets_seen(self):
+        """所有工作进程送达处理函数的包数"""
+        return sum(stats[0] for stats in self.worker_stats.values())
+
+    @property
+    def active_count(self):
+        """所有工作进程的活跃源数"""
+        return sum(stats[4] for stats in self.worker_stats.values())
+
+    def __len__(self):
+        """所有工作进程的源记录数"""
+        return sum(stats[5] for stats in self.worker_stats.values())
+
+    def queue_depth(self):
+        """事件队列中尚未处理的批次数，平台不支持时返回None"""
+        try:
+            return self.events.qsize()
+        except NotImplementedError:
+            return None
+
+    def sketch_summary(self, now=None, n=10):
+        """合并各工作进程最近上报的估算摘要，未启用估算时返回None"""
+        if not self.sketch_threshold:
+            return None
+        return merge_summaries([stats[8] for stats in self.worker_stats.values()], n)
+
+    def reply_counts(self):
+        """汇总各工作进程的 (配对成功数, 未配对应答数, 在途请求数, 超时请求数, 因容量淘汰的请求数)"""
+        totals = [0] * 5
+        for stats in self.worker_stats.values():
+            if stats[9] is not None:
+                for index, value in enumerate(stats[9]):
+                    totals[index] += value
+        return tuple(totals)
+
+    def sampling_counts(self):
+        """汇总各工作进程的 (最大采样倍数, 未处理的请求数, 放大后的活跃源数)"""
+        rate, shed, estimated = 1, 0, 0
+        for stats in self.worker_stats.values():
+            if stats[10] is None:
+                estimated += stats[4]
+            else:
+                rate = max(rate, stats[10][0])
+                shed += stats[10][1]
+                estimated += stats[10][2]
+        return rate, shed, estimated
+
+    def kernel_stats(self):
+        """汇总各工作进程的 (通过过滤的包数, 内核丢包数, 队列冻结次数)，冻结次数不上报记为0"""
+        values = self.worker_stats.values()
+        return sum(stats[2] for stats in values), sum(stats[3] for stats in values), 0
+
+    def start(self):
+        """启动工作进程"""
+        for index in range(self.workers):
+            process = multiprocessing.Process(
+                target=worker_main, name=f"icmp-fanout-{index}", daemon=True,
+                args=(index, self.workers, self.group_id, self.events, self.stop_event,
+                      self.echo_filter, self.timeout, self.max_sources, self.idle_timeout,
+                      self.sketch_threshold, self.replies, self.reply_timeout, self.max_in_flight,
+                      self.max_sampling, self.max_lag))
+            process.start()
+            self.processes.append(process)
+
+    def stop(self):
+        """通知所有工作进程退出"""
+        self.stop_event.set()
+
+    def join(self, timeout=5.0):
+        """等待工作进程退出，超时仍未退出的强制结束"""
+        deadline = time.time() + timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.time()))
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def run(self, on_start, on_stop):
+        """启动工作进程并在当前进程分发事件，直到所有工作进程退出
+
+        on_start(源地址, 时间戳)，on_stop(源地址, 最后活动时间, 请求数, 统计摘要, 开始时间)。
+        收到 KeyboardInterrupt 时通知工作进程退出，处理完剩余事件后重新抛出。
+        """
+        self.start()
+        try:
+            self._dispatch(on_start, on_stop)
+        except KeyboardInterrupt:
+            self.stop()
+            self._dispatch(on_start, on_stop)
+            raise
+        finally:
+            self.stop()
+            self.join()
+
+    def _dispatch(self, on_start, on_stop):
+        while len(self._exited) < len(self.processes):
+            try:
+                batch = self.events.get(timeout=0.5)
+            except queue.Empty:
+                # 被强制结束的进程不会发送 exit
+                for index, process in enumerate(self.processes):
+                    if process.exitcode is not None:
+                        self._exited.add(index)
+                continue
+            for event in batch:
+                kind = event[0]
+                if kind == 'start':
+                    on_start(event[1], event[2])
+                elif kind == 'stop':
+                    on_stop(*event[1:])
+                elif kind == 'error':
+                    self.errors.append(event[1])
+                else:
+                    self.worker_stats[event[1]] = event[2]
+                    if kind == 'exit':
+                        self._exited.add(event[1])
+                    if self.metrics is not None:
+                        values = self.worker_stats.values()
+                        self.metrics.handled = sum(stats[1] for stats in values)
+                        self.metrics.handler_latency.load(stats[6] for stats in values)
+                        self.metrics.expiry_tick.load(stats[7] for stats in values)
+                        self.metrics.capture_lag.load(stats[11] for stats in values)
+                    if self.max_sampling > 1:
+                        self._update_sampling()
+
+    def _update_sampling(self):
+        rate = self.sampling_counts()[0]
+        if rate != self._sampling_rate:
+            previous, self._sampling_rate = self._sampling_rate, rate
+            if self.on_sampling is not None:
+                self.on_sampling(rate, previous)
@@ -8,9 +8,28 @@ ICMP Ping 监控程序 - 图形界面版本
 
 import sys
 import time
-from collections import defaultdict
+import argparse
+import socket
+import sqlite3
 from datetime import datetime
-from threading import Thread
+from threading import Thread, Event
+
+from scapy_backend import load_scapy
+from capture_engine import (CaptureEngine, add_capture_arguments, capture_arguments_error, engine_options,
+                            DEFAULT_REFRESH_RATE)
+from event_output import EventOutput
+from metrics import start_exporters
+from source_stats import format_ms, format_ratio
+from source_table import ip_to_int, int_to_ip
+from source_sketch import format_top, DEFAULT_WINDOW
+from session_history import SessionHistory
+from state_snapshot import StateSnapshots
+from delta_protocol import (FrameDecoder, FRAME_HELLO, FRAME_START, FRAME_UPDATE, FRAME_STOP,
+                            FRAME_SWEEP, FRAME_STATS, FRAME_ERROR, FRAME_SNAPSHOT,
+                            DEFAULT_SOCKET_PATH)
+
+# 与抓包守护进程的连接断开后，每隔多少秒重连一次
+RECONNECT_INTERVAL = 1.0
 
 try:
     # 动态导入PyQt5模块
@@ -27,8 +46,7 @@ try:
     QHBoxLayout = getattr(QtWidgets, 'QHBoxLayout')
     QLabel = getattr(QtWidgets, 'QLabel')
     QPushButton = getattr(QtWidgets, 'QPushButton')
-    QTableWidget = getattr(QtWidgets, 'QTableWidget')
-    QTableWidgetItem = getattr(QtWidgets, 'QTableWidgetItem')
+    QTableView = getattr(QtWidgets, 'QTableView')
     QHeaderView = getattr(QtWidgets, 'QHeaderView')
     QStatusBar = getattr(QtWidgets, 'QStatusBar')
     QTextEdit = getattr(QtWidgets, 'QTextEdit')
@@ -37,148 +55,488 @@ try:
     QTimer = getattr(QtCore, 'QTimer')
     pyqtSignal = getattr(QtCore, 'pyqtSignal')
     QObject = getattr(QtCore, 'QObject')
+    QAbstractTableModel = getattr(QtCore, 'QAbstractTableModel')
+    QSortFilterProxyModel = getattr(QtCore, 'QSortFilterProxyModel')
+    QModelIndex = getattr(QtCore, 'QModelIndex')
     
     QColor = getattr(QtGui, 'QColor')
     QFont = getattr(QtGui, 'QFont')
-    
-    # 尝试导入Scapy
-    scapy_all = importlib.import_module('scapy.all')
-    sniff = getattr(scapy_all, 'sniff', None)
-    ICMP = getattr(scapy_all, 'ICMP', None)
-    IP = getattr(scapy_all, 'IP', None)
-    conf = getattr(scapy_all, 'conf', None)
-    
-    # 尝试导入L3RawSocket
-    try:
-        scapy_arch = importlib.import_module('scapy.arch')
-        L3RawSocket = getattr(scapy_arch, 'L3RawSocket', None)
-    except ImportError:
-        try:
-            scapy_supersocket = importlib.import_module('scapy.supersocket')
-            L3RawSocket = getattr(scapy_supersocket, 'L3RawSocket', None)
-        except ImportError:
-            L3RawSocket = None
-    
-    SCAPY_AVAILABLE = all([sniff, ICMP, IP, conf])
-    
 except ImportError as e:
     print(f"导入模块失败: {e}")
     sys.exit(1)
 
 
 class ICMPWorker(QObject):
-    """处理ICMP包嗅探的后台工作线程"""
+    """图形界面前端: 把抓包引擎(capture_engine.CaptureEngine)的事件转换为界面信号
+
+    以 coalesce 策略订阅事件总线: 界面线程跟不上时，队列中相邻的更新批次合并为一批，
+    开始/停止事件不丢弃，保持原来的顺序。抓包和会话跟踪都在引擎中完成。
+    """
     # 定义信号
     new_ping_signal = pyqtSignal(str, float)  # IP, timestamp
-    update_ping_signal = pyqtSignal(str, float)  # IP, timestamp
-    stop_ping_signal = pyqtSignal(str, float)  # IP, timestamp
+    batch_update_signal = pyqtSignal(object)  # {IP: (最后时间戳, 合并的请求数, 统计摘要)}
+    stop_ping_signal = pyqtSignal(str, float, object)  # IP, timestamp, 统计摘要
+    sweep_signal = pyqtSignal(object)  # 网段扫描开始、有新活动或结束时的 subnet_rollup.Sweep 快照
     error_signal = pyqtSignal(str)  # 错误信息
-    
-    def __init__(self):
+
+    def __init__(self, engine=None):
         super().__init__()
-        self.ping_records = defaultdict(dict)
-        self.last_update = defaultdict(float)
-        self.active_ips = set()
+        # 抓包引擎，默认按界面刷新频率合并更新
+        self.engine = engine if engine is not None else CaptureEngine(
+            update_interval=1.0 / DEFAULT_REFRESH_RATE)
+        self.sources = self.engine.sources
+        self.metrics = self.engine.metrics
+        self.sketch_threshold = self.engine.sketch_threshold
+        self.batches_emitted = 0
+        self.metrics.add('icmp_monitor_gui_batches_total', 'counter', "发送给界面的更新批次数",
+                         lambda: self.batches_emitted)
+        self.engine.bus.subscribe('gui', {
+            'start': self._emit_start,
+            'stop': self._emit_stop,
+            'updates': self._emit_updates,
+            'sweep_start': self.sweep_signal.emit,
+            'sweep': self.sweep_signal.emit,
+            'sweep_stop': self.sweep_signal.emit,
+            'error': self.error_signal.emit,
+        }, policy='coalesce')
+
+    @property
+    def is_running(self):
+        return self.engine.is_running
+
+    @property
+    def updates_merged(self):
+        return self.engine.updates_merged
+
+    def sketch_summary(self):
+        """估算模式的 (是否处于估算模式, 不同源估计值, 请求最多的源)，未启用时返回None"""
+        return self.engine.sketch_summary()
+
+    def reply_counts(self):
+        """返回应答配对的 (配对成功数, 在途请求数)，未启用应答配对时返回None"""
+        counts = self.engine.reply_counts()
+        if counts is None:
+            return None
+        return counts[0], counts[2]
+
+    def sampling_counts(self):
+        """返回过载采样的 (当前采样倍数, 未处理的请求数, 放大后的活跃源数估计)，未启用时返回None"""
+        return self.engine.sampling_counts()
+
+    def filter_stats(self):
+        """返回 (内核过滤丢弃数, 送达处理函数的包数)，丢弃数未知时为None"""
+        return self.engine.filter_stats()
+
+    def kernel_filtered(self):
+        """是否启用了内核过滤"""
+        return self.engine.kernel_filtered()
+
+    def kernel_drops(self):
+        """返回环形缓冲区溢出导致的内核丢包数，引擎不支持时为None"""
+        return self.engine.kernel_drops()
+
+    def save_active_sessions(self):
+        """退出时把仍在ping的源作为会话写入历史，启用状态快照时这些会话保存在快照中"""
+        self.engine.save_active_sessions()
+
+    def active_sessions(self):
+        """正在ping本机的源 [(IP, 开始时间, 最后时间戳, 统计摘要), ...]，格式与 DaemonClient.snapshot_signal 相同"""
+        return [(record.ip, record.start_time, record.last_time, record.stats.summary())
+                for record in self.engine.active_sessions()]
+
+    def _emit_start(self, src, timestamp):
+        self.new_ping_signal.emit(int_to_ip(src), timestamp)
+
+    def _emit_stop(self, src, start_time, last_time, count, summary):
+        self.stop_ping_signal.emit(int_to_ip(src), last_time, summary)
+
+    def _emit_updates(self, batch):
+        self.batches_emitted += 1
+        self.batch_update_signal.emit({int_to_ip(src): (timestamp, count, summary)
+                                       for src, (timestamp, count, _, summary) in batch.items()})
+
+    def start_sniffing(self):
+        """开始嗅探ICMP包，直到 stop_sniffing()；出错时发送 error_signal"""
+        self.engine.run_reporting_errors()
+
+    def stop_sniffing(self):
+        """停止嗅探"""
+        self.engine.stop()
+
+
+class DaemonClient(QObject):
+    """抓包守护进程(capture_daemon.py)的客户端，信号和统计接口与 ICMPWorker 相同
+
+    本进程不抓包，只把守护进程发来的增量帧转换为信号；连接时先收到快照，
+    连接断开后每隔 RECONNECT_INTERVAL 秒重连，断开和重连都不影响守护进程抓包。
+    """
+    new_ping_signal = pyqtSignal(str, float)
+    batch_update_signal = pyqtSignal(object)
+    stop_ping_signal = pyqtSignal(str, float, object)
+    sweep_signal = pyqtSignal(object)
+    error_signal = pyqtSignal(str)
+    snapshot_signal = pyqtSignal(object)  # 连接时正在ping本机的源 [(IP, 开始时间, 最后时间戳, 统计摘要), ...]
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH):
+        super().__init__()
+        self.path = path
         self.is_running = False
-        
-    def packet_handler(self, packet):
-        """处理捕获到的数据包"""
-        if SCAPY_AVAILABLE and ICMP and IP and packet.haslayer(ICMP) and packet.haslayer(IP):
-            # 只处理ICMP Echo Request (type=8)
-            if packet[ICMP].type == 8:
-                src_ip = packet[IP].src
-                timestamp = time.time()
-                
-                # 如果是第一次看到这个IP
-                if src_ip not in self.ping_records:
-                    self.ping_records[src_ip]['start_time'] = timestamp
-                    self.new_ping_signal.emit(src_ip, timestamp)
-                else:
-                    # 更新最后活动时间
-                    self.ping_records[src_ip]['last_time'] = timestamp
-                    self.update_ping_signal.emit(src_ip, timestamp)
-                    
-                # 更新活跃状态
-                self.last_update[src_ip] = timestamp
-                self.active_ips.add(src_ip)
-    
-    def check_inactive_ips(self):
-        """检查不活跃的IP并更新状态"""
-        if not self.is_running:
-            return
-            
-        current_time = time.time()
-        inactive_ips = []
-        
-        # 检查超过3秒没有活动的IP
-        for ip in self.active_ips:
-            if current_time - self.last_update[ip] > 3:
-                inactive_ips.append(ip)
-                
-        # 移除不活跃的IP并发送停止信号
-        for ip in inactive_ips:
-            self.active_ips.discard(ip)
-            last_time = self.last_update[ip]
-            self.stop_ping_signal.emit(ip, last_time)
-    
+        # 守护进程最近一次发来的 delta_protocol.DaemonStats，连接前为None
+        self.stats = None
+        self._socket = None
+        # 每次 start_sniffing() 使用新的事件，停止后立即重新开始时旧的线程也能退出
+        self._stopped = Event()
+
+    @property
+    def updates_merged(self):
+        return self.stats.updates_merged if self.stats is not None else 0
+
+    @property
+    def sketch_threshold(self):
+        return self.stats.sketch_threshold if self.stats is not None else 0
+
+    def filter_stats(self):
+        if self.stats is None:
+            return None, 0
+        return self.stats.rejected, self.stats.received
+
+    def kernel_filtered(self):
+        return self.stats is not None and self.stats.filtered
+
+    def kernel_drops(self):
+        return self.stats.kernel_drops if self.stats is not None else None
+
+    def reply_counts(self):
+        if self.stats is None or self.stats.replies_matched is None:
+            return None
+        return self.stats.replies_matched, self.stats.in_flight
+
+    def sketch_summary(self):
+        return self.stats.sketch if self.stats is not None else None
+
+    def sampling_counts(self):
+        return self.stats.sampling if self.stats is not None else None
+
     def start_sniffing(self):
-        """开始嗅探ICMP包"""
-        if not SCAPY_AVAILABLE:
-            self.error_signal.emit("Scapy库不可用，请安装Scapy库")
-            return
-            
+        """连接守护进程并接收增量，直到 stop_sniffing()"""
         self.is_running = True
-        try:
-            # 配置使用L3socket避免需要winpcap
-            if L3RawSocket and conf:
-                conf.L3socket = L3RawSocket
-            
-            # 在后台线程中定期检查不活跃的IP
-            checker_thread = Thread(target=self._check_loop, daemon=True)
-            checker_thread.start()
-            
-            # 开始嗅探ICMP包
-            if sniff:
-                sniff(filter="icmp", prn=self.packet_handler, store=0)
-        except PermissionError:
-            self.error_signal.emit("权限错误：需要管理员权限来捕获数据包，请以管理员身份运行此程序")
-        except Exception as e:
-            error_msg = str(e)
-            if "winpcap is not installed" in error_msg:
-                self.error_signal.emit("需要安装npcap或winpcap来捕获数据包，请访问https://nmap.org/npcap/下载安装")
-            else:
-                self.error_signal.emit(f"发生错误: {error_msg}")
-            
-    def _check_loop(self):
-        """定期检查不活跃IP的循环"""
-        while self.is_running:
-            time.sleep(1)
-            self.check_inactive_ips()
-    
+        self._stopped = stopped = Event()
+        reported = False
+        while not stopped.is_set():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError as e:
+                sock.close()
+                # 守护进程未启动时只提示一次
+                if not reported:
+                    reported = True
+                    self.error_signal.emit(f"无法连接抓包守护进程 {self.path}: {e}，"
+                                           f"每隔 {RECONNECT_INTERVAL:g} 秒重试")
+                stopped.wait(RECONNECT_INTERVAL)
+                continue
+            reported = False
+            self._socket = sock
+            if stopped.is_set():
+                # 连接期间已停止
+                sock.close()
+                break
+            try:
+                reason = self._receive(sock)
+            except (OSError, ValueError) as e:
+                reason = str(e)
+            finally:
+                sock.close()
+            if not stopped.is_set():
+                self.error_signal.emit(f"与抓包守护进程的连接断开: {reason}，正在重连")
+                stopped.wait(RECONNECT_INTERVAL)
+
+    def _receive(self, sock):
+        """接收并分发帧，返回连接结束的原因"""
+        decoder = FrameDecoder()
+        while True:
+            data = sock.recv(262144)
+            if not data:
+                return "守护进程关闭了连接"
+            for kind, value in decoder.feed(data):
+                if kind == FRAME_UPDATE:
+                    self.batch_update_signal.emit({int_to_ip(address): (timestamp, count, summary)
+                                                   for address, timestamp, count, summary in value})
+                elif kind == FRAME_START:
+                    self.new_ping_signal.emit(int_to_ip(value[0]), value[1])
+                elif kind == FRAME_STOP:
+                    self.stop_ping_signal.emit(int_to_ip(value[0]), value[2], value[4])
+                elif kind == FRAME_SWEEP:
+                    self.sweep_signal.emit(value)
+                elif kind == FRAME_STATS:
+                    self.stats = value
+                elif kind == FRAME_SNAPSHOT:
+                    self.snapshot_signal.emit([(int_to_ip(address), start_time, last_time, summary)
+                                               for address, start_time, last_time, _, summary in value])
+                elif kind == FRAME_ERROR:
+                    self.error_signal.emit(f"守护进程: {value}")
+                elif kind == FRAME_HELLO:
+                    self.stats = None
+
     def stop_sniffing(self):
-        """停止嗅探"""
+        """断开连接，守护进程继续抓包"""
         self.is_running = False
+        self._stopped.set()
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class IPRow:
+    """表格中的一行，缓存格式化后的显示文本
+
+    网段扫描的汇总行以 ('sweep', 扫描ID) 为 key，ip 为网段，hosts 为累计的源数。
+    """
+    __slots__ = ('key', 'ip', 'sort_key', 'start_time', 'last_time', 'status', 'start_text',
+                 'last_text', 'summary', 'hosts')
+
+    def __init__(self, ip, timestamp, text, key=None):
+        self.key = ip if key is None else key
+        self.ip = ip
+        # 网段按网络地址排序
+        self.sort_key = ip_to_int(ip.partition('/')[0])
+        self.start_time = timestamp
+        self.last_time = timestamp
+        self.status = 'pinging'
+        self.start_text = text
+        self.last_text = text
+        # source_stats.SourceStats.summary() 的结果
+        self.summary = None
+        self.hosts = None
+
+
+class IPTableModel(QAbstractTableModel):
+    """IP记录表格模型
+
+    每次更新只修改对应的一行并发出 dataChanged，不再重建整个表格。
+    """
+    HEADERS = ["IP地址", "开始时间", "最后活动时间", "状态",
+               "速率(包/秒)", "间隔P50/P95/P99(毫秒)", "载荷(字节)", "序号缺失/乱序",
+               "应答P50(毫秒)/未应答"]
+    # 排序使用的数据角色：IP按数值、时间按时间戳排序
+    SORT_ROLE = Qt.UserRole
+    STATUS_TEXT = {'pinging': "正在Ping", 'stopped': "已停止", 'sweeping': "扫描中"}
+    STATUS_COLOR = {'pinging': QColor(144, 238, 144),  # 浅绿色
+                    'stopped': QColor(255, 182, 193),  # 浅红色
+                    'sweeping': QColor(255, 215, 128)}  # 浅橙色
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = []
+        # ip -> 行号
+        self._index = {}
+        # 同一秒内的时间戳复用格式化结果
+        self._cached_second = None
+        self._cached_text = ''
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return row.ip
+            if column == 1:
+                return row.start_text
+            if column == 2:
+                return row.last_text
+            if column == 3:
+                if row.hosts is not None:
+                    return f"{self.STATUS_TEXT[row.status]} ({row.hosts} 个源)"
+                return self.STATUS_TEXT[row.status]
+            return self.stats_text(row.summary, column)
+        if role == Qt.BackgroundRole and column == 3:
+            return self.STATUS_COLOR[row.status]
+        if role == self.SORT_ROLE:
+            if column == 0:
+                return row.sort_key
+            if column == 1:
+                return row.start_time
+            if column == 2:
+                return row.last_time
+            if column == 3:
+                return row.status
+            return self.stats_sort_key(row.summary, column)
+        return None
+
+    @staticmethod
+    def stats_text(summary, column):
+        """统计列的显示文本"""
+        if summary is None:
+            return '-'
+        rate, p50, p95, p99, size_p50, gaps, reorders, reply_p50, _, unanswered = summary
+        if column == 4:
+            return f"{rate:.1f}"
+        if column == 5:
+            return f"{format_ms(p50)} / {format_ms(p95)} / {format_ms(p99)}"
+        if column == 6:
+            return '-' if size_p50 is None else str(size_p50)
+        if column == 7:
+            return f"{gaps} / {reorders}"
+        if unanswered is None:
+            return '-'
+        return f"{format_ms(reply_p50)} / {format_ratio(unanswered)}"
+
+    @staticmethod
+    def stats_sort_key(summary, column):
+        """统计列的排序键"""
+        if summary is None:
+            return -1
+        rate, p50, _, _, size_p50, gaps, reorders, _, _, unanswered = summary
+        if column == 4:
+            return rate
+        if column == 5:
+            return -1 if p50 is None else p50
+        if column == 6:
+            return -1 if size_p50 is None else size_p50
+        if column == 7:
+            return gaps + reorders
+        return -1 if unanswered is None else unanswered
+
+    def format_time(self, timestamp):
+        """格式化时间戳，同一秒内只格式化一次"""
+        second = int(timestamp)
+        if second != self._cached_second:
+            self._cached_second = second
+            self._cached_text = datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S')
+        return self._cached_text
+
+    def get(self, ip):
+        """返回IP对应的行，不存在时返回None"""
+        position = self._index.get(ip)
+        return None if position is None else self._rows[position]
+
+    def add(self, ip, timestamp):
+        """新增或重新开始一条记录"""
+        position = self._index.get(ip)
+        if position is not None:
+            row = self._rows[position]
+            row.start_time = timestamp
+            row.start_text = self.format_time(timestamp)
+            self.update(ip, timestamp, 'pinging')
+            return
+        position = len(self._rows)
+        self.beginInsertRows(QModelIndex(), position, position)
+        self._rows.append(IPRow(ip, timestamp, self.format_time(timestamp)))
+        self._index[ip] = position
+        self.endInsertRows()
+
+    def set_sweep(self, sweep):
+        """新增或更新网段扫描的汇总行，返回是否为新增"""
+        key = ('sweep', sweep.id)
+        position = self._index.get(key)
+        added = position is None
+        if added:
+            position = len(self._rows)
+            self.beginInsertRows(QModelIndex(), position, position)
+            self._rows.append(IPRow(sweep.cidr, sweep.start_time,
+                                    self.format_time(sweep.start_time), key))
+            self._index[key] = position
+            self.endInsertRows()
+        row = self._rows[position]
+        # 网段可能随新成员变宽
+        row.ip = sweep.cidr
+        row.sort_key = sweep.network
+        row.last_time = sweep.last_time
+        row.last_text = self.format_time(sweep.last_time)
+        row.status = 'stopped' if sweep.ended else 'sweeping'
+        row.hosts = sweep.hosts
+        self.dataChanged.emit(self.index(position, 0), self.index(position, len(self.HEADERS) - 1))
+        return added
+
+    def update(self, ip, timestamp, status, summary=None):
+        """更新一条记录的最后活动时间、状态和统计，不存在时返回False"""
+        position = self._index.get(ip)
+        if position is None:
+            return False
+        row = self._rows[position]
+        row.last_time = timestamp
+        row.last_text = self.format_time(timestamp)
+        row.status = status
+        if summary is not None:
+            row.summary = summary
+        self.dataChanged.emit(self.index(position, 1), self.index(position, len(self.HEADERS) - 1))
+        return True
+
+    def load(self, sessions):
+        """用 sessions [(IP, 开始时间, 最后时间戳, 统计摘要), ...] 替换全部记录，状态均为正在ping"""
+        self.beginResetModel()
+        self._rows = []
+        for ip, start_time, last_time, summary in sessions:
+            row = IPRow(ip, start_time, self.format_time(start_time))
+            row.last_time = last_time
+            row.last_text = self.format_time(last_time)
+            row.summary = summary
+            self._rows.append(row)
+        self._index = {row.key: position for position, row in enumerate(self._rows)}
+        self.endResetModel()
+
+    def remove_older_than(self, cutoff):
+        """删除最后活动时间早于 cutoff 的记录，返回删除的条数"""
+        keep = [row for row in self._rows if row.last_time >= cutoff]
+        removed = len(self._rows) - len(keep)
+        if removed:
+            self.beginResetModel()
+            self._rows = keep
+            self._index = {row.key: position for position, row in enumerate(keep)}
+            self.endResetModel()
+        return removed
+
+    def clear(self):
+        """清空所有记录"""
+        self.beginResetModel()
+        self._rows = []
+        self._index = {}
+        self.endResetModel()
 
 
 class MainWindow(QMainWindow):
     """主窗口类"""
     
-    def __init__(self):
+    def __init__(self, engine=None, connect=None):
         super().__init__()
         self.setWindowTitle("ICMP Ping 监控程序")
-        self.setGeometry(100, 100, 800, 600)
+        self.setGeometry(100, 100, 1200, 600)
         
         # 初始化UI
         self.init_ui()
         
-        # 初始化ICMP工作线程
-        self.icmp_worker = ICMPWorker()
+        # 初始化ICMP工作线程，订阅抓包引擎(capture_engine.CaptureEngine)的事件；
+        # 指定 connect 时改为显示抓包守护进程发来的增量，本进程不抓包
+        if connect is not None:
+            self.icmp_worker = DaemonClient(connect)
+            self.icmp_worker.snapshot_signal.connect(self.on_snapshot)
+            self.start_button.setText("连接守护进程")
+            self.stop_button.setText("断开连接")
+        else:
+            self.icmp_worker = ICMPWorker(engine)
         self.icmp_thread = None
         
         # 连接信号
         self.icmp_worker.new_ping_signal.connect(self.on_new_ping)
-        self.icmp_worker.update_ping_signal.connect(self.on_update_ping)
+        self.icmp_worker.batch_update_signal.connect(self.on_batch_update)
         self.icmp_worker.stop_ping_signal.connect(self.on_stop_ping)
+        self.icmp_worker.sweep_signal.connect(self.on_sweep)
         self.icmp_worker.error_signal.connect(self.on_error)
         
         # 设置定时器定期清理过期记录
@@ -186,8 +544,15 @@ class MainWindow(QMainWindow):
         self.cleanup_timer.timeout.connect(self.cleanup_old_records)
         self.cleanup_timer.start(10000)  # 每10秒检查一次
         
-        # 存储IP记录信息
-        self.ip_records = {}  # {ip: {start_time, last_time, status}}
+        # 设置定时器定期刷新抓包统计
+        self.stats_timer = QTimer()
+        self.stats_timer.timeout.connect(self.update_filter_stats)
+        self.stats_timer.start(1000)
+        self.batches_received = 0
+        self.stats_time = time.time()
+        self.sketch_active = False
+        self.sampling_rate = 1
+        
         
     def init_ui(self):
         """初始化用户界面"""
@@ -228,9 +593,17 @@ class MainWindow(QMainWindow):
         main_layout.addLayout(button_layout)
         
         # 创建表格显示IP记录
-        self.table = QTableWidget()
-        self.table.setColumnCount(4)
-        self.table.setHorizontalHeaderLabels(["IP地址", "开始时间", "最后活动时间", "状态"])
+        # 模型只保存IP记录，排序由代理模型按数值键完成
+        self.ip_model = IPTableModel(self)
+        self.proxy_model = QSortFilterProxyModel(self)
+        self.proxy_model.setSourceModel(self.ip_model)
+        self.proxy_model.setSortRole(IPTableModel.SORT_ROLE)
+        self.proxy_model.setDynamicSortFilter(True)
+        
+        self.table = QTableView()
+        self.table.setModel(self.proxy_model)
+        self.table.setSortingEnabled(True)
+        self.table.sortByColumn(0, Qt.AscendingOrder)
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.table.verticalHeader().setVisible(False)
         self.table.setAlternatingRowColors(True)
@@ -241,6 +614,16 @@ class MainWindow(QMainWindow):
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage("准备就绪")
         
+        # 状态栏右侧常驻显示抓包统计
+        self.filter_stats_label = QLabel()
+        self.status_bar.addPermanentWidget(self.filter_stats_label)
+        self.refresh_stats_label = QLabel()
+        self.status_bar.addPermanentWidget(self.refresh_stats_label)
+        # 估算模式下显示不同源数量和请求最多的源，完整列表在提示中
+        self.sketch_label = QLabel()
+        self.sketch_label.setVisible(False)
+        self.status_bar.addPermanentWidget(self.sketch_label)
+        
         # 创建日志输出区域
         self.log_text = QTextEdit()
         self.log_text.setMaximumHeight(100)
@@ -257,7 +640,10 @@ class MainWindow(QMainWindow):
         self.icmp_thread = Thread(target=self.icmp_worker.start_sniffing, daemon=True)
         self.icmp_thread.start()
         
-        self.log_message("开始监控ICMP ping请求...")
+        if isinstance(self.icmp_worker, DaemonClient):
+            self.log_message(f"连接抓包守护进程 {self.icmp_worker.path}...")
+        else:
+            self.log_message("开始监控ICMP ping请求...")
         
     def stop_monitoring(self):
         """停止监控"""
@@ -266,152 +652,124 @@ class MainWindow(QMainWindow):
         self.status_bar.showMessage("正在停止监控...")
         
         self.icmp_worker.stop_sniffing()
+        if isinstance(self.icmp_worker, DaemonClient):
+            self.log_message("已断开与抓包守护进程的连接，守护进程继续抓包")
+            self.status_bar.showMessage("已断开连接")
+            return
         self.log_message("监控已停止")
         self.status_bar.showMessage("监控已停止")
         
     def clear_records(self):
         """清空记录"""
-        self.table.setRowCount(0)
-        self.ip_records.clear()
+        self.ip_model.clear()
         self.log_message("记录已清空")
         
     def on_new_ping(self, ip, timestamp):
         """处理新ping事件"""
-        # 更新记录
-        self.ip_records[ip] = {
-            'start_time': timestamp,
-            'last_time': timestamp,
-            'status': 'pinging'
-        }
-        
-        # 更新UI
-        self.update_table()
+        # 更新记录，只影响这一行
+        self.ip_model.add(ip, timestamp)
         self.log_message(f"[{datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')}] {ip} 开始ping本机")
         self.status_bar.showMessage(f"检测到新的ping请求: {ip}")
         
-    def on_update_ping(self, ip, timestamp):
-        """处理ping更新事件"""
-        if ip in self.ip_records:
-            self.ip_records[ip]['last_time'] = timestamp
-            self.ip_records[ip]['status'] = 'pinging'
-            
-            # 更新UI
-            self.update_table()
+    def on_snapshot(self, sessions):
+        """连接到抓包守护进程时，用其快照替换表格中的记录"""
+        self.ip_model.load(sessions)
+        self.log_message(f"已连接抓包守护进程，{len(sessions)} 个源正在ping本机")
+        self.status_bar.showMessage("已连接抓包守护进程")
+
+    def on_warm_start(self, message):
+        """从状态快照热启动后，显示恢复的仍在ping的源"""
+        self.ip_model.load(self.icmp_worker.active_sessions())
+        self.log_message(message)
+
+    def on_batch_update(self, batch):
+        """处理一个刷新间隔内合并的ping更新事件"""
+        for ip, (timestamp, _, summary) in batch.items():
+            self.ip_model.update(ip, timestamp, 'pinging', summary)
+        self.batches_received += 1
             
-    def on_stop_ping(self, ip, timestamp):
+    def on_stop_ping(self, ip, timestamp, summary):
         """处理停止ping事件"""
-        if ip in self.ip_records:
-            self.ip_records[ip]['last_time'] = timestamp
-            self.ip_records[ip]['status'] = 'stopped'
-            
-            # 更新UI
-            self.update_table()
+        if self.ip_model.update(ip, timestamp, 'stopped', summary):
             self.log_message(f"[{datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')}] {ip} 停止ping本机")
             self.status_bar.showMessage(f"检测到停止ping: {ip}")
             
+    def on_sweep(self, sweep):
+        """处理网段扫描的开始、更新和结束"""
+        if self.ip_model.set_sweep(sweep):
+            self.log_message(f"[{self.ip_model.format_time(sweep.start_time)}] 发现来自 {sweep.cidr} 的扫描 "
+                             f"({sweep.active} 个源同时ping本机)")
+            self.status_bar.showMessage(f"检测到网段扫描: {sweep.cidr}")
+        elif sweep.ended:
+            self.log_message(f"[{self.ip_model.format_time(sweep.last_time)}] 来自 {sweep.cidr} 的扫描结束 "
+                             f"(共 {sweep.hosts} 个源, {sweep.requests} 个请求)")
+            self.status_bar.showMessage(f"网段扫描结束: {sweep.cidr}")
+
     def on_error(self, error_msg):
         """处理错误信息"""
         self.log_message(f"错误: {error_msg}")
         self.status_bar.showMessage(f"错误: {error_msg}")
         
-    def update_table(self):
-        """更新表格显示"""
-        # 清空表格
-        self.table.setRowCount(0)
-        self.table.setRowCount(len(self.ip_records))
-        
-        # 填充数据
-        row = 0
-        for ip, record in self.ip_records.items():
-            # IP地址
-            ip_item = QTableWidgetItem(ip)
-            self.table.setItem(row, 0, ip_item)
-            
-            # 开始时间
-            start_time = datetime.fromtimestamp(record['start_time']).strftime('%Y-%m-%d %H:%M:%S')
-            start_item = QTableWidgetItem(start_time)
-            self.table.setItem(row, 1, start_item)
-            
-            # 最后活动时间
-            last_time = datetime.fromtimestamp(record['last_time']).strftime('%Y-%m-%d %H:%M:%S')
-            last_item = QTableWidgetItem(last_time)
-            self.table.setItem(row, 2, last_item)
-            
-            # 状态
-            status = record['status']
-            status_item = QTableWidgetItem(status)
-            if status == 'pinging':
-                status_item.setBackground(QColor(144, 238, 144))  # 浅绿色
-                status_item.setText("正在Ping")
+    def update_filter_stats(self):
+        """刷新状态栏中的抓包统计和界面刷新统计"""
+        rejected, received = self.icmp_worker.filter_stats()
+        if not self.icmp_worker.kernel_filtered():
+            text = f"已处理: {received}"
+        elif rejected is None:
+            text = f"内核过滤: 送达 {received}"
+        else:
+            text = f"内核过滤: 丢弃 {rejected} / 送达 {received}"
+        drops = self.icmp_worker.kernel_drops()
+        if drops is not None:
+            text += f" | 内核丢包: {drops}"
+        replies = self.icmp_worker.reply_counts()
+        if replies is not None:
+            text += f" | 应答配对: {replies[0]} | 等待应答: {replies[1]}"
+        sampling = self.icmp_worker.sampling_counts()
+        if sampling is not None:
+            rate, shed, estimated = sampling
+            if rate > 1:
+                text += f" | 采样 1/{rate}: 约 {estimated} 个活跃源，未处理 {shed}"
+            self.update_sampling(rate)
+        self.filter_stats_label.setText(text)
+        
+        # 实际达到的刷新频率和合并掉的更新事件数
+        now = time.time()
+        rate = self.batches_received / max(now - self.stats_time, 1e-6)
+        self.batches_received = 0
+        self.stats_time = now
+        self.refresh_stats_label.setText(
+            f"刷新: {rate:.1f} Hz | 已合并: {self.icmp_worker.updates_merged}")
+        self.update_sketch()
+
+    def update_sampling(self, rate):
+        """过载采样倍数变化时记录日志"""
+        previous, self.sampling_rate = self.sampling_rate, rate
+        if rate > previous:
+            self.log_message(f"处理跟不上，切换到 1/{rate} 采样: 只显示按地址哈希选中的新源，"
+                             f"已在ping的源不受影响")
+        elif rate < previous:
+            self.log_message(f"负载下降，采样调整为 1/{rate}" if rate > 1 else "负载已恢复，恢复全量处理")
+
+    def update_sketch(self):
+        """刷新估算模式的显示，进入或退出估算模式时记录日志"""
+        summary = self.icmp_worker.sketch_summary()
+        if summary is None:
+            return
+        active, distinct, top = summary
+        if active != self.sketch_active:
+            self.sketch_active = active
+            self.sketch_label.setVisible(active)
+            if active:
+                self.log_message(f"活跃源达到 {self.icmp_worker.sketch_threshold} 个，切换到估算模式，"
+                                 f"新的源不再逐行显示")
             else:
-                status_item.setBackground(QColor(255, 182, 193))  # 浅红色
-                status_item.setText("已停止")
-            self.table.setItem(row, 3, status_item)
-            
-            row += 1
-            
-        # 根据IP地址排序（按数字排序而非字符串排序）
-        if len(self.ip_records) > 1:
-            self._sort_table_by_ip()
+                self.log_message("不同源数量已回落，恢复逐个记录")
+        if active:
+            self.sketch_label.setText(f"估算模式: 约 {distinct} 个源 | 最多: {format_top(top, 3)}")
+            self.sketch_label.setToolTip(f"最近 {DEFAULT_WINDOW:g} 秒约 {distinct} 个不同源\n"
+                                         f"请求最多的源:\n" + format_top(top, len(top)).replace(', ', '\n'))
         
-    def _sort_table_by_ip(self):
-        """根据IP地址进行数字排序"""
-        try:
-            # 获取所有行数据
-            rows = []
-            for row in range(self.table.rowCount()):
-                ip_item = self.table.item(row, 0)
-                if ip_item:
-                    rows.append((ip_item.text(), row))
-            
-            # 按IP地址数字排序
-            def ip_to_tuple(ip):
-                try:
-                    return tuple(int(i) for i in ip.split('.'))
-                except:
-                    return (0, 0, 0, 0)
-            
-            rows.sort(key=lambda x: ip_to_tuple(x[0]))
-            
-            # 保存当前表格的所有数据
-            table_data = []
-            for original_row in range(self.table.rowCount()):
-                row_data = []
-                for col in range(self.table.columnCount()):
-                    item = self.table.item(original_row, col)
-                    if item:
-                        # 保存项目的文本、背景色和显示文本
-                        row_data.append({
-                            'text': item.text(),
-                            'background': item.background(),
-                            'display_text': item.text()
-                        })
-                    else:
-                        row_data.append({
-                            'text': '',
-                            'background': None,
-                            'display_text': ''
-                        })
-                table_data.append(row_data)
-            
-            # 按排序后的顺序重新排列数据
-            sorted_data = []
-            for ip, original_row in rows:
-                sorted_data.append(table_data[original_row])
-            
-            # 重新填充表格
-            for i, row_data in enumerate(sorted_data):
-                for col, item_data in enumerate(row_data):
-                    item = QTableWidgetItem(item_data['text'])
-                    if item_data['background']:
-                        item.setBackground(item_data['background'])
-                    if item_data['display_text'] and item_data['display_text'] != item_data['text']:
-                        item.setText(item_data['display_text'])
-                    self.table.setItem(i, col, item)
-        except Exception as e:
-            # 如果排序出错，至少保持原有数据显示
-            pass
-    
     def log_message(self, message):
         """添加日志消息"""
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -421,19 +779,9 @@ class MainWindow(QMainWindow):
         
     def cleanup_old_records(self):
         """清理过期记录（超过1小时没有活动的记录）"""
-        current_time = time.time()
-        expired_ips = []
-        
-        for ip, record in self.ip_records.items():
-            if current_time - record['last_time'] > 3600:  # 1小时
-                expired_ips.append(ip)
-                
-        for ip in expired_ips:
-            del self.ip_records[ip]
-            
-        if expired_ips:
-            self.update_table()
-            self.log_message(f"已清理 {len(expired_ips)} 条过期记录")
+        removed = self.ip_model.remove_older_than(time.time() - 3600)  # 1小时
+        if removed:
+            self.log_message(f"已清理 {removed} 条过期记录")
             
     def closeEvent(self, event):
         """窗口关闭事件"""
@@ -441,17 +789,87 @@ class MainWindow(QMainWindow):
         event.accept()
 
 
+def parse_args(argv=None):
+    """解析命令行参数，未识别的参数留给Qt处理"""
+    parser = argparse.ArgumentParser(description="ICMP Ping 监控程序 - 图形界面版本")
+    add_capture_arguments(parser)
+    parser.add_argument('--connect', nargs='?', const=DEFAULT_SOCKET_PATH, metavar='SOCKET',
+                        help=f"不在本进程抓包，改为显示抓包守护进程(capture_daemon.py)的数据（默认 {DEFAULT_SOCKET_PATH}），"
+                             f"抓包相关的参数在守护进程中指定")
+    return parser.parse_known_args(argv)
+
+
 def main():
-    app = QApplication(sys.argv)
+    args, qt_args = parse_args()
+    app = QApplication(sys.argv[:1] + qt_args)
     
     # 设置应用程序样式
     app.setStyle('Fusion')
     
-    window = MainWindow()
+    if args.connect:
+        window = MainWindow(connect=args.connect)
+        window.show()
+        # 打开窗口即连接，守护进程尚未启动时自动重试
+        window.start_monitoring()
+        sys.exit(app.exec_())
+    
+    engine = CaptureEngine(**engine_options(args))
+    errors = []
+    error = capture_arguments_error(args)
+    if error is not None:
+        # 参数有误时不保存也不恢复快照
+        errors.append(error)
+        args.state = None
+    history = None
+    if args.db:
+        try:
+            history = SessionHistory(args.db)
+            engine.add_history(history)
+        except sqlite3.Error as e:
+            errors.append(f"无法打开会话历史数据库 {args.db}: {e}")
+    output = None
+    if args.jsonl:
+        # 与界面共用一次抓包的 JSON Lines 输出
+        try:
+            output = EventOutput('jsonl', args.jsonl)
+            engine.add_output(output)
+        except OSError as e:
+            errors.append(f"无法打开事件输出 {args.jsonl}: {e}")
+    
+    state = StateSnapshots(args.state, args.state_interval) if args.state else None
+    if state is not None:
+        engine.add_state(state)
+    window = MainWindow(engine)
     window.show()
+    for error in errors:
+        window.on_error(error)
+    if state is not None:
+        if args.warm_start:
+            window.on_warm_start(state.warm_start(window.icmp_worker.sources))
+        state.start(window.icmp_worker.sources)
+    if engine.engine == 'scapy':
+        # 窗口显示后在后台预先导入Scapy，点击开始监控时不必再等待
+        Thread(target=load_scapy, daemon=True).start()
+    try:
+        exporters = start_exporters(window.icmp_worker.metrics, args.metrics_port, args.stats_interval)
+    except OSError as e:
+        window.on_error(f"无法启动指标服务: {e}")
+        exporters = []
     
-    sys.exit(app.exec_())
+    status = app.exec_()
+    for exporter in exporters:
+        exporter.close()
+    if state is not None and not state.close():
+        print(f"无法保存源状态快照 {args.state}: {state.error}", file=sys.stderr)
+    window.icmp_worker.save_active_sessions()
+    # 各订阅者处理完队列中的事件后才能关闭会话历史和输出
+    engine.close()
+    if history is not None:
+        history.close()
+    if output is not None:
+        output.close()
+    sys.exit(status)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
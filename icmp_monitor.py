@@ -1,10 +1,23 @@
 import sys
 import time
-from collections import defaultdict
-from datetime import datetime
 import os
 import platform
 import io
+import argparse
+import functools
+import sqlite3
+import threading
+
+from scapy_backend import load_scapy, scapy_error
+from capture_engine import (CaptureEngine, add_capture_arguments, capture_arguments_error,
+                            engine_options)
+from pcap_reader import PcapReplay
+from event_output import EventOutput, FORMATTERS, OUTPUT_FORMATS
+from metrics import start_exporters
+from source_sketch import format_top, DEFAULT_WINDOW
+from session_history import (SessionHistory, query_sessions, parse_time, parse_address_range,
+                             DEFAULT_HISTORY_PATH, DEFAULT_QUERY_LIMIT)
+from state_snapshot import StateSnapshots
 
 def change_default_encoding():
     """判断是否在 windows git-bash 下运行，是则使用 utf-8 编码"""
@@ -15,142 +28,335 @@ def change_default_encoding():
             sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
 
+# 估算模式下每隔多少秒输出一次请求最多的源和不同源数量
+SKETCH_REPORT_INTERVAL = 10.0
 
-# 初始化Scapy相关变量
-sniff = None
-ICMP = None
-IP = None
-conf = None
-L3RawSocket = None
-SCAPY_AVAILABLE = False
-
-# 尝试导入Scapy模块
-try:
-    import importlib
-    scapy_all = importlib.import_module('scapy.all')
-    # 使用getattr安全地获取模块属性
-    sniff = getattr(scapy_all, 'sniff', None)
-    ICMP = getattr(scapy_all, 'ICMP', None)
-    IP = getattr(scapy_all, 'IP', None)
-    conf = getattr(scapy_all, 'conf', None)
-    
-    # 尝试导入L3RawSocket
-    try:
-        scapy_arch = importlib.import_module('scapy.arch')
-        L3RawSocket = getattr(scapy_arch, 'L3RawSocket', None)
-    except ImportError:
-        try:
-            scapy_supersocket = importlib.import_module('scapy.supersocket')
-            L3RawSocket = getattr(scapy_supersocket, 'L3RawSocket', None)
-        except ImportError:
-            pass
-    
-    SCAPY_AVAILABLE = all([sniff, ICMP, IP, conf])
-except ImportError:
-    print("警告: Scapy未安装或不可用，将使用基本模式运行")
 
 class ICMPPingMonitor:
-    def __init__(self):
-        # 存储每个IP的ping信息
-        self.ping_records = defaultdict(dict)
-        # 记录上次更新时间，用于检测ping是否停止
-        self.last_update = defaultdict(float)
-        # 存储活跃的IP列表
-        self.active_ips = set()
-        
-    def packet_handler(self, packet):
-        """处理捕获到的数据包"""
-        if SCAPY_AVAILABLE and ICMP and IP and packet.haslayer(ICMP) and packet.haslayer(IP):
-            # 只处理ICMP Echo Request (type=8)
-            if packet[ICMP].type == 8:
-                src_ip = packet[IP].src
-                timestamp = time.time()
-                
-                # 如果是第一次看到这个IP
-                if src_ip not in self.ping_records:
-                    self.ping_records[src_ip]['start_time'] = timestamp
-                    sys.stdout.flush()
-                    print(f"[{datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')}] {src_ip} 开始ping本机")
-                else:
-                    # 更新最后活动时间
-                    self.ping_records[src_ip]['last_time'] = timestamp
-                    
-                # 更新活跃状态
-                self.last_update[src_ip] = timestamp
-                self.active_ips.add(src_ip)
-                
-    def check_inactive_ips(self):
-        """检查不活跃的IP并更新状态"""
-        current_time = time.time()
-        inactive_ips = []
-        
-        # 检查超过3秒没有活动的IP
-        for ip in self.active_ips:
-            if current_time - self.last_update[ip] > 3:
-                inactive_ips.append(ip)
-                
-        # 移除不活跃的IP并打印停止信息
-        for ip in inactive_ips:
-            self.active_ips.discard(ip)
-            last_time = self.last_update[ip]
-            sys.stdout.flush()
-            print(f"[{datetime.fromtimestamp(last_time).strftime('%Y-%m-%d %H:%M:%S')}] {ip} 停止ping本机")
-            
-    def start_monitoring(self):
-        """开始监控ICMP包"""
-        if not SCAPY_AVAILABLE:
-            print("错误: 需要安装Scapy库来监控ICMP包")
-            print("请运行 'pip install scapy' 安装Scapy")
+    """命令行前端: 订阅抓包引擎(capture_engine.CaptureEngine)的事件，写到 output 并打印提示
+
+    抓包、会话跟踪和停止检测都在引擎中完成；extra_outputs 中的其他输出(event_output.EventOutput)
+    各自订阅事件总线，只增加格式化和写出的开销。其余关键字参数原样传给 CaptureEngine。
+    """
+
+    def __init__(self, output=None, history=None, state=None, extra_outputs=(), **options):
+        self.engine = CaptureEngine(**options)
+        self.sources = self.engine.sources
+        self.metrics = self.engine.metrics
+        # 基准测试直接调用处理函数和不活跃检查
+        self.handle_echo = self.engine.handle_echo
+        self.check_inactive_ips = self.engine.check_inactive_ips
+        # 开始/停止事件的输出(event_output.EventOutput)，默认为写到标准输出的文本；
+        # 采样倍数变化和抓包错误的提示与事件在同一个分发线程中按顺序处理
+        self.output = output if output is not None else EventOutput()
+        self._console = self.engine.add_output(self.output, 'console',
+                                               {'sampling': self.on_sampling_change, 'error': self.log})
+        for index, extra in enumerate(extra_outputs, 1):
+            self.engine.add_output(extra, f'output-{index}')
+        # 会话历史(session_history.SessionHistory)和源状态快照(state_snapshot.StateSnapshots)，为None时不保存
+        if history is not None:
+            self.engine.add_history(history)
+        if state is not None:
+            self.engine.add_state(state)
+        self._sketch_active = False
+        self._next_sketch_report = 0.0
+
+    @property
+    def capture(self):
+        """引擎当前的抓包器"""
+        return self.engine.capture
+
+    def on_sampling_change(self, rate, previous, busy=None, lag=None):
+        """采样倍数变化: 之后的事件带上新的倍数并打印提示，在输出的分发线程中调用"""
+        self.output.sampling(rate)
+        moment = time.strftime('%Y-%m-%d %H:%M:%S')
+        if rate > previous:
+            load = f"（收包线程占用 {busy:.0%}，积压 {lag:.2f} 秒）" if busy is not None else ""
+            self.log(f"[{moment}] 处理跟不上{load}，切换到 1/{rate} 采样: "
+                     f"只跟踪按地址哈希选中的新源，已在ping的源不受影响")
+        elif rate > 1:
+            self.log(f"[{moment}] 负载下降，采样调整为 1/{rate}")
+        else:
+            self.log(f"[{moment}] 负载已恢复，恢复全量处理")
+
+    def log(self, message=''):
+        """打印提示信息，先写出已发布的事件以保持先后顺序；事件占用标准输出时改写到标准错误"""
+        self._console.flush()
+        self.output.flush()
+        print(message, file=sys.stderr if self.output.owns_stdout else sys.stdout)
+
+    def report_sketch(self, now, force=False):
+        """估算模式切换时，以及估算模式下每隔 SKETCH_REPORT_INTERVAL 秒打印一次估算结果"""
+        summary = self.engine.sketch_summary(now)
+        if summary is None:
             return
-            
-        print("开始监控ICMP ping请求...")
-        print("按 Ctrl+C 停止监控")
-        
+        active, distinct, top = summary
+        moment = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+        if active != self._sketch_active:
+            self._sketch_active = active
+            if active:
+                self.log(f"[{moment}] 活跃源达到 {self.engine.sketch_threshold} 个，切换到估算模式: "
+                         f"新的源不再逐个记录和输出开始/停止")
+                self._next_sketch_report = now
+            else:
+                self.log(f"[{moment}] 不同源数量已回落，恢复逐个记录")
+        if active and (force or now >= self._next_sketch_report):
+            self._next_sketch_report = now + SKETCH_REPORT_INTERVAL
+            self.log(f"[{moment}] 估算模式: 最近 {DEFAULT_WINDOW:g} 秒约 {distinct} 个不同源，请求最多: {format_top(top)}")
+
+    def replay(self, path):
+        """回放抓包文件，用记录时间戳代替当前时间驱动开始/停止检测"""
+        engine = self.engine
+        reader = engine.capture = PcapReplay(path)
+        # 回放速度与实时负载无关，包时间也不能用来衡量积压，不采样也不记录积压
+        engine.sources.shedder = None
+        engine.live = False
+        expiry = engine.sources.expiry
+        handle_echo = engine.handle_echo
+        check_inactive_ips = engine.check_inactive_ips
+        report_sketch = self.report_sketch if engine.sketch_threshold else None
+        never = float('inf')
+        next_check = never
+        next_report = 0.0
+
+        def handle(src, timestamp, ident=0, seq=0, size=0):
+            nonlocal next_check, next_report
+            # 包时间越过最早的截止时间时才检查，新源的截止时间不会早于已有的
+            if timestamp > next_check:
+                check_inactive_ips(timestamp)
+                next_check = expiry.next_deadline() or never
+            if report_sketch is not None and timestamp >= next_report:
+                report_sketch(timestamp)
+                next_report = timestamp + 1.0
+            handle_echo(src, timestamp, ident, seq, size)
+            if next_check is never:
+                next_check = expiry.next_deadline() or never
+
+        self.log(f"回放抓包文件: {path}")
+        started = time.perf_counter()
         try:
-            # 在后台线程中定期检查不活跃的IP
-            import threading
-            def check_inactive():
+            # 应答不影响停止检测，直接交给 handle_reply 配对
+            reader.run(handle, reply_handler=engine.reply_handler())
+        except (OSError, ValueError) as e:
+            self.log(f"发生错误: {e}")
+            return
+        # 文件结束时仍在ping的源按最后一个请求的时间结束
+        check_inactive_ips(never)
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        self.log(f"回放完成: {reader.packets_seen} 个包（{reader.packets_matched} 个Echo请求），"
+              f"耗时 {elapsed:.2f} 秒，{reader.packets_seen / elapsed:,.0f} 包/秒，"
+              f"{reader.bytes_read / elapsed / 1e6:.1f} MB/秒")
+        if engine.replies is not None:
+            self.print_reply_stats()
+
+    def print_filter_stats(self):
+        """打印内核过滤统计"""
+        engine = self.engine
+        rejected, received = engine.filter_stats()
+        if engine.echo_filter is None:
+            self.log(f"共处理 {received} 个ICMP包")
+        elif rejected is None:
+            self.log(f"送达处理函数 {received} 个包（当前系统无法统计内核过滤丢弃数）")
+        else:
+            self.log(f"内核过滤丢弃 {rejected} 个ICMP包，送达处理函数 {received} 个包")
+        drops = engine.kernel_drops()
+        if drops is not None:
+            self.log(f"环形缓冲区溢出丢包 {drops} 个")
+        if engine.sketch_threshold:
+            self.report_sketch(time.time(), force=True)
+        if engine.replies is not None:
+            self.print_reply_stats()
+        if engine.max_sampling > 1:
+            rate, shed, _ = engine.sampling_counts()
+            self.log(f"过载采样: 共有 {shed} 个请求未处理，当前采样 1/{rate}")
+
+    def print_reply_stats(self):
+        """打印应答配对统计"""
+        matched, unmatched, in_flight, expired, overflowed = self.engine.reply_counts()
+        self.log(f"应答配对: 配对成功 {matched} 个，未配对的应答 {unmatched} 个，"
+                 f"超时未应答 {expired} 个，在途索引已满而放弃 {overflowed} 个，仍在等待 {in_flight} 个")
+
+    def start_monitoring(self):
+        """开始监控ICMP包，直到 Ctrl+C"""
+        engine = self.engine
+        if engine.engine == 'scapy' and engine.workers == 1 and load_scapy() is None:
+            self.log(f"错误: 需要安装Scapy库来监控ICMP包 ({scapy_error()})")
+            self.log("请运行 'pip install scapy' 安装Scapy")
+            return
+
+        if engine.workers > 1:
+            self.log(f"开始监控ICMP ping请求... (抓包引擎: {engine.engine}, {engine.workers} 个工作进程)")
+        else:
+            self.log(f"开始监控ICMP ping请求... (抓包引擎: {engine.engine})")
+        self.log("按 Ctrl+C 停止监控")
+        if engine.echo_filter is not None:
+            self.log(f"内核过滤: 只接收Echo请求 ({engine.echo_filter.describe()})")
+        raw_socket = engine.engine in ('raw', 'asyncio') and engine.workers == 1
+        if engine.replies is not None and raw_socket and platform.system() == 'Linux':
+            self.log("提示: Linux 的原始套接字收不到本机发出的应答，只有回环接口上的ping能配对；"
+                     "请使用 ring 或 scapy 引擎")
+        if engine.sketch_threshold:
+            # 估算模式的切换和估算结果由后台线程每秒检查一次
+            def report_sketch():
                 while True:
-                    time.sleep(1)
-                    self.check_inactive_ips()
-                    
-            checker_thread = threading.Thread(target=check_inactive, daemon=True)
-            checker_thread.start()
-            
-            # 配置使用L3socket避免需要winpcap
-            if L3RawSocket and conf:
-                conf.L3socket = L3RawSocket
-            
-            # 开始嗅探ICMP包
-            if sniff:
-                sniff(filter="icmp", prn=self.packet_handler, store=0)
-            
+                    time.sleep(1.0)
+                    self.report_sketch(time.time())
+
+            threading.Thread(target=report_sketch, daemon=True).start()
+
+        try:
+            engine.run()
         except KeyboardInterrupt:
-            print("\n监控已停止")
+            engine.stop()
+            self.log("\n监控已停止")
+            engine.save_active_sessions()
+            self.print_filter_stats()
         except PermissionError:
-            print("错误: 需要管理员权限来捕获数据包")
-            print("请以管理员身份运行此程序")
+            self.log("错误: 需要管理员权限来捕获数据包")
+            self.log("请以管理员身份运行此程序")
         except Exception as e:
-            print(f"发生错误: {e}")
-            print("请确保以管理员身份运行此程序")
+            self.log(f"发生错误: {e}")
+            self.log("请确保以管理员身份运行此程序")
+
+    def close(self):
+        """处理完已发布的事件，之后才能关闭输出和会话历史"""
+        self.engine.close()
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="ICMP Ping 监控程序")
+    add_capture_arguments(parser, refresh=False)
+    parser.add_argument('--read', metavar='FILE',
+                        help="回放 pcap/pcapng 抓包文件而不是实时抓包，按包时间检测开始/停止，不需要管理员权限")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='text',
+                        help="事件输出格式: text(默认，中文文本) 或 jsonl(每行一个JSON对象，"
+                             "包含ip、事件类型、开始/最后时间和计数)")
+    parser.add_argument('--output', metavar='TARGET',
+                        help="事件输出目标: 文件路径（追加写入）或 unix:套接字路径，默认标准输出")
+    parser.add_argument('--history', action='store_true',
+                        help=f"查询 --db 指定的会话历史（默认 {DEFAULT_HISTORY_PATH}）后退出，不需要管理员权限")
+    parser.add_argument('--since', type=parse_time, metavar='TIME',
+                        help="只查询此后结束的会话: 30m/2h/7d（距今）、'2024-01-15 14:30' 或Unix时间戳")
+    parser.add_argument('--until', type=parse_time, metavar='TIME', help="只查询此前结束的会话，格式同 --since")
+    parser.add_argument('--ip', type=parse_address_range, metavar='ADDRESS',
+                        help="只查询该地址或网段（CIDR）的会话")
+    parser.add_argument('--limit', type=int, default=DEFAULT_QUERY_LIMIT, metavar='N',
+                        help=f"最多显示最近的N个会话（默认 {DEFAULT_QUERY_LIMIT}）")
+    return parser.parse_args(argv)
+
+
+def print_history(args):
+    """--history: 查询会话历史并按 --format 输出"""
+    path = args.db or DEFAULT_HISTORY_PATH
+    if not os.path.exists(path):
+        print(f"会话历史数据库不存在: {path}", file=sys.stderr)
+        return
+    started = time.perf_counter()
+    try:
+        sessions = query_sessions(path, args.since, args.until, args.ip, args.limit)
+    except sqlite3.Error as e:
+        print(f"无法查询会话历史 {path}: {e}", file=sys.stderr)
+        return
+    elapsed = time.perf_counter() - started
+    formatter = FORMATTERS[args.format]()
+    for src, start_time, last_time, count, summary in sessions:
+        print(formatter.session(src, start_time, last_time, count, summary))
+    more = "（已达到 --limit，只显示最近的会话）" if len(sessions) >= args.limit else ""
+    print(f"共 {len(sessions)} 个会话{more}，查询耗时 {elapsed * 1000:.1f} 毫秒", file=sys.stderr)
+
 
 def main():
-    print("ICMP Ping 监控程序")
-    print("=====================")
-    print("功能说明:")
-    print("1. 监控所有对本机的ICMP Echo请求(ping)")
-    print("2. 显示开始ping的IP地址和时间")
-    print("3. 当IP停止ping时显示停止时间")
-    print("4. 实时显示ping状态")
-    print()
-    print("使用说明:")
-    print("- 需要以管理员权限运行此程序")
-    print("- 需要安装Scapy库 (pip install scapy)")
-    print("- 按 Ctrl+C 停止监控")
-    print()
+    args = parse_args()
+    if args.history:
+        print_history(args)
+        return
+    try:
+        output = EventOutput(args.format, args.output)
+    except OSError as e:
+        print(f"无法打开事件输出 {args.output}: {e}")
+        return
+    outputs = [output]
+    if args.jsonl:
+        try:
+            outputs.append(EventOutput('jsonl', args.jsonl))
+        except OSError as e:
+            print(f"无法打开事件输出 {args.jsonl}: {e}")
+            output.close()
+            return
+
+    def close_outputs():
+        for item in outputs:
+            item.close()
+
+    # 结构化事件写到标准输出时，说明文字改写到标准错误
+    log = functools.partial(print, file=sys.stderr if output.owns_stdout else sys.stdout)
+    log("ICMP Ping 监控程序")
+    log("=====================")
+    log("功能说明:")
+    log("1. 监控所有对本机的ICMP Echo请求(ping)")
+    log("2. 显示开始ping的IP地址和时间")
+    log("3. 当IP停止ping时显示停止时间")
+    log("4. 实时显示ping状态")
+    log()
+    log("使用说明:")
+    log("- 需要以管理员权限运行此程序")
+    log("- 需要安装Scapy库 (pip install scapy)，使用 raw/ring/asyncio 引擎时不需要")
+    log("- 按 Ctrl+C 停止监控")
+    log()
     
-    monitor = ICMPPingMonitor()
-    monitor.start_monitoring()
+    error = capture_arguments_error(args)
+    if error is None and args.state and args.read:
+        error = "--state 不能与 --read 同时使用"
+    if error is not None:
+        log(f"错误: {error}")
+        close_outputs()
+        return
+    state = StateSnapshots(args.state, args.state_interval) if args.state else None
+    history = None
+    if args.db:
+        try:
+            history = SessionHistory(args.db)
+        except sqlite3.Error as e:
+            log(f"无法打开会话历史数据库 {args.db}: {e}")
+            close_outputs()
+            return
+    monitor = ICMPPingMonitor(output=output, history=history, state=state, extra_outputs=outputs[1:],
+                              **engine_options(args))
+    try:
+        exporters = start_exporters(monitor.metrics, args.metrics_port, args.stats_interval)
+    except OSError as e:
+        log(f"无法启动指标服务: {e}")
+        monitor.close()
+        if history is not None:
+            history.close()
+        close_outputs()
+        return
+    if state is not None:
+        if args.warm_start:
+            log(state.warm_start(monitor.sources))
+        state.start(monitor.sources)
+    try:
+        if args.read:
+            monitor.replay(args.read)
+        else:
+            monitor.start_monitoring()
+    finally:
+        for exporter in exporters:
+            exporter.close()
+        if state is not None:
+            if state.close():
+                log(f"源状态快照: 已保存 {state.records} 个源到 {args.state}")
+            else:
+                log(f"无法保存源状态快照 {args.state}: {state.error}")
+        # 各输出和会话历史处理完队列中的事件后才能关闭
+        monitor.close()
+        if history is not None:
+            history.close()
+            message = f"会话历史: 已写入 {history.written} 个会话到 {args.db}"
+            if history.dropped:
+                message += f"，丢弃 {history.dropped} 个 ({history.error or '写入跟不上'})"
+            log(message)
+        close_outputs()
 
 if __name__ == "__main__":
     change_default_encoding()
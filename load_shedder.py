@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+过载时的自适应采样
+洪泛时收包线程处理不过来，积压越来越多，输出落后于实际时间。LoadShedder 在收包线程中每秒检查一次
+收包线程的CPU占用和包的积压时间（处理时刻减去包的时间戳），超过阈值时切换到按源地址哈希的 1/N 采样:
+只有被选中的新源才建立会话，已经在ping的源照常处理，因此每个源的会话要么完整、要么完全不出现；
+负载回落后逐级降低 N，直到恢复全量处理
+"""
+
+import time
+
+# 默认的最大采样倍数，1为不采样
+DEFAULT_MAX_SAMPLING = 1
+# 包的积压时间超过多少秒视为处理跟不上
+DEFAULT_MAX_LAG = 1.0
+# 收包线程的CPU占用超过该比例，或积压超过 max_lag 且没有减少时提高采样倍数
+BUSY_HIGH = 0.9
+# 占用低于该比例（且积压低于 max_lag 的1/4）连续 CALM_CHECKS 次时降低采样倍数；
+# 采样倍数减半后负载大约翻倍，因此要明显低于 BUSY_HIGH 的一半，避免来回切换
+BUSY_LOW = 0.4
+CALM_CHECKS = 3
+# 检查间隔（秒，按包的时间戳计）
+CHECK_INTERVAL = 1.0
+# 超过这么多秒没有任何请求时直接恢复全量处理
+IDLE_RESET = 5.0
+
+# 地址乘以该常数（2^32 / 黄金比例）后的32位值在整个空间内均匀分布，相邻地址也会被打散
+_FIBONACCI = 0x9E3779B1
+_HASH_SPACE = 1 << 32
+
+# 收包线程的CPU时间，Python 3.6 没有 thread_time，退回到进程的CPU时间
+_cpu_time = getattr(time, 'thread_time', time.process_time)
+
+
+def parse_sampling(text):
+    """解析最大采样倍数，必须是2的幂"""
+    value = int(text)
+    if value < 1 or value & (value - 1):
+        raise ValueError(f"采样倍数必须是2的幂: {text}")
+    return value
+
+
+class LoadShedder:
+    """按负载调整的源地址哈希采样
+
+    rate 为当前的采样倍数 N（2的幂），为1时全量处理；地址哈希小于 2^32/N 的源被选中，
+    N 翻倍时选中的源是原来的子集，N 减半时原来选中的源仍然选中。
+    observe() 由收包线程对每个请求调用一次并返回当前的 N，只比较时间戳，
+    每隔 CHECK_INTERVAL 秒才读取一次时钟和CPU时间；shed 由 SourceTable 在丢弃请求时累加。
+    没有请求时 observe() 不会被调用，由检查线程定期调用 relax() 恢复全量处理。
+    N 变化时在收包线程或检查线程中调用 on_change(新的N, 原来的N, CPU占用, 积压秒数)。
+    """
+
+    def __init__(self, max_rate=DEFAULT_MAX_SAMPLING, max_lag=DEFAULT_MAX_LAG, on_change=None):
+        self.max_rate = parse_sampling(max_rate)
+        self.max_lag = max_lag
+        self.on_change = on_change
+        self.rate = 1
+        self._limit = _HASH_SPACE
+        # 送来的请求数和因采样未处理的请求数
+        self.offered = 0
+        self.shed = 0
+        # 最近一次检查时收包线程的CPU占用和包的积压时间
+        self.busy = 0.0
+        self.lag = 0.0
+        self._next_check = None
+        self._wall = None
+        self._cpu = None
+        self._calm = 0
+        self._idle_offered = 0
+        self._idle_since = None
+
+    def selects(self, address):
+        """当前采样倍数下是否选中该源"""
+        return (address * _FIBONACCI) & 0xFFFFFFFF < self._limit
+
+    def observe(self, timestamp):
+        """记录一个请求，必要时重新评估负载，返回当前的采样倍数"""
+        self.offered += 1
+        next_check = self._next_check
+        if next_check is None or timestamp >= next_check:
+            self._evaluate(timestamp)
+        return self.rate
+
+    def _evaluate(self, timestamp):
+        now = time.time()
+        cpu = _cpu_time()
+        if self._wall is not None:
+            elapsed = now - self._wall
+            if elapsed > 0:
+                previous_lag = self.lag
+                self.busy = (cpu - self._cpu) / elapsed
+                self.lag = max(0.0, now - timestamp)
+                self._adjust(previous_lag)
+        self._wall = now
+        self._cpu = cpu
+        self._next_check = timestamp + CHECK_INTERVAL
+
+    def relax(self, now):
+        """由检查线程定期调用，超过 IDLE_RESET 秒没有任何请求时恢复全量处理"""
+        offered = self.offered
+        if offered != self._idle_offered or self._idle_since is None:
+            self._idle_offered = offered
+            self._idle_since = now
+        elif self.rate > 1 and now - self._idle_since >= IDLE_RESET:
+            # 下一个请求到达时重新开始计量
+            self._wall = None
+            self._next_check = None
+            self._calm = 0
+            self.busy = self.lag = 0.0
+            self._set_rate(1)
+
+    def _adjust(self, previous_lag):
+        # 积压已在减少时说明当前的倍数足以追上，保持不变
+        if self.busy >= BUSY_HIGH or previous_lag <= self.lag >= self.max_lag:
+            self._calm = 0
+            if self.rate < self.max_rate:
+                self._set_rate(self.rate * 2)
+        elif self.busy < BUSY_LOW and self.lag < self.max_lag / 4:
+            self._calm += 1
+            if self._calm >= CALM_CHECKS and self.rate > 1:
+                self._calm = 0
+                self._set_rate(self.rate // 2)
+        else:
+            self._calm = 0
+
+    def _set_rate(self, rate):
+        previous = self.rate
+        if rate == previous:
+            return
+        self.rate = rate
+        self._limit = _HASH_SPACE // rate
+        if self.on_change is not None:
+            self.on_change(rate, previous, self.busy, self.lag)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+运行指标
+收包数、处理数、内核丢包、处理函数耗时直方图、不活跃检查耗时、包的积压时间、源数量、队列深度和会话时长，
+以 Prometheus 文本格式通过本地HTTP端口提供，也可以定期在标准错误输出一行摘要
+"""
+
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+except ImportError:
+    # Python 3.6 没有 ThreadingHTTPServer
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+    class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+# 耗时直方图的桶边界为 2^k 纳秒，k 从 MIN_EXP(约1微秒) 到 MAX_EXP(约1秒)
+MIN_EXP = 10
+MAX_EXP = 30
+# 积压时间直方图的上限为 2^LAG_MAX_EXP 纳秒（约69秒），洪泛时积压可以达到数秒
+LAG_MAX_EXP = 36
+# 会话时长直方图的上限为 2^SESSION_MAX_EXP 纳秒（约73分钟）
+SESSION_MAX_EXP = 42
+# 处理耗时每 LATENCY_SAMPLE_MASK+1 个请求采样一次，两次 perf_counter 和一次直方图记录
+# 约0.5微秒，逐包记录会占处理函数总耗时的一成以上
+LATENCY_SAMPLE_MASK = 15
+# 默认的指标HTTP监听地址
+DEFAULT_METRICS_HOST = '127.0.0.1'
+
+
+class LatencyHistogram:
+    """以2的幂为边界的耗时直方图
+
+    记录一次只需一次 bit_length 和几次整数加法，可以常驻在收包热路径中。
+    计数在收包线程中更新、在导出线程中读取，依靠GIL保证单次加法的原子性，不额外加锁。
+    """
+
+    def __init__(self, name, help_text, max_exp=MAX_EXP):
+        self.name = name
+        self.help_text = help_text
+        self.max_exp = max_exp
+        # counts[i] 为耗时落在 (2^(MIN_EXP+i-1), 2^(MIN_EXP+i)] 纳秒内的次数，最后一个桶不设上限
+        self.counts = [0] * (max_exp - MIN_EXP + 2)
+        self.count = 0
+        self.total_ns = 0
+
+    def observe(self, seconds):
+        """记录一次耗时（秒）"""
+        ns = int(seconds * 1e9)
+        index = (ns - 1).bit_length() - MIN_EXP if ns > 1 else 0
+        if index < 0:
+            index = 0
+        elif index > self.max_exp - MIN_EXP + 1:
+            index = self.max_exp - MIN_EXP + 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ns += ns
+
+    def state(self):
+        """返回可跨进程传递的 (桶计数列表, 总次数, 总纳秒数)"""
+        return list(self.counts), self.count, self.total_ns
+
+    def load(self, states):
+        """用多个 state() 的合计替换当前内容，用于汇总多进程的直方图"""
+        counts = [0] * len(self.counts)
+        count = total_ns = 0
+        for state_counts, state_count, state_total in states:
+            for index, value in enumerate(state_counts):
+                counts[index] += value
+            count += state_count
+            total_ns += state_total
+        self.counts, self.count, self.total_ns = counts, count, total_ns
+
+    def percentile(self, quantile):
+        """按桶上界估算分位数（秒），没有数据时返回None"""
+        total = self.count
+        if not total:
+            return None
+        rank = quantile * total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return (1 << min(index + MIN_EXP, self.max_exp)) / 1e9
+        return (1 << self.max_exp) / 1e9
+
+    def render(self, lines):
+        """追加 Prometheus 文本格式的 histogram"""
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        cumulative = 0
+        for index, count in enumerate(self.counts[:-1]):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{(1 << (index + MIN_EXP)) / 1e9:.9g}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {self.total_ns / 1e9:.9f}")
+        lines.append(f"{self.name}_count {self.count}")
+
+
+class MonitorMetrics:
+    """监控程序的指标集合
+
+    计数器和仪表值通过回调在导出时读取，热路径上只累加 handled，
+    并按 LATENCY_SAMPLE_MASK 采样记录处理耗时和积压时间：
+
+        handled = metrics.handled = metrics.handled + 1
+        timed = not handled & LATENCY_SAMPLE_MASK
+
+    积压时间为处理时刻减去包的时间戳；时间戳来自内核时才有意义，回放时不记录。
+    """
+
+    def __init__(self):
+        # 已处理的Echo请求数
+        self.handled = 0
+        self.handler_latency = LatencyHistogram(
+            'icmp_monitor_handler_seconds',
+            f"处理单个Echo请求的耗时（每{LATENCY_SAMPLE_MASK + 1}个请求采样一次）")
+        self.expiry_tick = LatencyHistogram(
+            'icmp_monitor_expiry_tick_seconds', "一次不活跃检查的耗时")
+        self.capture_lag = LatencyHistogram(
+            'icmp_monitor_capture_lag_seconds',
+            "包从内核收到到被处理的时间（抽样）",
+            LAG_MAX_EXP)
+        # (名称, 类型, 说明, 回调)
+        self._values = []
+        # 由 add_histogram() 注册的其他直方图
+        self._histograms = []
+        self._last_seen = None
+        self._last_time = None
+
+    def add(self, name, kind, help_text, callback):
+        """注册一个 counter 或 gauge，callback 返回当前值，返回None时不导出"""
+        self._values.append((name, kind, help_text, callback))
+
+    def add_histogram(self, histogram):
+        """注册一个 LatencyHistogram，随其余指标一起导出"""
+        self._histograms.append(histogram)
+
+    def values(self):
+        """读取所有回调，返回 {名称: 值}"""
+        result = {}
+        for name, _, _, callback in self._values:
+            try:
+                result[name] = callback()
+            except Exception:
+                result[name] = None
+        return result
+
+    def render(self):
+        """返回 Prometheus 文本格式的全部指标"""
+        lines = []
+        values = self.values()
+        for name, kind, help_text, _ in self._values:
+            value = values[name]
+            if value is None:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        lines.append("# HELP icmp_monitor_packets_handled_total 已处理的Echo请求数")
+        lines.append("# TYPE icmp_monitor_packets_handled_total counter")
+        lines.append(f"icmp_monitor_packets_handled_total {self.handled}")
+        self.handler_latency.render(lines)
+        self.expiry_tick.render(lines)
+        self.capture_lag.render(lines)
+        for histogram in self._histograms:
+            histogram.render(lines)
+        return '\n'.join(lines) + '\n'
+
+    def summary_line(self):
+        """一行摘要，收包速率按距上次调用的间隔计算"""
+        values = self.values()
+        now = time.time()
+        seen = values.get('icmp_monitor_packets_seen_total') or 0
+        rate = 0.0
+        if self._last_time is not None and now > self._last_time:
+            rate = (seen - self._last_seen) / (now - self._last_time)
+        self._last_seen, self._last_time = seen, now
+
+        def us(histogram, quantile):
+            value = histogram.percentile(quantile)
+            return '-' if value is None else f"{value * 1e6:.0f}"
+
+        def ms(histogram, quantile):
+            value = histogram.percentile(quantile)
+            return '-' if value is None else f"{value * 1e3:.0f}"
+
+        drops = values.get('icmp_monitor_kernel_drops_total')
+        queue = values.get('icmp_monitor_queue_depth')
+        return (f"[指标] 收包 {seen} ({rate:.0f}/秒) 处理 {self.handled} "
+                f"内核丢包 {'-' if drops is None else drops} "
+                f"处理耗时P50/P99 {us(self.handler_latency, 0.5)}/{us(self.handler_latency, 0.99)} 微秒 "
+                f"检查耗时P99 {us(self.expiry_tick, 0.99)} 微秒 "
+                f"积压P99 {ms(self.capture_lag, 0.99)} 毫秒 "
+                f"活跃源 {values.get('icmp_monitor_sources_active', 0)}/"
+                f"{values.get('icmp_monitor_sources', 0)} "
+                f"队列 {'-' if queue is None else queue}")
+
+
+class SessionCounters:
+    """事件总线(event_bus.EventBus)上的指标订阅者，统计结束的会话数和会话时长
+
+    订阅抓包引擎的 'session' 事件，每个结束的会话都计入，不受网段汇总影响。
+    """
+
+    def __init__(self, metrics):
+        self.sessions = 0
+        self.duration = LatencyHistogram('icmp_monitor_session_duration_seconds',
+                                         "ping会话从第一个到最后一个请求的时长", SESSION_MAX_EXP)
+        metrics.add('icmp_monitor_sessions_total', 'counter', "结束的ping会话数", lambda: self.sessions)
+        metrics.add_histogram(self.duration)
+
+    def session(self, src, start_time, last_time, count, summary):
+        self.sessions += 1
+        if start_time is not None:
+            self.duration.observe(last_time - start_time)
+
+
+class MetricsServer:
+    """在后台线程中通过HTTP提供 /metrics"""
+
+    def __init__(self, metrics, port, host=DEFAULT_METRICS_HOST):
+        self.metrics = metrics
+        server_metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = server_metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # 不在终端打印访问日志
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StderrReporter:
+    """每隔 interval 秒在标准错误输出一行指标摘要"""
+
+    def __init__(self, metrics, interval, stream=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.stream = stream
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        # 先取一次基准，第一行就能给出速率
+        self.metrics.summary_line()
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            print(self.metrics.summary_line(), file=self.stream or sys.stderr, flush=True)
+
+    def close(self):
+        self._stop.set()
+
+
+def start_exporters(metrics, port=None, interval=None, host=DEFAULT_METRICS_HOST):
+    """按参数启动HTTP导出和/或标准错误摘要，返回已启动的对象列表"""
+    exporters = []
+    if port is not None:
+        exporters.append(MetricsServer(metrics, port, host).start())
+    if interval:
+        exporters.append(StderrReporter(metrics, interval).start())
+    return exporters
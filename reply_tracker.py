@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Echo请求/应答配对
+按 (对端地址, identifier, sequence) 把本机发出的Echo应答与收到的请求配对，
+统计每个源的应答延迟和未应答比例；在途请求索引有容量上限并按时间淘汰，洪泛时内存不增长
+"""
+
+from collections import OrderedDict
+
+# 默认等待应答的最长时间（秒），应不大于停止检测的超时，停止时在途的请求都已有结果
+DEFAULT_REPLY_TIMEOUT = 2.0
+# 默认最多同时等待应答的请求数
+DEFAULT_MAX_IN_FLIGHT = 65536
+
+
+def echo_key(address, ident, seq):
+    """把 (32位地址, 16位identifier, 16位sequence) 合成一个64位整数键"""
+    return (address << 32) | (ident << 16) | seq
+
+
+class InFlightIndex:
+    """在途Echo请求索引
+
+    OrderedDict 以 echo_key() 为键、(请求时间, SourceStats) 为值，按请求到达的顺序排列：
+    add() 时顺带从最前面淘汰等待超过 timeout 秒的请求，条目数超过 max_size 时淘汰最旧的请求，
+    两者的开销按均摊计都是O(1)；match() 是一次字典查找和删除。
+    被淘汰的请求不再能配对，在源的统计中计为未应答；超时后才到达的应答计入 unmatched。
+    同一个键重复的请求只保留第一个。
+    本类不加锁，add() 和 match() 应在同一个收包线程中调用。
+    """
+
+    def __init__(self, timeout=DEFAULT_REPLY_TIMEOUT, max_size=DEFAULT_MAX_IN_FLIGHT):
+        self.timeout = timeout
+        self.max_size = max_size
+        self._pending = OrderedDict()
+        # 配对成功的应答数、找不到请求的应答数、超时和因容量被淘汰的请求数
+        self.matched = 0
+        self.unmatched = 0
+        self.expired = 0
+        self.overflowed = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, address, ident, seq, timestamp, stats):
+        """记录一个来自 address 的请求，stats 为该源的 source_stats.SourceStats"""
+        pending = self._pending
+        key = echo_key(address, ident, seq)
+        if key in pending:
+            return
+        limit = timestamp - self.timeout
+        while pending:
+            oldest = next(iter(pending.values()))
+            if oldest[0] >= limit:
+                break
+            pending.popitem(last=False)
+            self.expired += 1
+        pending[key] = (timestamp, stats)
+        stats.expect_reply()
+        if len(pending) > self.max_size:
+            pending.popitem(last=False)
+            self.overflowed += 1
+
+    def match(self, address, ident, seq, timestamp):
+        """本机向 address 发出了应答，配对成功时把延迟计入请求方的统计并返回延迟（秒）"""
+        entry = self._pending.pop(echo_key(address, ident, seq), None)
+        if entry is None:
+            self.unmatched += 1
+            return None
+        requested, stats = entry
+        latency = timestamp - requested
+        if latency > self.timeout:
+            self.expired += 1
+            self.unmatched += 1
+            return None
+        # 不同来源的时间戳（例如 pcap 的乱序记录）可能使延迟略小于0
+        latency = max(0.0, latency)
+        stats.record_reply(latency)
+        self.matched += 1
+        return latency
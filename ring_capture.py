@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+TPACKET_V3 内存映射环形缓冲区抓包引擎（仅Linux）
+内核把包成批写入映射到用户态的块中，每次唤醒处理一整块，无需逐包系统调用
+"""
+
+import mmap
+import select
+import socket
+import struct
+
+from raw_capture import parse_echo_request, parse_echo_reply
+from bpf_filter import attach_filter, build_echo_filter, build_source_hash_program, pack_program
+
+# linux/if_packet.h 常量
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+PACKET_FANOUT = 18
+PACKET_FANOUT_DATA = 22
+PACKET_FANOUT_HASH = 0
+PACKET_FANOUT_CBPF = 6
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+ETH_P_IP = 0x0800
+
+# struct tpacket_block_desc: version, offset_to_priv, 然后是 tpacket_hdr_v1
+BLOCK_STATUS_OFFSET = 8
+BLOCK_NUM_PKTS_OFFSET = 12
+BLOCK_FIRST_PKT_OFFSET = 16
+
+# struct tpacket3_hdr 前部: next_offset, sec, nsec, snaplen, len, status, mac, net
+TPACKET3_HDR = struct.Struct('IIIIIIHH')
+# struct tpacket_stats_v3: packets, drops, freeze_q_cnt
+TPACKET_STATS_V3 = struct.Struct('III')
+
+
+def join_fanout(sock, group_id, workers):
+    """加入 PACKET_FANOUT 组，同一源地址的包总是分到同一个套接字
+
+    优先使用 PACKET_FANOUT_CBPF 按源地址分发；内核不支持（4.3之前）时退回
+    PACKET_FANOUT_HASH，此时按(源, 目的)地址哈希，只有单个本机地址时才能保证源地址亲和。
+    返回实际使用的模式名。
+    """
+    try:
+        sock.setsockopt(SOL_PACKET, PACKET_FANOUT, group_id | (PACKET_FANOUT_CBPF << 16))
+    except OSError:
+        sock.setsockopt(SOL_PACKET, PACKET_FANOUT, group_id | (PACKET_FANOUT_HASH << 16))
+        return 'hash'
+    fprog, buffer = pack_program(build_source_hash_program(workers))
+    sock.setsockopt(SOL_PACKET, PACKET_FANOUT_DATA, fprog)
+    del buffer
+    return 'cbpf'
+
+
+class RingCapture:
+    """基于 PACKET_RX_RING/TPACKET_V3 的ICMP抓包器
+
+    使用 SOCK_DGRAM 包套接字，帧数据从IP头开始；通过 memoryview 切片零拷贝解析。
+    始终挂载BPF过滤器，至少只放行Echo请求，避免其他流量占用环形缓冲区。
+    """
+
+    def __init__(self, echo_filter=None, block_size=1 << 20, block_count=32,
+                 frame_size=2048, block_timeout_ms=50, fanout=None, poll_timeout_ms=1000):
+        # 可选的 bpf_filter.EchoRequestFilter
+        self.echo_filter = echo_filter
+        # 可选的 (组ID, 组内套接字数)，多进程抓包时加入 PACKET_FANOUT 组
+        self.fanout = fanout
+        self.fanout_mode = None
+        # 没有数据时 poll 的超时，决定 should_continue 的最长调用间隔
+        self.poll_timeout_ms = poll_timeout_ms
+        # run() 给定 reply_handler 时过滤器同时放行本机发出的Echo应答
+        self.replies = False
+        self.block_size = block_size
+        self.block_count = block_count
+        self.frame_size = frame_size
+        self.block_timeout_ms = block_timeout_ms
+        self.sock = None
+        self.ring = None
+        self.packets_seen = 0
+        self.packets_matched = 0
+        # PACKET_STATISTICS 读取后会清零，这里累计
+        self.kernel_packets = 0
+        self.kernel_drops = 0
+        self.freeze_count = 0
+
+    def open(self):
+        """创建包套接字并映射环形缓冲区（需要root权限或CAP_NET_RAW）"""
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_DGRAM, socket.htons(ETH_P_IP))
+        try:
+            if self.echo_filter is not None:
+                attach_filter(sock, self.echo_filter.bpf_program(self.replies))
+                self.echo_filter.start_counting()
+                if self.echo_filter.interface:
+                    sock.bind((self.echo_filter.interface, ETH_P_IP))
+            else:
+                attach_filter(sock, build_echo_filter(replies=self.replies))
+            sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            frame_count = self.block_size * self.block_count // self.frame_size
+            request = struct.pack('IIIIIII', self.block_size, self.block_count, self.frame_size,
+                                  frame_count, self.block_timeout_ms, 0, 0)
+            sock.setsockopt(SOL_PACKET, PACKET_RX_RING, request)
+            self.ring = mmap.mmap(sock.fileno(), self.block_size * self.block_count,
+                                  mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            if self.fanout is not None:
+                self.fanout_mode = join_fanout(sock, *self.fanout)
+        except Exception:
+            sock.close()
+            raise
+        self.sock = sock
+        return sock
+
+    def close(self):
+        """解除映射并关闭套接字"""
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def kernel_stats(self):
+        """读取 PACKET_STATISTICS，返回累计的 (通过过滤的包数, 内核丢包数, 队列冻结次数)"""
+        if self.sock is not None:
+            raw = self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, TPACKET_STATS_V3.size)
+            packets, drops, freeze = TPACKET_STATS_V3.unpack(raw)
+            self.kernel_packets += packets
+            self.kernel_drops += drops
+            self.freeze_count += freeze
+        return self.kernel_packets, self.kernel_drops, self.freeze_count
+
+    def run(self, handler, should_continue=None, reply_handler=None):
+        """循环处理环形缓冲区，每个Echo请求调用 handler(源地址整数, timestamp, identifier, sequence, 载荷字节数)
+
+        时间戳取内核接收时间（tp_sec/tp_nsec）。
+        should_continue 为可选的回调，返回False时退出循环。
+        给定 reply_handler 时每个本机发出的Echo应答调用 reply_handler(目的地址整数, timestamp, identifier, sequence)，
+        包套接字能看到出站的包，时间戳为应答交给网卡的时间。
+        """
+        if self.sock is None:
+            self.replies = reply_handler is not None
+            self.open()
+        poller = select.poll()
+        poller.register(self.sock, select.POLLIN | select.POLLERR)
+        view = memoryview(self.ring)
+        block_size = self.block_size
+        block_index = 0
+        try:
+            while should_continue is None or should_continue():
+                offset = block_index * block_size
+                status = struct.unpack_from('I', view, offset + BLOCK_STATUS_OFFSET)[0]
+                if not status & TP_STATUS_USER:
+                    poller.poll(self.poll_timeout_ms)
+                    continue
+                self._walk_block(view, offset, handler, reply_handler)
+                # 处理完毕后把块交还给内核
+                struct.pack_into('I', view, offset + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+                block_index = (block_index + 1) % self.block_count
+        finally:
+            self.kernel_stats()
+            view.release()
+            self.close()
+
+    def _walk_block(self, view, offset, handler, reply_handler=None):
+        """遍历一个块中的所有帧"""
+        num_packets, first = struct.unpack_from('II', view, offset + BLOCK_NUM_PKTS_OFFSET)
+        unpack_header = TPACKET3_HDR.unpack_from
+        position = offset + first
+        for _ in range(num_packets):
+            next_offset, sec, nsec, snaplen, _, _, _, net = unpack_header(view, position)
+            start = position + net
+            echo = parse_echo_request(view[start:start + snaplen], snaplen)
+            if echo is not None:
+                self.packets_matched += 1
+                src, ident, seq, size = echo
+                handler(src, sec + nsec * 1e-9, ident, seq, size)
+            elif reply_handler is not None:
+                reply = parse_echo_reply(view[start:start + snaplen], snaplen)
+                if reply is not None:
+                    dst, ident, seq = reply
+                    reply_handler(dst, sec + nsec * 1e-9, ident, seq)
+            position += next_offset
+        self.packets_seen += num_packets
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+会话历史
+每次ping会话（源地址、开始/结束时间、请求数和统计摘要）结束时写入本地SQLite数据库。
+写入由后台线程按批次以 executemany 在一个事务中完成，数据库使用WAL模式，检查线程只追加到内存列表；
+按源地址和时间建有索引，查询数百万条会话也只需几毫秒
+"""
+
+import ipaddress
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# 默认数据库路径
+DEFAULT_HISTORY_PATH = 'icmp_history.db'
+# 默认每隔多少秒写入一批
+DEFAULT_FLUSH_INTERVAL = 1.0
+# 待写入的会话超过这么多条时立即唤醒写入线程
+DEFAULT_BATCH_SIZE = 1000
+# 待写入的会话上限，磁盘跟不上时丢弃新的会话而不是无限占用内存
+DEFAULT_MAX_PENDING = 100000
+# 查询默认最多返回的会话数
+DEFAULT_QUERY_LIMIT = 100
+
+# 统计摘要各项对应的列，顺序与 source_stats.SourceStats.summary() 相同
+SUMMARY_COLUMNS = ('rate', 'interval_p50_ms', 'interval_p95_ms', 'interval_p99_ms', 'size_p50',
+                   'seq_gaps', 'reorders', 'reply_p50_ms', 'reply_p95_ms', 'unanswered_ratio')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    ip INTEGER NOT NULL,
+    start_ts REAL,
+    end_ts REAL NOT NULL,
+    count INTEGER NOT NULL,
+    rate REAL,
+    interval_p50_ms REAL,
+    interval_p95_ms REAL,
+    interval_p99_ms REAL,
+    size_p50 INTEGER,
+    seq_gaps INTEGER,
+    reorders INTEGER,
+    reply_p50_ms REAL,
+    reply_p95_ms REAL,
+    unanswered_ratio REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_ip_end ON sessions (ip, end_ts);
+CREATE INDEX IF NOT EXISTS sessions_end ON sessions (end_ts);
+"""
+
+_INSERT = (f"INSERT INTO sessions (ip, start_ts, end_ts, count, {', '.join(SUMMARY_COLUMNS)}) "
+           f"VALUES ({', '.join('?' * (4 + len(SUMMARY_COLUMNS)))})")
+
+# 相对时间，例如 30s、15m、2h、7d
+_RELATIVE_TIME = re.compile(r'^(\d+(?:\.\d+)?)([smhd])$')
+_UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def connect(path):
+    """打开数据库用于写入: 建表建索引，启用WAL模式"""
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute('PRAGMA journal_mode=WAL')
+        # WAL模式下 NORMAL 只在检查点时同步，掉电最多丢失最近的事务，不会损坏数据库
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA)
+    except sqlite3.Error:
+        connection.close()
+        raise
+    return connection
+
+
+def parse_time(text, now=None):
+    """把 '30m'/'2h'/'7d'（距今）、'2024-01-15'、'2024-01-15 14:30[:00]'（本地时间）或Unix时间戳解析为时间戳"""
+    text = text.strip()
+    match = _RELATIVE_TIME.match(text)
+    if match:
+        if now is None:
+            now = time.time()
+        return now - float(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for layout in ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S',
+                   '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(text, layout).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"无法识别的时间: {text}")
+
+
+def parse_address_range(text):
+    """把IP地址或CIDR解析为 (最小地址, 最大地址) 整数"""
+    network = ipaddress.ip_network(text, strict=False)
+    if network.version != 4:
+        raise ValueError(f"只支持IPv4: {text}")
+    return int(network.network_address), int(network.broadcast_address)
+
+
+class SessionHistory:
+    """会话历史的后台写入器
+
+    record() 只把一行追加到内存列表；写入线程每隔 flush_interval 秒（或攒够 batch_size 条时）
+    取走整个列表，用一次 executemany 在一个事务中写入。
+    待写入的会话超过 max_pending 条时丢弃新的会话并计入 dropped。多个线程可以同时调用 record()。
+    """
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 batch_size=DEFAULT_BATCH_SIZE, max_pending=DEFAULT_MAX_PENDING):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        # 启动时就建表，路径或权限错误能立即报告；连接只在写入线程中使用
+        connect(path).close()
+        self.written = 0
+        self.dropped = 0
+        # 最近一次写入失败的错误
+        self.error = None
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name='session-history', daemon=True)
+        self._thread.start()
+
+    def pending(self):
+        """尚未写入的会话数"""
+        return len(self._pending)
+
+    def record(self, src, start_time, last_time, count, summary):
+        """追加一个结束的会话，参数与 event_output.EventOutput.stop() 相同"""
+        row = (src, start_time, last_time, count) + tuple(summary)
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        connection = connect(self.path)
+        try:
+            while True:
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+                with self._lock:
+                    rows, self._pending = self._pending, []
+                    closing = self._closing
+                if rows:
+                    self._write(connection, rows)
+                if closing:
+                    break
+        finally:
+            connection.close()
+
+    def _write(self, connection, rows):
+        try:
+            with connection:
+                connection.executemany(_INSERT, rows)
+            self.written += len(rows)
+        except sqlite3.Error as e:
+            self.dropped += len(rows)
+            self.error = e
+
+    def close(self):
+        """写入剩余的会话并结束写入线程"""
+        with self._lock:
+            self._closing = True
+        self._wake.set()
+        self._thread.join()
+
+
+def query_sessions(path, since=None, until=None, address_range=None, limit=DEFAULT_QUERY_LIMIT):
+    """查询结束时间在 [since, until] 内的会话，按结束时间取最近的 limit 条
+
+    address_range 为 parse_address_range() 的结果。以只读方式打开数据库，可以在监控运行时查询。
+    返回按结束时间从旧到新排列的 [(地址, 开始时间, 结束时间, 请求数, 统计摘要), ...]。
+    """
+    uri = Path(path).resolve().as_uri() + '?mode=ro'
+    conditions = []
+    params = []
+    if address_range is not None:
+        conditions.append('ip BETWEEN ? AND ?')
+        params.extend(address_range)
+    if since is not None:
+        conditions.append('end_ts >= ?')
+        params.append(since)
+    if until is not None:
+        conditions.append('end_ts <= ?')
+        params.append(until)
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ''
+    sql = (f"SELECT ip, start_ts, end_ts, count, {', '.join(SUMMARY_COLUMNS)} FROM sessions "
+           f"{where}ORDER BY end_ts DESC LIMIT ?")
+    params.append(limit)
+    connection = sqlite3.connect(uri, uri=True)
+    try:
+        rows = connection.execute(sql, params).fetchall()
+    finally:
+        connection.close()
+    rows.reverse()
+    return [(row[0], row[1], row[2], row[3], tuple(row[4:])) for row in rows]
@@ -3,15 +3,98 @@
 
 """
 简化的ICMP监控程序
-在没有完整的Scapy支持或管理员权限的情况下提供基本功能
+在没有完整的Scapy支持或管理员权限的情况下提供基本功能：
+Linux 上读取 /proc/net/snmp 的ICMP计数检测ping活动，其他系统使用 netstat
 """
 
+import os
 import sys
 import time
+import argparse
 import subprocess
 import re
 from datetime import datetime
 
+# 内核的协议计数和原始套接字列表（仅Linux，普通用户可读）
+PROC_SNMP = '/proc/net/snmp'
+PROC_RAW = '/proc/net/raw'
+# 默认轮询间隔（秒）
+DEFAULT_POLL_INTERVAL = 0.2
+# 超过多少秒没有新的Echo请求视为ping停止，与完整版本相同
+DEFAULT_TIMEOUT = 3.0
+# /proc/net/raw 中 ICMP 原始套接字的本地地址以协议号结尾
+RAW_ICMP_SUFFIX = b':0001'
+
+
+class ProcIcmpCounters:
+    """从 /proc/net/snmp 读取ICMP计数，从 /proc/net/raw 读取本机ICMP原始套接字，不需要管理员权限
+
+    两个文件在构造时各打开一次，之后每次读取只是一次从偏移0开始的 os.pread，
+    不重新打开文件，也不启动子进程。内核只提供汇总计数，无法得到ping的源地址。
+    """
+
+    def __init__(self, snmp_path=PROC_SNMP, raw_path=PROC_RAW):
+        self._snmp = os.open(snmp_path, os.O_RDONLY)
+        try:
+            self._raw = os.open(raw_path, os.O_RDONLY)
+        except OSError:
+            self._raw = None
+        # 列名只解析一次，之后按位置取值
+        names = self._icmp_line(0).split()[1:]
+        try:
+            self._in_msgs = names.index(b'InMsgs') + 1
+            self._in_echos = names.index(b'InEchos') + 1
+        except ValueError:
+            self.close()
+            raise ValueError(f"{snmp_path} 中没有ICMP计数")
+
+    @staticmethod
+    def _read(fd):
+        """从头读出整个文件，通常一次系统调用即可读完"""
+        chunks = []
+        offset = 0
+        while True:
+            chunk = os.pread(fd, 65536, offset)
+            chunks.append(chunk)
+            if len(chunk) < 65536:
+                return b''.join(chunks)
+            offset += len(chunk)
+
+    def _icmp_line(self, which):
+        """返回第 which 个以 'Icmp: ' 开头的行：0为列名，1为数值"""
+        data = self._read(self._snmp)
+        start = data.find(b'Icmp: ')
+        if which:
+            start = data.find(b'Icmp: ', start + 1)
+        if start < 0:
+            return b''
+        end = data.find(b'\n', start)
+        return data[start:end if end >= 0 else len(data)]
+
+    def counters(self):
+        """返回 (收到的ICMP消息总数, 收到的Echo请求数)"""
+        values = self._icmp_line(1).split()
+        return int(values[self._in_msgs]), int(values[self._in_echos])
+
+    def raw_sockets(self):
+        """返回本机 (ICMP原始套接字数, 这些套接字的累计丢包数)，无法读取时为 (None, None)"""
+        if self._raw is None:
+            return None, None
+        sockets = drops = 0
+        for line in self._read(self._raw).split(b'\n')[1:]:
+            fields = line.split()
+            if len(fields) >= 13 and fields[1].endswith(RAW_ICMP_SUFFIX):
+                sockets += 1
+                drops += int(fields[-1])
+        return sockets, drops
+
+    def close(self):
+        for fd in (self._snmp, self._raw):
+            if fd is not None:
+                os.close(fd)
+        self._snmp = self._raw = None
+
+
 def parse_ping_output(output):
     """解析ping命令的输出，提取IP地址"""
     # 匹配IPv4地址的正则表达式
@@ -70,9 +153,90 @@ def monitor_with_ping():
     except KeyboardInterrupt:
         print("\n监控已停止")
 
+def monitor_with_proc(interval=DEFAULT_POLL_INTERVAL, timeout=DEFAULT_TIMEOUT):
+    """按 /proc/net/snmp 中 Echo 请求计数的变化检测ping活动（仅Linux），无法读取时返回False"""
+    try:
+        counters = ProcIcmpCounters()
+        _, last_echos = counters.counters()
+    except (OSError, ValueError) as e:
+        print(f"无法读取ICMP计数: {e}")
+        return False
+
+    print("简化的ICMP监控程序")
+    print("==================")
+    print("注意: 此版本读取内核的ICMP计数，只能检测ping活动及其速率，无法显示来源IP")
+    print("需要显示来源IP时请使用完整版本icmp_monitor.py")
+    sockets, last_drops = counters.raw_sockets()
+    if sockets:
+        print(f"本机有 {sockets} 个ICMP原始套接字（可能是其他监控程序或ping进程）")
+    print()
+    print(f"开始监控... (每 {interval:g} 秒读取一次) 按 Ctrl+C 停止")
+
+    last_poll = time.monotonic()
+    # 当前这次ping活动的开始时间、最后一次收到请求的时间、请求数和峰值速率
+    active_since = last_seen = None
+    session_echos = 0
+    peak_rate = 0.0
+    try:
+        while True:
+            time.sleep(interval)
+            _, echos = counters.counters()
+            now = time.monotonic()
+            # 计数器在网络命名空间重建等情况下可能回退，按0处理
+            delta = max(echos - last_echos, 0)
+            elapsed = max(now - last_poll, 1e-6)
+            last_echos, last_poll = echos, now
+            if delta:
+                rate = delta / elapsed
+                if active_since is None:
+                    active_since = now
+                    session_echos = 0
+                    peak_rate = 0.0
+                    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 检测到ping本机 "
+                          f"(约 {rate:.1f} 次/秒)")
+                session_echos += delta
+                peak_rate = max(peak_rate, rate)
+                last_seen = now
+            elif active_since is not None and now - last_seen >= timeout:
+                duration = last_seen - active_since
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ping本机已停止 "
+                      f"(共 {session_echos} 个请求, 持续 {duration:.1f} 秒, "
+                      f"平均 {session_echos / max(duration, interval):.1f} 次/秒, 峰值 {peak_rate:.1f} 次/秒)")
+                active_since = None
+
+            _, drops = counters.raw_sockets()
+            if drops is not None and drops > last_drops:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] 本机ICMP原始套接字丢包 "
+                      f"{drops - last_drops} 个")
+            if drops is not None:
+                last_drops = drops
+    except KeyboardInterrupt:
+        print("\n监控已停止")
+    finally:
+        counters.close()
+    return True
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="ICMP监控程序 - 简化版")
+    parser.add_argument('--interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f"读取 /proc 计数的间隔秒数（默认 {DEFAULT_POLL_INTERVAL:g}，仅Linux）")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help=f"超过多少秒没有新的请求视为ping停止（默认 {DEFAULT_TIMEOUT:g}，仅Linux）")
+    parser.add_argument('--netstat', action='store_true',
+                        help="不读取 /proc，改用 netstat 轮询（非Linux系统的默认方式）")
+    return parser.parse_args(argv)
+
+
 def main():
+    args = parse_args()
     print("ICMP监控程序 - 简化版")
     print("====================")
+    # Linux 上优先读取 /proc，不需要每次启动 netstat 进程
+    if not args.netstat and os.path.exists(PROC_SNMP):
+        if monitor_with_proc(args.interval, args.timeout):
+            return
     monitor_with_ping()
 
 if __name__ == "__main__":
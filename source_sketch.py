@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+固定内存的源估算
+伪造源地址的洪泛下逐源记录的内存随攻击者选择的地址数增长。估算模式用 Count-Min Sketch 加
+top-k 堆找出请求最多的源，用按时间分段的 HyperLogLog 估算滑动窗口内的不同源数量，
+占用的内存与源数量无关
+"""
+
+import heapq
+import math
+from array import array
+from collections import deque
+
+from source_table import int_to_ip
+
+# 默认在活跃源达到多少个时切换到估算模式，0为不切换
+DEFAULT_SKETCH_THRESHOLD = 0
+# Count-Min Sketch 的宽度（必须是2的幂）和行数
+DEFAULT_CMS_WIDTH = 8192
+DEFAULT_CMS_DEPTH = 4
+# 保留的请求最多的源数量
+DEFAULT_TOP_K = 10
+# HyperLogLog 的精度，寄存器数为 2^precision，标准误差约 1.04/sqrt(2^precision)
+DEFAULT_HLL_PRECISION = 12
+# 不同源数量的滑动窗口（秒）及其分段数
+DEFAULT_WINDOW = 60.0
+DEFAULT_WINDOW_SLOTS = 6
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+def mix64(value):
+    """64位整数混合函数（splitmix64 的末尾步骤），把相邻的地址打散到整个64位空间"""
+    value = ((value ^ (value >> 33)) * 0xFF51AFD7ED558CCD) & _MASK64
+    value = ((value ^ (value >> 33)) * 0xC4CEB9FE1A85EC53) & _MASK64
+    return value ^ (value >> 33)
+
+
+class CountMinSketch:
+    """Count-Min Sketch：depth 行 width 列的计数器，估计值只会偏大
+
+    每行的列号由同一个64位哈希的两半组合得到 (h1 + i*h2) mod width，不需要多个哈希函数。
+    """
+
+    def __init__(self, width=DEFAULT_CMS_WIDTH, depth=DEFAULT_CMS_DEPTH):
+        if width & (width - 1):
+            raise ValueError("width 必须是2的幂")
+        self.width = width
+        self.depth = depth
+        self.rows = [array('I', bytes(4 * width)) for _ in range(depth)]
+        self.total = 0
+
+    def add(self, hashed, count=1):
+        """按 mix64() 的结果加计数，返回加完后的估计值"""
+        mask = self.width - 1
+        h1 = hashed & 0xFFFFFFFF
+        h2 = (hashed >> 32) | 1
+        estimate = None
+        for row in self.rows:
+            index = h1 & mask
+            value = row[index] + count
+            row[index] = value
+            if estimate is None or value < estimate:
+                estimate = value
+            h1 += h2
+        self.total += count
+        return estimate
+
+    def estimate(self, hashed):
+        mask = self.width - 1
+        h1 = hashed & 0xFFFFFFFF
+        h2 = (hashed >> 32) | 1
+        estimate = None
+        for row in self.rows:
+            value = row[h1 & mask]
+            if estimate is None or value < estimate:
+                estimate = value
+            h1 += h2
+        return estimate
+
+
+class TopK:
+    """估计值最大的k个键
+
+    members 保存每个键当前的估计值，堆中的值可能已经过时（估计值只增不减），
+    只在与新键比较时才把堆顶修正为当前值，每次更新的开销与k无关。
+    """
+
+    def __init__(self, k=DEFAULT_TOP_K):
+        self.k = k
+        self.members = {}
+        self._heap = []
+
+    def offer(self, key, estimate):
+        members = self.members
+        if key in members:
+            members[key] = estimate
+            return
+        heap = self._heap
+        if len(members) < self.k:
+            members[key] = estimate
+            heapq.heappush(heap, (estimate, key))
+            return
+        # 堆顶修正为当前值后才是真正的最小值
+        while True:
+            value, smallest = heap[0]
+            current = members[smallest]
+            if current == value:
+                break
+            heapq.heapreplace(heap, (current, smallest))
+        if estimate > value:
+            heapq.heapreplace(heap, (estimate, key))
+            del members[smallest]
+            members[key] = estimate
+
+    def items(self, n=None):
+        """按估计值从大到小返回 [(键, 估计值), ...]"""
+        ranked = sorted(self.members.items(), key=lambda item: item[1], reverse=True)
+        return ranked if n is None else ranked[:n]
+
+
+class WindowedHyperLogLog:
+    """滑动窗口内的 HyperLogLog
+
+    窗口分为 slots 段，每段一组寄存器，估算时按位取最大值合并窗口内的各段；
+    过期的段整体丢弃，不需要逐个删除元素。时间戳比当前段更早的元素计入当前段。
+    """
+
+    def __init__(self, precision=DEFAULT_HLL_PRECISION, window=DEFAULT_WINDOW,
+                 slots=DEFAULT_WINDOW_SLOTS):
+        self.precision = precision
+        self.size = 1 << precision
+        self.window = window
+        self.slots = slots
+        self.slot_seconds = window / slots
+        # (段序号, 寄存器)，从旧到新
+        self._segments = deque()
+        self._slot = None
+        self._registers = None
+        if self.size >= 128:
+            self._alpha = 0.7213 / (1 + 1.079 / self.size)
+        else:
+            self._alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.size]
+
+    def add(self, hashed, timestamp):
+        """加入一个 mix64() 结果，进入新的一段时返回True"""
+        rotated = False
+        slot = int(timestamp // self.slot_seconds)
+        if self._slot is None or slot > self._slot:
+            self._rotate(slot)
+            rotated = True
+        rest_bits = 64 - self.precision
+        index = hashed >> rest_bits
+        # 剩余位中第一个1的位置（从1开始）
+        rank = rest_bits - (hashed & ((1 << rest_bits) - 1)).bit_length() + 1
+        registers = self._registers
+        if rank > registers[index]:
+            registers[index] = rank
+        return rotated
+
+    def _rotate(self, slot):
+        self._slot = slot
+        self._registers = bytearray(self.size)
+        segments = self._segments
+        segments.append((slot, self._registers))
+        while segments[0][0] <= slot - self.slots:
+            segments.popleft()
+
+    def estimate(self, now):
+        """估算 now 之前一个窗口内的不同元素数"""
+        oldest = int(now // self.slot_seconds) - self.slots
+        live = [registers for slot, registers in self._segments if slot > oldest]
+        if not live:
+            return 0
+        merged = live[0] if len(live) == 1 else bytes(map(max, *live))
+        size = self.size
+        estimate = self._alpha * size * size / sum(2.0 ** -value for value in merged)
+        if estimate <= 2.5 * size:
+            # 小基数时改用线性计数
+            zeros = merged.count(0)
+            if zeros:
+                estimate = size * math.log(size / zeros)
+        return int(round(estimate))
+
+
+class SourceSketch:
+    """活跃源过多时的估算模式，由 source_table.SourceTable 持有
+
+    活跃源达到 threshold 个时 activate()，之后每个请求都计入 Count-Min Sketch、top-k 和
+    滑动窗口 HyperLogLog；窗口内的不同源估计值降到 threshold 的一半以下时在下一段开始时
+    自动退出。每次进入估算模式时计数器清零，top-k 的请求数从切换时算起。
+    本类不加锁，由 SourceTable 在自己的锁内调用。
+    """
+
+    def __init__(self, threshold, top_k=DEFAULT_TOP_K, width=DEFAULT_CMS_WIDTH,
+                 depth=DEFAULT_CMS_DEPTH, precision=DEFAULT_HLL_PRECISION, window=DEFAULT_WINDOW):
+        self.threshold = threshold
+        self.top_k = top_k
+        self.width = width
+        self.depth = depth
+        self.precision = precision
+        self.window = window
+        self.active = False
+        # 进入估算模式的时间，未进入时为None
+        self.since = None
+        # 进入估算模式的次数和估算模式下的请求数
+        self.activations = 0
+        self.packets = 0
+        self.counts = None
+        self.heavy = None
+        self.distinct = None
+
+    def activate(self, timestamp):
+        self.counts = CountMinSketch(self.width, self.depth)
+        self.heavy = TopK(self.top_k)
+        self.distinct = WindowedHyperLogLog(self.precision, self.window)
+        self.active = True
+        self.since = timestamp
+        self.activations += 1
+
+    def deactivate(self):
+        self.active = False
+        self.since = None
+
+    def add(self, address, timestamp):
+        """计入一个请求，窗口内的不同源已经足够少时退出估算模式"""
+        hashed = mix64(address)
+        self.packets += 1
+        self.heavy.offer(address, self.counts.add(hashed))
+        if self.distinct.add(hashed, timestamp) and timestamp - self.since >= self.window:
+            if self.distinct.estimate(timestamp) * 2 < self.threshold:
+                self.deactivate()
+
+    def summary(self, now, n=DEFAULT_TOP_K):
+        """返回 (是否处于估算模式, 窗口内不同源的估计值, [(地址, 请求数估计值), ...])
+
+        未处于估算模式时后两项为None和空列表。结果只含数字和元组，可以跨进程传递。
+        """
+        if not self.active:
+            return False, None, []
+        return True, self.distinct.estimate(now), self.heavy.items(n)
+
+
+def merge_summaries(summaries, n=DEFAULT_TOP_K):
+    """合并多个按源地址分片的 summary()：不同源数相加，top-k 取并集中最大的n个"""
+    active = False
+    distinct = 0
+    top = []
+    for summary_active, summary_distinct, summary_top in summaries:
+        if summary_active:
+            active = True
+            distinct += summary_distinct
+            top.extend(summary_top)
+    if not active:
+        return False, None, []
+    return True, distinct, heapq.nlargest(n, top, key=lambda item: item[1])
+
+
+def format_top(top, n=5):
+    """把 [(地址, 请求数), ...] 格式化为 '1.2.3.4 (500), ...'"""
+    return ', '.join(f"{int_to_ip(address)} ({count})" for address, count in top[:n]) or '-'
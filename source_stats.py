@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+单个ping源的流式统计
+在收包路径中增量计算速率、请求间隔分位数、包大小分布、序号缺失/乱序以及应答延迟，每个源占用的内存有上限
+"""
+
+import math
+
+# 速率EWMA的时间常数（秒）
+RATE_TIME_CONSTANT = 5.0
+# 直方图记录的最大值（位数），更大的值并入最后一个桶
+MAX_VALUE_BITS = 27
+
+
+def bucket_index(value, sub_bits):
+    """把非负整数映射到对数桶编号
+
+    每个2的幂区间再细分为 2^sub_bits 个子桶，相对误差约 1/2^sub_bits，
+    小于 2^(sub_bits+1) 的值精确记录；桶数量不超过 (MAX_VALUE_BITS + 1) << sub_bits。
+    """
+    if value < (1 << sub_bits):
+        return value
+    if value >= (1 << MAX_VALUE_BITS):
+        value = (1 << MAX_VALUE_BITS) - 1
+    shift = value.bit_length() - sub_bits - 1
+    return ((shift + 1) << sub_bits) + ((value >> shift) & ((1 << sub_bits) - 1))
+
+
+def bucket_value(index, sub_bits):
+    """对数桶编号对应区间的中间值"""
+    if index < (1 << sub_bits):
+        return index
+    shift = (index >> sub_bits) - 1
+    low = ((1 << sub_bits) | (index & ((1 << sub_bits) - 1))) << shift
+    return low + ((1 << shift) >> 1)
+
+
+class LogHistogram:
+    """稀疏的对数直方图（HDR直方图的简化版）
+
+    只保存非空的桶，桶总数有上限，因此内存有界；ping的间隔和大小通常很规律，实际只占几个桶。
+    """
+    __slots__ = ('buckets', 'total')
+    # 子桶位数，决定精度
+    SUB_BITS = 3
+
+    def __init__(self):
+        self.buckets = {}
+        self.total = 0
+
+    def record(self, value):
+        """记录一个非负整数值"""
+        index = bucket_index(value, self.SUB_BITS)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.total += 1
+
+    def percentiles(self, *quantiles):
+        """返回各分位数（0~1）的近似值，没有数据时为None"""
+        results = [None] * len(quantiles)
+        if not self.total:
+            return tuple(results)
+        targets = [max(1, math.ceil(q * self.total)) for q in quantiles]
+        remaining = len(targets)
+        cumulative = 0
+        for index in sorted(self.buckets):
+            cumulative += self.buckets[index]
+            for i, target in enumerate(targets):
+                if results[i] is None and cumulative >= target:
+                    results[i] = bucket_value(index, self.SUB_BITS)
+                    remaining -= 1
+            if not remaining:
+                break
+        return tuple(results)
+
+
+class SizeHistogram(LogHistogram):
+    """载荷大小直方图，256字节以内精确记录"""
+    __slots__ = ()
+    SUB_BITS = 7
+
+
+class SourceStats:
+    """单个源的增量统计"""
+    __slots__ = ('last_time', 'burst', 'rate', 'intervals', 'size', 'sizes', 'last_ident', 'last_seq',
+                 'seq_gaps', 'reorders', 'replies_expected', 'replies', 'reply_times')
+
+    def __init__(self):
+        self.last_time = None
+        # 与 last_time 时间戳相同的请求数
+        self.burst = 0
+        # 按时间加权的请求速率EWMA（包/秒）
+        self.rate = 0.0
+        # 请求间隔（微秒）和载荷大小（字节）的分布，在第二个请求时才创建：
+        # 洪泛中大多数源只有一个请求，只记下它的载荷大小
+        self.intervals = None
+        self.size = None
+        self.sizes = None
+        self.last_ident = None
+        self.last_seq = None
+        # 跳过的序号总数和回退（乱序/重复）的次数
+        self.seq_gaps = 0
+        self.reorders = 0
+        # 启用应答配对(reply_tracker.InFlightIndex)时: 等待应答的请求数、配对成功的应答数
+        # 和应答延迟（微秒）的分布，延迟分布在第一个应答时才创建
+        self.replies_expected = 0
+        self.replies = 0
+        self.reply_times = None
+
+    def update(self, timestamp, ident, seq, size):
+        """记录一个Echo请求"""
+        last_time = self.last_time
+        if last_time is None:
+            self.last_time = timestamp
+            self.burst = 1
+        else:
+            intervals = self.intervals
+            if intervals is None:
+                intervals = self.intervals = LogHistogram()
+            elapsed = timestamp - last_time
+            if elapsed > 0:
+                intervals.record(int(elapsed * 1e6))
+                instant = self.burst / elapsed
+                if self.rate == 0.0:
+                    # 第一个间隔直接作为初值
+                    self.rate = instant
+                else:
+                    # 瞬时速率按间隔长短加权并入EWMA
+                    weight = 1.0 - math.exp(-elapsed / RATE_TIME_CONSTANT)
+                    self.rate += weight * (instant - self.rate)
+                self.last_time = timestamp
+                self.burst = 1
+            else:
+                intervals.record(0)
+                self.burst += 1
+        sizes = self.sizes
+        if sizes is not None:
+            sizes.record(size)
+        elif self.size is None:
+            self.size = size
+        else:
+            sizes = self.sizes = SizeHistogram()
+            sizes.record(self.size)
+            sizes.record(size)
+
+        # 同一个ping进程(identifier)内按16位序号检查缺失和乱序
+        if ident != self.last_ident or self.last_seq is None:
+            self.last_ident = ident
+            self.last_seq = seq
+            return
+        delta = (seq - self.last_seq) & 0xFFFF
+        if delta == 0 or delta >= 0x8000:
+            self.reorders += 1
+        else:
+            self.seq_gaps += delta - 1
+            self.last_seq = seq
+
+    def expect_reply(self):
+        """一个请求进入在途索引"""
+        self.replies_expected += 1
+
+    def record_reply(self, latency):
+        """一个请求收到了应答，latency 为延迟（秒）"""
+        if self.reply_times is None:
+            self.reply_times = LogHistogram()
+        self.reply_times.record(int(latency * 1e6))
+        self.replies += 1
+
+    def unanswered_ratio(self):
+        """未应答的请求占比（0~1），未启用应答配对时为None
+
+        在途尚未应答的请求也计为未应答，源停止时（超过应答超时）才是最终值。
+        """
+        if not self.replies_expected:
+            return None
+        return (self.replies_expected - self.replies) / self.replies_expected
+
+    def current_rate(self, now=None):
+        """当前速率（包/秒），指定 now 时计入最后一个请求之后的衰减"""
+        if now is None or self.last_time is None or now <= self.last_time:
+            return self.rate
+        return self.rate * math.exp(-(now - self.last_time) / RATE_TIME_CONSTANT)
+
+    def summary(self, now=None):
+        """返回 (速率, 间隔P50毫秒, P95毫秒, P99毫秒, 载荷大小P50, 序号缺失数, 乱序数,
+        应答延迟P50毫秒, 应答延迟P95毫秒, 未应答比例)，未启用应答配对时后三项为None"""
+        p50 = p95 = p99 = None
+        if self.intervals is not None:
+            p50, p95, p99 = (None if v is None else v / 1000.0
+                             for v in self.intervals.percentiles(0.5, 0.95, 0.99))
+        size_p50 = self.sizes.percentiles(0.5)[0] if self.sizes is not None else self.size
+        reply_p50 = reply_p95 = None
+        if self.reply_times is not None:
+            reply_p50, reply_p95 = (v / 1000.0 for v in self.reply_times.percentiles(0.5, 0.95))
+        return (self.current_rate(now), p50, p95, p99, size_p50, self.seq_gaps, self.reorders,
+                reply_p50, reply_p95, self.unanswered_ratio())
+
+
+def format_ms(value):
+    """格式化毫秒数，没有数据时显示 -"""
+    return '-' if value is None else f"{value:.1f}"
+
+
+def format_summary(summary):
+    """把 summary() 的结果格式化为一行文字"""
+    rate, p50, p95, p99, size_p50, gaps, reorders, reply_p50, reply_p95, unanswered = summary
+    size_text = '-' if size_p50 is None else str(size_p50)
+    text = (f"速率 {rate:.1f} 包/秒, 间隔P50/P95/P99 {format_ms(p50)}/{format_ms(p95)}/{format_ms(p99)} 毫秒, "
+            f"载荷 {size_text} 字节, 序号缺失 {gaps}, 乱序 {reorders}")
+    if unanswered is not None:
+        text += (f", 应答延迟P50/P95 {format_ms(reply_p50)}/{format_ms(reply_p95)} 毫秒, "
+                 f"未应答 {format_ratio(unanswered)}")
+    return text
+
+
+def format_ratio(value):
+    """格式化比例为百分数，没有数据时显示 -"""
+    return '-' if value is None else f"{value * 100:.1f}%"
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ping源状态表
+以32位整数形式的IPv4地址为键，使用 __slots__ 记录，限制最大条目数并按LRU/空闲时间淘汰
+"""
+
+import socket
+import struct
+import threading
+from collections import OrderedDict
+
+from expiry import ExpiryHeap, DEFAULT_TIMEOUT
+from source_stats import SourceStats
+
+# 默认最多保留的源数量
+DEFAULT_MAX_SOURCES = 100000
+# 默认空闲多久后淘汰记录（秒）
+DEFAULT_IDLE_TIMEOUT = 3600
+# 最近一次测得的积压在这么多秒内有效，之后视为已经追上
+LAG_HOLD = 1.0
+
+_ADDRESS = struct.Struct('!I')
+
+
+def ip_to_int(ip):
+    """点分十进制字符串转为32位整数"""
+    return _ADDRESS.unpack(socket.inet_aton(ip))[0]
+
+
+def int_to_ip(address):
+    """32位整数转为点分十进制字符串"""
+    return socket.inet_ntoa(_ADDRESS.pack(address))
+
+
+class SourceRecord:
+    """单个ping源的状态"""
+    __slots__ = ('address', 'start_time', 'last_time', 'count', 'deadline', 'active_since', 'stats',
+                 'weight')
+
+    def __init__(self, address, timestamp):
+        self.address = address
+        # 本次会话的开始时间和请求数，停止后重新活跃时开始新的会话
+        self.start_time = timestamp
+        self.last_time = timestamp
+        self.count = 1
+        # 不活跃截止时间，由 ExpiryHeap 维护，None表示已停止
+        self.deadline = None
+        # 本次活跃开始的时间，停止后重新活跃时更新
+        self.active_since = timestamp
+        # 本次会话的速率、间隔分位数等流式统计，由收包线程更新
+        self.stats = SourceStats()
+        # 本次活跃开始时的采样倍数，即这个源在估算中代表的源数量
+        self.weight = 1
+
+    @property
+    def ip(self):
+        return int_to_ip(self.address)
+
+
+class SourceTable:
+    """有界的ping源状态表
+
+    OrderedDict 按最近活动排序，最久未活动的在最前面：
+    超过 max_size 时淘汰最前面的记录，evict_idle() 从前往后淘汰空闲超时的记录，
+    两者开销都只与被淘汰的条目数成正比。max_size 为0或None时不限制条目数。
+    已停止的源总排在仍在ping的源前面，因此先被淘汰；只有全部记录都活跃时才会淘汰活跃的源，
+    它们由下一次 expire() 与超时的源一起取出，照常报告停止和写入会话历史。
+    活跃状态由内部的 ExpiryHeap 维护，超过 timeout 秒没有活动的源由 expire() 取出。
+    给定 sketch(source_sketch.SourceSketch) 时，活跃源达到其阈值后切换到估算模式：
+    所有请求计入 sketch，已有记录的源照常更新，新的源不再建立记录。
+    给定 shedder(load_shedder.LoadShedder) 时，过载期间未被采样选中的源不开始新的活跃期，
+    它们的请求只计入 shedder.shed；已经活跃的源不受影响。
+    时间戳为内核收到包的时间，收包线程落后时缓冲区中还有未处理的包；收包线程通过 record_lag()
+    报告积压，expire()/wait_time() 按 clock() 换算出的已处理到的时间判断超时，避免把这些源误判为停止。
+    热启动时 restore() 放回快照中的活跃记录，不活跃的记录留在 dormant(state_snapshot.DormantRecords) 中，
+    源再次ping本机时才取出，取出后与停止后重新活跃的源相同；dormant 不参与按容量淘汰，全部空闲超时后整体丢弃。
+    收包线程和检查线程之间通过同一把锁同步。
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SOURCES, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 timeout=DEFAULT_TIMEOUT, sketch=None, shedder=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self._records = OrderedDict()
+        self.expiry = ExpiryHeap(timeout, self._records.get)
+        self.sketch = sketch
+        self.shedder = shedder
+        # 采样期间开始的活跃源各代表 weight 个源，这里累计活跃源多代表的数量
+        self.unsampled = 0
+        # 因超出容量被淘汰的记录数
+        self.evicted = 0
+        # 被淘汰时仍在ping的记录，等待 expire() 报告停止
+        self._evicted_active = []
+        # 最近一次测得的积压（秒）和测量时刻
+        self.lag = 0.0
+        self._lag_time = 0.0
+        # 热启动后快照中尚未取出的不活跃记录
+        self.dormant = None
+
+    def __len__(self):
+        dormant = self.dormant
+        return len(self._records) + (len(dormant) if dormant is not None else 0)
+
+    def __contains__(self, address):
+        return address in self._records
+
+    @property
+    def active_count(self):
+        """当前活跃的源数量"""
+        return len(self.expiry)
+
+    @property
+    def estimated_active(self):
+        """按采样倍数放大后的活跃源数量估计，未采样时等于 active_count"""
+        return len(self.expiry) + self.unsampled
+
+    @property
+    def sampling_rate(self):
+        """当前的采样倍数，未启用采样时为1"""
+        return self.shedder.rate if self.shedder is not None else 1
+
+    def get(self, address):
+        """返回地址对应的记录，不存在时返回None"""
+        return self._records.get(address)
+
+    def records(self):
+        """返回当前所有记录的列表（按最近活动从旧到新）"""
+        with self.lock:
+            return list(self._records.values())
+
+    def touch(self, address, timestamp):
+        """记录一次来自 address 的请求，返回 (记录, 是否开始了新的会话)
+
+        新的源和停止后重新活跃的源都开始新的会话，后者的开始时间、请求数和统计重新计算，调用者应同样报告开始；
+        估算模式下没有记录的源只计入 sketch，因采样被丢弃的请求同样返回 (None, False)。
+        """
+        records = self._records
+        sketch = self.sketch
+        shedder = self.shedder
+        rate = shedder.observe(timestamp) if shedder is not None else 1
+        with self.lock:
+            record = records.get(address)
+            if rate > 1 and (record is None or record.deadline is None) \
+                    and not shedder.selects(address):
+                shedder.shed += 1
+                return None, False
+            if record is None and self.dormant is not None:
+                record = self._revive(address)
+            if sketch is not None:
+                if not sketch.active and record is None and len(self.expiry) >= sketch.threshold:
+                    sketch.activate(timestamp)
+                if sketch.active:
+                    sketch.add(address, timestamp)
+                    if record is None and sketch.active:
+                        return None, False
+            if record is not None:
+                record.last_time = timestamp
+                records.move_to_end(address)
+                if self.expiry.touch(record):
+                    # 上一次会话已经报告过停止，不再累计到新的会话中
+                    record.start_time = record.active_since = timestamp
+                    record.count = 1
+                    record.stats = SourceStats()
+                    record.weight = rate
+                    self.unsampled += rate - 1
+                    return record, True
+                record.count += 1
+                return record, False
+            record = records[address] = SourceRecord(address, timestamp)
+            self.expiry.touch(record)
+            if rate > 1:
+                record.weight = rate
+                self.unsampled += rate - 1
+            if self.max_size and len(records) > self.max_size:
+                self._evict_oldest()
+            return record, True
+
+    def _revive(self, address):
+        """从 dormant 中取出 address 的记录放回表中，没有时返回None，调用时已持有锁"""
+        dormant = self.dormant
+        record = dormant.take(address)
+        if record is None:
+            return None
+        if not len(dormant):
+            self.dormant = None
+        records = self._records
+        records[address] = record
+        if self.max_size and len(records) > self.max_size:
+            self._evict_oldest()
+        return record
+
+    def _evict_oldest(self):
+        """淘汰最久未活动的记录，调用时已持有锁"""
+        _, oldest = self._records.popitem(last=False)
+        if oldest.deadline is not None:
+            self._evicted_active.append(oldest)
+        self._discard(oldest)
+        self.evicted += 1
+
+    def restore(self, records, dormant=None):
+        """热启动: 放回快照中的活跃记录（按最近活动从旧到新）和尚未取出的不活跃记录
+
+        截止时间按原来的最后活动时间计算，停机期间已经超时的源由下一次 expire() 照常报告停止。
+        快照保存时的 max_size 更大时，与 touch() 一样淘汰最久未活动的记录，仍在ping的同样由下一次 expire() 报告停止。
+        返回因超出容量淘汰的记录数。
+        """
+        with self.lock:
+            for record in records:
+                self._records[record.address] = record
+                self._records.move_to_end(record.address)
+                if self.expiry.touch(record):
+                    self.unsampled += record.weight - 1
+            evicted = 0
+            if self.max_size:
+                while len(self._records) > self.max_size:
+                    self._evict_oldest()
+                    evicted += 1
+            self.dormant = dormant
+            return evicted
+
+    def snapshot(self):
+        """返回 (记录列表, dormant, dormant 中已取出的地址)，在锁内一次取得，供 state_snapshot 保存"""
+        with self.lock:
+            dormant = self.dormant
+            return (list(self._records.values()), dormant,
+                    dormant.taken() if dormant is not None else None)
+
+    def _discard(self, record):
+        """把记录标记为不活跃，调用时已持有锁"""
+        if record.deadline is not None:
+            self.unsampled -= record.weight - 1
+        self.expiry.discard(record)
+
+    def record_lag(self, timestamp, now):
+        """收包线程报告一个包的积压，now 为处理时的当前时间，返回积压秒数
+
+        只需抽样调用；回放等时间戳与当前时间无关的场合不要调用。
+        """
+        lag = now - timestamp
+        if lag < 0:
+            lag = 0.0
+        self.lag = lag
+        self._lag_time = now
+        return lag
+
+    def clock(self, now):
+        """把当前时间换算为收包线程已处理到的包时间"""
+        if now - self._lag_time < LAG_HOLD:
+            return now - self.lag
+        return now
+
+    def expire(self, now):
+        """取出超过 timeout 秒没有活动的源，以及上次调用以来被淘汰时仍在ping的源，返回记录列表
+
+        检查线程定期调用，同时让 shedder 在没有请求时恢复全量处理。
+        """
+        if self.shedder is not None:
+            self.shedder.relax(now)
+        now = self.clock(now)
+        with self.lock:
+            expired = self.expiry.expire(now)
+            if self.unsampled:
+                self.unsampled -= sum(record.weight - 1 for record in expired)
+            if self._evicted_active:
+                # 被淘汰的记录已在 _discard() 中扣除采样权重
+                expired.extend(self._evicted_active)
+                self._evicted_active = []
+            return expired
+
+    def wait_time(self, now, max_wait=1.0):
+        """距离下一个源超时的秒数，最长 max_wait"""
+        now = self.clock(now)
+        with self.lock:
+            return self.expiry.wait_time(now, max_wait)
+
+    def evict_idle(self, now):
+        """淘汰空闲超过 idle_timeout 的记录，返回被淘汰的记录列表"""
+        evicted = []
+        if not self.idle_timeout:
+            return evicted
+        records = self._records
+        limit = now - self.idle_timeout
+        with self.lock:
+            if self.dormant is not None and self.dormant.newest < limit:
+                self.dormant = None
+            while records:
+                address, record = next(iter(records.items()))
+                if record.last_time >= limit:
+                    break
+                del records[address]
+                if record.deadline is not None:
+                    self._evicted_active.append(record)
+                self._discard(record)
+                evicted.append(record)
+        return evicted
+
+    def sketch_summary(self, now, n=10):
+        """估算模式的 SourceSketch.summary()，未启用估算时返回None
+
+        采样期间 sketch 只看到被选中的源，不同源数量按当前的采样倍数放大。
+        """
+        if self.sketch is None:
+            return None
+        with self.lock:
+            active, distinct, top = self.sketch.summary(now, n)
+        rate = self.sampling_rate
+        if rate > 1 and distinct is not None:
+            distinct *= rate
+        return active, distinct, top
+
+    def remove(self, address):
+        """删除一条记录"""
+        with self.lock:
+            record = self._records.pop(address, None)
+            if record is not None:
+                self._discard(record)
+            elif self.dormant is not None:
+                record = self.dormant.take(address)
+            return record
+
+    def clear(self):
+        """清空所有记录"""
+        with self.lock:
+            self.expiry.clear()
+            self._records.clear()
+            self._evicted_active = []
+            self.unsampled = 0
+            self.dormant = None
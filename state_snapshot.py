@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+源状态快照
+定期把源状态表原子地写入紧凑的二进制文件，重启时用它热启动: 仍在超时时间内的会话继续进行，
+不再重复输出开始事件。文件为64字节的头部加上每条64字节的定长记录，活跃的源在前，
+不活跃的源按地址排序在后，最后是不活跃的源的4字节地址索引；热启动时只为活跃的源创建记录，
+不活跃的源留在 mmap 中，再次ping本机时才按地址索引二分查找取出，几十万个源也只需几毫秒
+"""
+
+import heapq
+import mmap
+import os
+import platform
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from source_table import SourceRecord
+
+MAGIC = b'ICMS'
+SNAPSHOT_VERSION = 1
+# 默认每隔多少秒保存一次，编码几十万个源约需半秒（在后台线程中）
+DEFAULT_SNAPSHOT_INTERVAL = 30.0
+
+HEADER_SIZE = 64
+RECORD_SIZE = 64
+# 头部: 魔数, 版本, 记录长度, 活跃记录数, 不活跃记录数, 保存时间, 不活跃记录中最晚的最后活动时间
+_HEADER = struct.Struct('!4sBHIIdd')
+# 记录: 地址, 标志, 采样权重, 累计请求数, 开始时间, 最后活动时间, 本次活跃开始时间,
+# 速率EWMA, identifier, 序号, 序号缺失, 乱序, 等待应答的请求数, 配对成功的应答数
+_RECORD = struct.Struct(f'!IBIIdddfHHIIII{RECORD_SIZE - 61}x')
+_ADDRESS = struct.Struct('!I')
+
+# 标志位
+_ACTIVE = 1
+_SEQUENCE = 2  # identifier 和序号有效
+
+_U32_MAX = 0xFFFFFFFF
+
+
+def _pack_record(record):
+    stats = record.stats
+    flags = _ACTIVE if record.deadline is not None else 0
+    if stats.last_seq is not None:
+        flags |= _SEQUENCE
+    return _RECORD.pack(record.address, flags, record.weight, min(record.count, _U32_MAX),
+                        record.start_time, record.last_time, record.active_since, stats.rate,
+                        stats.last_ident or 0, stats.last_seq or 0, min(stats.seq_gaps, _U32_MAX),
+                        min(stats.reorders, _U32_MAX), min(stats.replies_expected, _U32_MAX),
+                        min(stats.replies, _U32_MAX))
+
+
+def _unpack_record(values):
+    """由记录的各项创建 SourceRecord（不在 ExpiryHeap 中），返回 (记录, 是否活跃)
+
+    间隔、载荷和应答延迟的分布不保存，热启动后只统计之后的请求；计数、速率和序号照常延续。
+    """
+    (address, flags, weight, count, start_time, last_time, active_since, rate, ident, seq,
+     gaps, reorders, expected, replies) = values
+    record = SourceRecord(address, start_time)
+    record.last_time = last_time
+    record.count = count
+    record.active_since = active_since
+    record.weight = weight
+    stats = record.stats
+    stats.last_time = last_time
+    stats.burst = 1
+    stats.rate = rate
+    if flags & _SEQUENCE:
+        stats.last_ident = ident
+        stats.last_seq = seq
+    stats.seq_gaps = gaps
+    stats.reorders = reorders
+    stats.replies_expected = expected
+    stats.replies = replies
+    return record, bool(flags & _ACTIVE)
+
+
+def _address_array(data):
+    """把网络字节序的4字节地址序列读入 array"""
+    addresses = array('I')
+    addresses.frombytes(data)
+    if sys.byteorder == 'little':
+        addresses.byteswap()
+    return addresses
+
+
+def _address_bytes(addresses):
+    addresses = array('I', addresses)
+    if sys.byteorder == 'little':
+        addresses.byteswap()
+    return addresses.tobytes()
+
+
+class DormantRecords:
+    """快照中尚未取出的不活跃记录
+
+    记录按地址排序保存在 mmap（Windows 上为读入的字节串）中，地址索引读入 array 后用 bisect 查找，
+    take() 只为找到的源创建对象，取出的地址不再出现在 rows() 中。由 SourceTable 在持有锁时调用。
+    """
+
+    def __init__(self, data, offset, addresses, newest):
+        self._data = data
+        self._offset = offset
+        self._addresses = addresses
+        self._taken = set()
+        # 其中最晚的最后活动时间，早于空闲淘汰时间时整体丢弃
+        self.newest = newest
+
+    def __len__(self):
+        return len(self._addresses) - len(self._taken)
+
+    def take(self, address):
+        """取出 address 的记录，不存在或已取出时返回None"""
+        addresses = self._addresses
+        index = bisect_left(addresses, address)
+        if index == len(addresses) or addresses[index] != address or address in self._taken:
+            return None
+        self._taken.add(address)
+        offset = self._offset + index * RECORD_SIZE
+        record, _ = _unpack_record(_RECORD.unpack_from(self._data, offset))
+        return record
+
+    def rows(self, taken):
+        """按地址顺序生成尚未取出的 (地址, 记录字节)，taken 为取快照时已取出的地址集合的副本"""
+        data = self._data
+        offset = self._offset
+        for address in self._addresses:
+            if address not in taken:
+                yield address, data[offset:offset + RECORD_SIZE]
+            offset += RECORD_SIZE
+
+    def taken(self):
+        """已取出的地址集合的副本"""
+        return set(self._taken)
+
+
+def save_snapshot(table, path, now=None):
+    """把源状态表(source_table.SourceTable)写入 path，返回写入的记录数
+
+    先写入同目录下的临时文件并 fsync，再用 os.replace 替换，任何时刻崩溃都只会留下旧的或新的完整快照。
+    只在取记录列表时持有表的锁，编码和写入在锁外进行。
+    """
+    if now is None:
+        now = time.time()
+    records, dormant, taken = table.snapshot()
+    active = []
+    inactive = []
+    newest = 0.0
+    for record in records:
+        if record.deadline is not None:
+            active.append(_pack_record(record))
+        else:
+            inactive.append((record.address, _pack_record(record)))
+            newest = max(newest, record.last_time)
+    inactive.sort()
+    rows = inactive
+    if dormant is not None and len(dormant):
+        newest = max(newest, dormant.newest)
+        rows = heapq.merge(inactive, dormant.rows(taken))
+    addresses = []
+    chunks = []
+    for address, row in rows:
+        addresses.append(address)
+        chunks.append(row)
+    header = _HEADER.pack(MAGIC, SNAPSHOT_VERSION, RECORD_SIZE, len(active), len(chunks), now, newest)
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        f.writelines(active)
+        f.writelines(chunks)
+        f.write(_address_bytes(addresses))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return len(active) + len(chunks)
+
+
+def load_snapshot(path):
+    """读取快照，返回 (保存时间, 活跃记录列表, DormantRecords或None)
+
+    活跃记录按最近活动从旧到新排列，尚未加入 ExpiryHeap；文件损坏或格式不符时抛出 ValueError。
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER_SIZE:
+            raise ValueError("快照文件不完整")
+        if platform.system() == 'Windows':
+            # Windows 上映射中的文件不能被下一次保存替换，读入内存
+            data = f.read()
+        else:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, record_size, active, inactive, saved, newest = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("不是源状态快照文件")
+    if version != SNAPSHOT_VERSION or record_size != RECORD_SIZE:
+        raise ValueError(f"快照版本不匹配: 文件为 {version}，本程序为 {SNAPSHOT_VERSION}")
+    index = HEADER_SIZE + (active + inactive) * RECORD_SIZE
+    if size != index + inactive * _ADDRESS.size:
+        raise ValueError("快照文件不完整")
+    end = HEADER_SIZE + active * RECORD_SIZE
+    records = [_unpack_record(values)[0] for values in _RECORD.iter_unpack(data[HEADER_SIZE:end])]
+    dormant = None
+    if inactive:
+        dormant = DormantRecords(data, end, _address_array(data[index:]), newest)
+    return saved, records, dormant
+
+
+class StateSnapshots:
+    """源状态快照的后台写入器
+
+    warm_start() 在开始抓包前调用，把快照放回源状态表；start() 之后每隔 interval 秒保存一次，
+    close() 停止线程并保存最后一次。保存失败时记录在 error 中，下次照常重试，不影响抓包。
+    """
+
+    def __init__(self, path, interval=DEFAULT_SNAPSHOT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.table = None
+        # 保存成功的次数、最近一次保存的记录数和耗时（秒）
+        self.written = 0
+        self.records = 0
+        self.duration = None
+        # 最近一次保存失败的错误
+        self.error = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def warm_start(self, table):
+        """从快照恢复 table，返回一行说明；快照不存在或无法读取时保持空的状态"""
+        if not os.path.exists(self.path):
+            return f"快照 {self.path} 不存在，从空的状态开始"
+        started = time.perf_counter()
+        try:
+            saved, records, dormant = load_snapshot(self.path)
+        except (OSError, ValueError) as e:
+            return f"无法读取快照 {self.path}: {e}，从空的状态开始"
+        evicted = table.restore(records, dormant)
+        elapsed = time.perf_counter() - started
+        moment = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(saved))
+        message = (f"从 {moment} 的快照恢复 {len(records) - evicted} 个正在ping的源和 "
+                   f"{len(dormant) if dormant is not None else 0} 个不活跃的源，耗时 {elapsed * 1000:.1f} 毫秒")
+        if evicted:
+            message += f"；超出最大源数量，淘汰了最久未活动的 {evicted} 个"
+        return message
+
+    def start(self, table):
+        """开始定期保存 table"""
+        self.table = table
+        self._thread = threading.Thread(target=self._run, name='state-snapshot', daemon=True)
+        self._thread.start()
+        return self
+
+    def save(self):
+        """立即保存一次，返回是否成功"""
+        with self._lock:
+            started = time.perf_counter()
+            try:
+                self.records = save_snapshot(self.table, self.path)
+            except OSError as e:
+                self.error = str(e)
+                return False
+            self.duration = time.perf_counter() - started
+            self.written += 1
+            return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.save()
+
+    def close(self):
+        """停止定期保存并保存最后一次，返回是否成功"""
+        if self._thread is None:
+            return False
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return self.save()
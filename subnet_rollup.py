@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+网段汇总与扫描检测
+用路径压缩的二叉基数树(radix trie)记录活跃的源，同一前缀内同时活跃的源达到阈值时汇总为一次扫描，
+之后该网段内各源的开始/停止不再逐条输出，扫描结束时输出一条汇总
+"""
+
+import threading
+
+from source_table import int_to_ip
+
+# 默认汇总阈值（同一前缀内同时活跃的源数），0为不汇总
+DEFAULT_SWEEP_THRESHOLD = 0
+# 默认参与汇总的前缀长度范围
+DEFAULT_MIN_PREFIX = 16
+DEFAULT_MAX_PREFIX = 24
+
+
+def prefix_mask(length):
+    """前缀长度对应的32位掩码"""
+    return (0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF
+
+
+def parse_prefix_range(text):
+    """把 '16-24' 或 '24' 解析为 (最短, 最长) 前缀长度"""
+    low, _, high = text.partition('-')
+    low = int(low)
+    high = int(high) if high else low
+    if not 1 <= low <= high <= 32:
+        raise ValueError(f"前缀长度范围无效: {text}")
+    return low, high
+
+
+class TrieNode:
+    """基数树节点：key 的前 length 位为该节点的前缀，count 为子树中的地址数"""
+    __slots__ = ('key', 'length', 'zero', 'one', 'count')
+
+    def __init__(self, key, length, count=0):
+        self.key = key
+        self.length = length
+        self.zero = None
+        self.one = None
+        self.count = count
+
+
+class RadixTrie:
+    """路径压缩的二叉基数树，保存32位地址集合
+
+    只有分叉处才有内部节点，每个地址约占两个节点；插入和删除沿一条路径最多走32层，
+    路径上各节点的 count 同时加减，因此任意前缀内的地址数都可以沿同一条路径读出。
+    本类不加锁，由调用方负责同步。
+    """
+
+    def __init__(self):
+        self.root = TrieNode(0, 0)
+
+    def __len__(self):
+        return self.root.count
+
+    def __contains__(self, address):
+        node = self.root
+        while node is not None and node.length < 32:
+            node = node.one if (address >> (31 - node.length)) & 1 else node.zero
+        return node is not None and node.key == address
+
+    def insert(self, address):
+        """插入一个地址，返回根到叶的节点列表；地址必须不在树中"""
+        node = self.root
+        path = [node]
+        while True:
+            node.count += 1
+            bit = (address >> (31 - node.length)) & 1
+            child = node.one if bit else node.zero
+            if child is None:
+                leaf = TrieNode(address, 32, 1)
+                self._set_child(node, bit, leaf)
+                path.append(leaf)
+                return path
+            # address 与子节点前缀相同的位数
+            diff = (address ^ child.key) & prefix_mask(child.length)
+            common = 32 - diff.bit_length()
+            if common >= child.length:
+                node = child
+                path.append(node)
+                continue
+            # 在分叉处插入新的内部节点
+            fork = TrieNode(address & prefix_mask(common), common, child.count + 1)
+            leaf = TrieNode(address, 32, 1)
+            self._set_child(fork, (child.key >> (31 - common)) & 1, child)
+            self._set_child(fork, (address >> (31 - common)) & 1, leaf)
+            self._set_child(node, bit, fork)
+            path.append(fork)
+            path.append(leaf)
+            return path
+
+    def remove(self, address):
+        """删除一个地址，不存在时返回False"""
+        path = []
+        node = self.root
+        while node is not None and node.length < 32:
+            path.append(node)
+            if (address ^ node.key) & prefix_mask(node.length):
+                return False
+            node = node.one if (address >> (31 - node.length)) & 1 else node.zero
+        if node is None or node.key != address:
+            return False
+        for ancestor in path:
+            ancestor.count -= 1
+        parent = path[-1]
+        self._set_child(parent, (address >> (31 - parent.length)) & 1, None)
+        # 只剩一个子节点的内部节点与其子节点合并，保持路径压缩
+        if parent is not self.root:
+            remaining = parent.zero or parent.one
+            grandparent = path[-2]
+            self._set_child(grandparent, (parent.key >> (31 - grandparent.length)) & 1, remaining)
+        return True
+
+    def addresses(self, network, length):
+        """返回 network/length 内的所有地址"""
+        node = self.root
+        while node is not None and node.length < length:
+            if (network ^ node.key) & prefix_mask(node.length):
+                return []
+            node = node.one if (network >> (31 - node.length)) & 1 else node.zero
+        if node is None or (network ^ node.key) & prefix_mask(length):
+            return []
+        result = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.length == 32:
+                result.append(node.key)
+                continue
+            if node.zero is not None:
+                stack.append(node.zero)
+            if node.one is not None:
+                stack.append(node.one)
+        return result
+
+    @staticmethod
+    def _set_child(node, bit, child):
+        if bit:
+            node.one = child
+        else:
+            node.zero = child
+
+
+class Sweep:
+    """一次来自某个网段的扫描
+
+    network/length 为包含全部成员的最小网段（不短于 min_prefix、不长于 max_prefix），成员增加时可能变宽；
+    active 为当前仍在ping的源数，hosts 为累计的源数，peak 为同时活跃的最大源数，
+    requests 为已停止的源的请求数之和。
+    """
+    __slots__ = ('id', 'network', 'length', 'start_time', 'last_time', 'active', 'hosts', 'peak',
+                 'requests', 'ended', 'reported')
+
+    def __init__(self, id, network, length, timestamp):
+        self.id = id
+        self.network = network
+        self.length = length
+        self.start_time = timestamp
+        self.last_time = timestamp
+        self.active = 0
+        self.hosts = 0
+        self.peak = 0
+        self.requests = 0
+        self.ended = False
+        # 汇总前已单独输出开始事件的源，它们的停止事件照常输出
+        self.reported = set()
+
+    @property
+    def cidr(self):
+        return f"{int_to_ip(self.network)}/{self.length}"
+
+    def add(self, address, timestamp, min_prefix):
+        """加入一个成员，必要时放宽网段使其包含 address"""
+        diff = (self.network ^ address) & prefix_mask(self.length)
+        if diff:
+            self.length = max(min_prefix, 32 - diff.bit_length())
+            self.network &= prefix_mask(self.length)
+        self.active += 1
+        self.hosts += 1
+        if self.active > self.peak:
+            self.peak = self.active
+        if timestamp > self.last_time:
+            self.last_time = timestamp
+
+    def copy(self):
+        """不含 reported 的快照，可以交给其他线程读取"""
+        snapshot = Sweep(self.id, self.network, self.length, self.start_time)
+        for name in ('last_time', 'active', 'hosts', 'peak', 'requests', 'ended'):
+            setattr(snapshot, name, getattr(self, name))
+        return snapshot
+
+
+class SubnetRollup:
+    """按网段汇总开始/停止事件
+
+    start()/stop() 的参数与 event_output.EventOutput 相同，不汇总的事件原样交给 on_start/on_stop。
+    同一个 /min_prefix 网段内同时活跃的源达到 threshold 时调用一次 on_sweep_start(Sweep)，
+    扫描的网段取基数树中包含这些源的最小前缀（最长 /max_prefix）；之后落在该网段内的新源只计数，
+    全部停止后调用 on_sweep_stop(Sweep)。源停止后重新开始ping时同样调用 start()。
+    多个线程可以同时调用。
+    """
+
+    def __init__(self, on_start, on_stop, on_sweep_start, on_sweep_stop, threshold,
+                 min_prefix=DEFAULT_MIN_PREFIX, max_prefix=DEFAULT_MAX_PREFIX):
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.on_sweep_start = on_sweep_start
+        self.on_sweep_stop = on_sweep_stop
+        self.threshold = threshold
+        self.min_prefix = min_prefix
+        self.max_prefix = max_prefix
+        self.lock = threading.Lock()
+        self._block_mask = prefix_mask(min_prefix)
+        # 未被汇总的活跃源
+        self.trie = RadixTrie()
+        # 源地址 -> 所属的 Sweep
+        self.members = {}
+        # /min_prefix 网段地址 -> 进行中的 Sweep
+        self.sweeps = {}
+        self.sweeps_started = 0
+        # 被汇总而没有单独输出的事件数
+        self.suppressed = 0
+
+    def sweep_of(self, address):
+        """源所属的进行中的扫描，不属于任何扫描时返回None"""
+        return self.members.get(address)
+
+    def start(self, src, timestamp):
+        """源开始ping"""
+        with self.lock:
+            if self._activate(src, timestamp):
+                self.on_start(src, timestamp)
+
+    def stop(self, src, start_time, last_time, count, summary):
+        """源停止ping"""
+        with self.lock:
+            sweep = self.members.pop(src, None)
+            if sweep is None:
+                # 未经过 start() 的源（例如在汇总启用前已经活跃）也照常输出
+                self.trie.remove(src)
+                self.on_stop(src, start_time, last_time, count, summary)
+                return
+            sweep.active -= 1
+            sweep.requests += count
+            if last_time > sweep.last_time:
+                sweep.last_time = last_time
+            if src in sweep.reported:
+                sweep.reported.discard(src)
+                self.on_stop(src, start_time, last_time, count, summary)
+            else:
+                self.suppressed += 1
+            if not sweep.active:
+                del self.sweeps[sweep.network & self._block_mask]
+                sweep.ended = True
+                self.on_sweep_stop(sweep)
+
+    def _activate(self, src, timestamp):
+        """记录一个活跃的源，返回是否应单独输出其开始事件"""
+        if src in self.members:
+            return False
+        sweep = self.sweeps.get(src & self._block_mask)
+        if sweep is not None:
+            sweep.add(src, timestamp, self.min_prefix)
+            self.members[src] = sweep
+            self.suppressed += 1
+            return False
+        if src in self.trie:
+            # 同一时间戳的重复调用
+            return False
+        # 路径上第一个不短于 min_prefix 的节点恰好包含该网段内的全部活跃源，
+        # 其前缀长度就是这些源的最长公共前缀
+        for node in self.trie.insert(src):
+            if node.length >= self.min_prefix:
+                break
+        if node.count < self.threshold:
+            return True
+        length = min(node.length, self.max_prefix)
+        network = node.key & prefix_mask(length)
+        self.sweeps_started += 1
+        sweep = self.sweeps[src & self._block_mask] = Sweep(self.sweeps_started, network, length,
+                                                            timestamp)
+        # 网段内已活跃的源一并转入扫描，触发汇总的这个源不再单独输出
+        for address in self.trie.addresses(network, length):
+            self.trie.remove(address)
+            sweep.add(address, timestamp, self.min_prefix)
+            self.members[address] = sweep
+            if address != src:
+                sweep.reported.add(address)
+        self.suppressed += 1
+        self.on_sweep_start(sweep)
+        return False
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+BPF程序测试: 用一个只支持这里用到的指令的经典BPF解释器运行生成的程序
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import socket
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bpf_filter  # noqa: E402
+from bpf_filter import (build_echo_filter, build_source_hash_program, parse_networks,  # noqa: E402
+                        SKF_NET_OFF, ICMP_ECHO_REQUEST, ICMP_ECHO_REPLY)
+from capture_engine import add_capture_arguments  # noqa: E402
+
+ETHERNET_HEADER = b'\x02\x00\x00\x00\x00\x01\x02\x00\x00\x00\x00\x02\x08\x00'
+
+
+def load(packet, network_offset, offset, size):
+    """按内核的规则读取: 非负偏移从数据起点算，SKF_NET_OFF 之后的偏移从IP头算"""
+    if offset < 0:
+        offset = network_offset + offset - SKF_NET_OFF
+    return int.from_bytes(packet[offset:offset + size], 'big')
+
+
+def run(program, packet, network_offset=0):
+    """运行BPF程序，返回程序的返回值"""
+    a = x = pc = 0
+    b = bpf_filter
+    while True:
+        code, jt, jf, k = program[pc]
+        pc += 1
+        if code == b.BPF_LD_B_ABS:
+            a = load(packet, network_offset, k, 1)
+        elif code == b.BPF_LD_H_ABS:
+            a = load(packet, network_offset, k, 2)
+        elif code == b.BPF_LD_W_ABS:
+            a = load(packet, network_offset, k, 4)
+        elif code == b.BPF_LD_B_IND:
+            a = load(packet, network_offset, x + k, 1)
+        elif code == b.BPF_LDX_B_MSH:
+            x = (load(packet, network_offset, k, 1) & 0xf) * 4
+        elif code == b.BPF_ALU_AND_K:
+            a &= k
+        elif code == b.BPF_ALU_MUL_K:
+            a = (a * k) & 0xFFFFFFFF
+        elif code == b.BPF_ALU_RSH_K:
+            a >>= k
+        elif code == b.BPF_ALU_MOD_K:
+            a %= k
+        elif code == b.BPF_JMP_JA:
+            pc += k
+        elif code == b.BPF_JMP_JEQ_K:
+            pc += jt if a == k else jf
+        elif code == b.BPF_JMP_JSET_K:
+            pc += jt if a & k else jf
+        elif code == b.BPF_RET_K:
+            return k
+        elif code == b.BPF_RET_A:
+            return a
+        else:
+            raise ValueError(f"不支持的指令 {code:#x}")
+
+
+def echo_packet(icmp_type, src, dst):
+    """不带链路层头的ICMP Echo包"""
+    icmp = struct.pack('!BBHHH', icmp_type, 0, 0, 1, 1)
+    return struct.pack('!BBHHHBBH4s4s', 0x45, 0, 28, 0, 0, 64, socket.IPPROTO_ICMP, 0,
+                       socket.inet_aton(src), socket.inet_aton(dst)) + icmp
+
+
+class SourceHashTest(unittest.TestCase):
+
+    def test_egress_reply_with_ethernet_header_hashes_like_request(self):
+        program = build_source_hash_program(8)
+        buckets = set()
+        for index in range(64):
+            peer = f'10.0.{index}.1'
+            # 收到的请求从IP头开始，本机发出的应答前面还有以太网头
+            request = echo_packet(ICMP_ECHO_REQUEST, peer, '192.0.2.2')
+            reply = ETHERNET_HEADER + echo_packet(ICMP_ECHO_REPLY, '192.0.2.2', peer)
+            bucket = run(program, request)
+            self.assertEqual(run(program, reply, len(ETHERNET_HEADER)), bucket)
+            buckets.add(bucket)
+        self.assertEqual(buckets, set(range(8)))
+
+    def test_program_packs_negative_offsets(self):
+        fprog, buffer = bpf_filter.pack_program(build_source_hash_program(4))
+        self.assertEqual(len(buffer), 8 * len(build_source_hash_program(4)))
+
+
+class EchoFilterTest(unittest.TestCase):
+
+    def test_accepts_requests_to_local_address_from_networks(self):
+        program = build_echo_filter(['192.0.2.2'], parse_networks(['10.0.0.0/8']), replies=True)
+        cases = [
+            ((ICMP_ECHO_REQUEST, '10.1.1.1', '192.0.2.2'), True),
+            ((ICMP_ECHO_REQUEST, '11.1.1.1', '192.0.2.2'), False),
+            ((ICMP_ECHO_REQUEST, '10.1.1.1', '192.0.2.3'), False),
+            ((ICMP_ECHO_REPLY, '192.0.2.2', '10.1.1.1'), True),
+            ((ICMP_ECHO_REPLY, '192.0.2.2', '11.1.1.1'), False),
+            ((3, '192.0.2.2', '10.1.1.1'), False),
+        ]
+        for packet, accepted in cases:
+            self.assertEqual(bool(run(program, echo_packet(*packet))), accepted, packet)
+
+
+def address_message(index, attributes, family=socket.AF_INET):
+    """一条 RTM_NEWADDR 消息，attributes 为 [(属性类型, 点分地址)]"""
+    payload = bpf_filter._IFADDRMSG.pack(family, 24, 0, 0, index)
+    for attribute, address in attributes:
+        payload += bpf_filter._RTATTR.pack(8, attribute) + socket.inet_aton(address)
+    return bpf_filter._NLMSGHDR.pack(16 + len(payload), bpf_filter.RTM_NEWADDR, 2, 1, 0) + payload
+
+
+class NetlinkAddressTest(unittest.TestCase):
+
+    def test_lists_secondary_and_point_to_point_addresses(self):
+        data = (address_message(2, [(bpf_filter.IFA_ADDRESS, '192.0.2.2'), (bpf_filter.IFA_LOCAL, '192.0.2.2')])
+                + address_message(2, [(bpf_filter.IFA_ADDRESS, '192.0.2.9'), (bpf_filter.IFA_LOCAL, '192.0.2.9')])
+                # 点对点网卡: IFA_ADDRESS 是对端地址
+                + address_message(3, [(bpf_filter.IFA_ADDRESS, '198.51.100.1'),
+                                      (bpf_filter.IFA_LOCAL, '198.51.100.2')]))
+        self.assertEqual(bpf_filter.parse_address_messages(data),
+                         ([(2, '192.0.2.2'), (2, '192.0.2.9'), (3, '198.51.100.2')], False))
+
+    def test_done_and_error_messages(self):
+        done = bpf_filter._NLMSGHDR.pack(20, bpf_filter.NLMSG_DONE, 2, 1, 0) + b'\0' * 4
+        self.assertEqual(bpf_filter.parse_address_messages(done), ([], True))
+        error = bpf_filter._NLMSGHDR.pack(20, bpf_filter.NLMSG_ERROR, 0, 1, 0) + struct.pack('=i', -1)
+        with self.assertRaises(OSError):
+            bpf_filter.parse_address_messages(error)
+
+    @unittest.skipUnless(hasattr(socket, 'AF_NETLINK'), "需要 netlink")
+    def test_netlink_lists_loopback(self):
+        addresses = bpf_filter.netlink_ipv4_addresses()
+        if addresses is None:
+            self.skipTest("netlink 不可用")
+        self.assertIn('127.0.0.1', [address for _, address in addresses])
+
+
+class SourceNetworkArgumentTest(unittest.TestCase):
+
+    def parse(self, *argv):
+        parser = argparse.ArgumentParser()
+        add_capture_arguments(parser)
+        return parser.parse_args(argv)
+
+    def test_valid_networks_are_parsed(self):
+        args = self.parse('--src-net', '10.1.2.3/8', '--src-net', '192.0.2.1')
+        self.assertEqual([str(network) for network in args.src_net], ['10.0.0.0/8', '192.0.2.1/32'])
+        self.assertEqual(parse_networks(args.src_net), args.src_net)
+
+    def test_invalid_networks_are_usage_errors(self):
+        for value in ('10.0.0.0/33', 'foo', '2001:db8::/32'):
+            stderr = io.StringIO()
+            with contextlib.redirect_stderr(stderr), self.assertRaises(SystemExit) as raised:
+                self.parse('--src-net', value)
+            self.assertEqual(raised.exception.code, 2)
+            self.assertIn(value, stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
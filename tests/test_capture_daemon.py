@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+抓包守护进程测试: 新界面的快照不受发送缓冲区上限限制，快照之后的积压超过上限时断开
+"""
+
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture_daemon import DeltaPublisher  # noqa: E402
+from delta_protocol import (FrameDecoder, encode_snapshot, encode_start,  # noqa: E402
+                            FRAME_HELLO, FRAME_SNAPSHOT, FRAME_START)
+
+START_TIME = 1700000000.0
+BASE_ADDRESS = 0x0A000000
+MAX_BUFFER = 64 * 1024
+WAIT = 5.0
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "需要Unix域套接字")
+class SnapshotLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # 快照约 3 MB，远大于 max_buffer
+        sessions = [(BASE_ADDRESS + i, START_TIME, START_TIME + 1, 2, None) for i in range(50000)]
+        self.snapshot = [encode_snapshot(sessions)]
+        self.publisher = DeltaPublisher(os.path.join(self.directory.name, 'daemon.sock'),
+                                        lambda: self.snapshot, max_buffer=MAX_BUFFER, log=lambda message: None)
+        self.publisher.open()
+        self.thread = threading.Thread(target=self.publisher.serve, daemon=True)
+        self.thread.start()
+        self.client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.client.connect(self.publisher.path)
+        self.wait_for(lambda: self.publisher.clients_connected == 1)
+
+    def tearDown(self):
+        self.client.close()
+        self.publisher.close()
+        self.thread.join(WAIT)
+        self.directory.cleanup()
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + WAIT
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def receive(self, count):
+        """读取并解码 count 帧"""
+        decoder = FrameDecoder()
+        frames = []
+        self.client.settimeout(WAIT)
+        while len(frames) < count:
+            data = self.client.recv(1 << 20)
+            self.assertTrue(data)
+            frames.extend(decoder.feed(data))
+        return frames
+
+    def test_large_snapshot_does_not_disconnect_new_client(self):
+        # 界面还没开始读，快照仍在发送缓冲区中
+        for i in range(10):
+            self.publisher.publish(encode_start(BASE_ADDRESS + i, START_TIME + 2))
+        time.sleep(0.2)
+        frames = self.receive(12)
+        self.assertEqual(self.publisher.clients_dropped, 0)
+        self.assertEqual([kind for kind, _ in frames],
+                         [FRAME_HELLO, FRAME_SNAPSHOT] + [FRAME_START] * 10)
+        self.assertEqual(len(frames[1][1]), 50000)
+
+    def test_backlog_after_snapshot_disconnects_slow_client(self):
+        frame = encode_start(BASE_ADDRESS, START_TIME + 2)
+        for _ in range(2 * MAX_BUFFER // len(frame)):
+            self.publisher.publish(frame)
+        self.wait_for(lambda: self.publisher.clients_dropped == 1)
+        self.assertEqual(self.publisher.client_count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+抓包引擎测试: 发布的开始/停止事件成对出现，源停止后重新开始ping时先发布开始事件
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture_engine import CaptureEngine  # noqa: E402
+from source_table import ip_to_int  # noqa: E402
+
+START_TIME = 1700000000.0
+
+
+class StartStopPairingTest(unittest.TestCase):
+
+    def run_engine(self, **options):
+        engine = CaptureEngine(engine='raw', timeout=3.0, **options)
+        events = []
+        engine.bus.subscribe('test', {
+            'start': lambda src, timestamp: events.append(('start', src, timestamp)),
+            'stop': lambda src, start_time, last_time, count, summary:
+                events.append(('stop', src, start_time, last_time, count)),
+        }, policy='block')
+        src = ip_to_int('10.0.0.1')
+        for i in range(10):
+            engine.handle_echo(src, START_TIME + i, 1, i, 56)
+        engine.check_inactive_ips(START_TIME + 13)
+        for i in range(5):
+            engine.handle_echo(src, START_TIME + 20 + i, 1, 100 + i, 56)
+        engine.check_inactive_ips(START_TIME + 28)
+        engine.close()
+        return src, events
+
+    def assert_paired(self, src, events):
+        self.assertEqual(events, [
+            ('start', src, START_TIME),
+            ('stop', src, START_TIME, START_TIME + 9, 10),
+            ('start', src, START_TIME + 20),
+            ('stop', src, START_TIME + 20, START_TIME + 24, 5),
+        ])
+
+    def test_resumed_source_publishes_start(self):
+        self.assert_paired(*self.run_engine(sweep_threshold=0))
+
+    def test_resumed_source_publishes_start_with_rollup(self):
+        self.assert_paired(*self.run_engine(sweep_threshold=4))
+
+
+if __name__ == '__main__':
+    unittest.main()
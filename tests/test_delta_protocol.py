@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+守护进程增量协议测试: 各类帧编码后按字节流拆分解码应得到原来的内容
+"""
+
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from delta_protocol import (DaemonStats, FrameDecoder, encode_error, encode_hello,  # noqa: E402
+                            encode_snapshot, encode_start, encode_stats, encode_stop, encode_sweep,
+                            encode_updates, FRAME_ERROR, FRAME_HELLO, FRAME_SNAPSHOT, FRAME_START,
+                            FRAME_STATS, FRAME_STOP, FRAME_SWEEP, FRAME_UPDATE, MAX_FRAME_SIZE,
+                            PROTOCOL_VERSION)
+from subnet_rollup import Sweep  # noqa: E402
+
+START_TIME = 1700000000.0
+BASE_ADDRESS = 0x0A000000
+
+# 单精度可以精确表示的统计摘要
+SUMMARY = (2.5, 1000.0, 1500.0, 2000.0, 56, 3, 1, 0.25, 0.5, 0.125)
+# 未启用应答配对、只有一个请求的摘要
+SPARSE_SUMMARY = (0.0, None, None, None, 56, 0, 0, None, None, None)
+
+
+def decode(data, chunk=None):
+    """按 chunk 字节一段喂给解码器，返回全部帧"""
+    decoder = FrameDecoder()
+    if chunk is None:
+        return decoder.feed(data)
+    frames = []
+    for offset in range(0, len(data), chunk):
+        frames.extend(decoder.feed(data[offset:offset + chunk]))
+    return frames
+
+
+class DeltaProtocolTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        sweep = Sweep(3, BASE_ADDRESS, 24, START_TIME)
+        sweep.last_time = START_TIME + 5
+        sweep.active, sweep.hosts, sweep.peak, sweep.requests = 10, 40, 25, 1 << 40
+        stats = DaemonStats(1000, 20, None, 5, None, 7, True, 5000,
+                            (True, 12345, [(BASE_ADDRESS, 600), (BASE_ADDRESS + 1, 300)]), (4, 900, 20000))
+        updates = [(BASE_ADDRESS, START_TIME + 1, 2, SUMMARY), (BASE_ADDRESS + 1, START_TIME + 2, 1, None)]
+        sessions = [(BASE_ADDRESS, START_TIME, START_TIME + 1, 2, SUMMARY),
+                    (BASE_ADDRESS + 1, START_TIME, START_TIME, 1, SPARSE_SUMMARY)]
+        data = b''.join([
+            encode_hello(START_TIME),
+            encode_snapshot(sessions),
+            encode_start(BASE_ADDRESS + 2, START_TIME + 3),
+            encode_updates(updates),
+            encode_stop(BASE_ADDRESS, START_TIME, START_TIME + 4, 5, SUMMARY),
+            encode_sweep(sweep),
+            encode_stats(stats),
+            encode_error("抓包失败"),
+        ])
+        for chunk in (None, 1, 7):
+            frames = decode(data, chunk)
+            self.assertEqual([kind for kind, _ in frames],
+                             [FRAME_HELLO, FRAME_SNAPSHOT, FRAME_START, FRAME_UPDATE, FRAME_STOP,
+                              FRAME_SWEEP, FRAME_STATS, FRAME_ERROR])
+            contents = [content for _, content in frames]
+            self.assertEqual(contents[0], START_TIME)
+            self.assertEqual(contents[1], sessions)
+            self.assertEqual(contents[2], (BASE_ADDRESS + 2, START_TIME + 3))
+            self.assertEqual(contents[3], updates)
+            self.assertEqual(contents[4], (BASE_ADDRESS, START_TIME, START_TIME + 4, 5, SUMMARY))
+            decoded = contents[5]
+            for name in ('id', 'network', 'length', 'start_time', 'last_time', 'active', 'hosts',
+                         'peak', 'requests', 'ended'):
+                self.assertEqual(getattr(decoded, name), getattr(sweep, name), name)
+            self.assertEqual(contents[6], stats)
+            self.assertEqual(contents[7], "抓包失败")
+
+    def test_stats_without_optional_parts(self):
+        stats = DaemonStats(10, None, 0, None, None, 0, False, 0, None, None)
+        self.assertEqual(decode(encode_stats(stats)), [(FRAME_STATS, stats)])
+
+    def test_partial_frame_is_kept_until_complete(self):
+        data = encode_start(BASE_ADDRESS, START_TIME)
+        decoder = FrameDecoder()
+        self.assertEqual(decoder.feed(data[:-1]), [])
+        self.assertEqual(decoder.feed(data[-1:]), [(FRAME_START, (BASE_ADDRESS, START_TIME))])
+
+    def test_unknown_frame_is_skipped(self):
+        data = struct.pack('!BI', 200, 3) + b'abc' + encode_start(BASE_ADDRESS, START_TIME)
+        self.assertEqual(decode(data), [(FRAME_START, (BASE_ADDRESS, START_TIME))])
+
+    def test_corrupt_stream_raises(self):
+        with self.assertRaises(ValueError):
+            decode(struct.pack('!BI', FRAME_START, MAX_FRAME_SIZE + 1))
+        with self.assertRaises(ValueError):
+            decode(struct.pack('!BI', FRAME_START, 3) + b'abc')
+
+    def test_hello_checks_version(self):
+        hello = bytearray(encode_hello(START_TIME))
+        hello[9] = PROTOCOL_VERSION + 1
+        with self.assertRaises(ValueError):
+            decode(bytes(hello))
+        hello = encode_hello(START_TIME).replace(b'ICMD', b'XXXX')
+        with self.assertRaises(ValueError):
+            decode(hello)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+事件总线测试: 三种背压策略在订阅者跟不上时的行为
+"""
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_bus import EventBus  # noqa: E402
+
+WAIT = 5.0
+
+
+def merge_lists(earlier, later):
+    return (earlier[0] + later[0],)
+
+
+class BackpressureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bus = EventBus()
+        self.bus.coalesce('updates', merge_lists)
+        self.received = []
+        # 第一个事件的回调等待 release，之后的事件留在队列中
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.bus.close()
+
+    def subscribe(self, policy, size=2):
+        def handler(kind):
+            def handle(*args):
+                self.entered.set()
+                self.release.wait(WAIT)
+                self.received.append((kind,) + args)
+            return handle
+        return self.bus.subscribe('test', {kind: handler(kind) for kind in ('start', 'stop', 'updates')},
+                                  size=size, policy=policy)
+
+    def stall(self):
+        """发布一个事件并等到分发线程卡在它的回调里"""
+        self.bus.publish('start', 0)
+        self.assertTrue(self.entered.wait(WAIT))
+
+    def publish_in_thread(self, *events):
+        def publish():
+            for event in events:
+                self.bus.publish(*event)
+        thread = threading.Thread(target=publish, daemon=True)
+        thread.start()
+        return thread
+
+    def test_drop_oldest_discards_oldest_events(self):
+        subscription = self.subscribe('drop-oldest')
+        self.stall()
+        for i in range(1, 5):
+            self.bus.publish('start', i)
+        self.release.set()
+        self.bus.flush()
+        self.assertEqual(self.received, [('start', 0), ('start', 3), ('start', 4)])
+        self.assertEqual(subscription.dropped, 2)
+
+    def test_block_waits_for_subscriber(self):
+        subscription = self.subscribe('block')
+        self.stall()
+        thread = self.publish_in_thread(*[('start', i) for i in range(1, 5)])
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+        self.release.set()
+        thread.join(WAIT)
+        self.bus.flush()
+        self.assertEqual(self.received, [('start', i) for i in range(5)])
+        self.assertEqual(subscription.dropped, 0)
+
+    def test_coalesce_merges_adjacent_updates(self):
+        subscription = self.subscribe('coalesce')
+        self.stall()
+        for i in range(1, 4):
+            self.bus.publish('updates', [i])
+        self.bus.publish('stop', 1)
+        self.release.set()
+        self.bus.flush()
+        self.assertEqual(self.received, [('start', 0), ('updates', [1, 2, 3]), ('stop', 1)])
+        self.assertEqual(subscription.coalesced, 2)
+
+    def test_coalesce_never_drops_lifecycle_events(self):
+        subscription = self.subscribe('coalesce')
+        self.stall()
+        # 队列已满且队尾不能合并，开始/停止事件等待而不是挤掉更早的事件
+        thread = self.publish_in_thread(('updates', [1]), ('stop', 1), ('start', 2), ('stop', 2),
+                                        ('updates', [3]))
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+        self.release.set()
+        thread.join(WAIT)
+        self.bus.flush()
+        self.assertEqual(self.received, [('start', 0), ('updates', [1]), ('stop', 1), ('start', 2),
+                                         ('stop', 2), ('updates', [3])])
+        self.assertEqual(subscription.dropped, 0)
+
+    def test_unsubscribed_kinds_are_not_queued(self):
+        subscription = self.subscribe('drop-oldest')
+        self.assertFalse(self.bus.wants('sampling'))
+        self.bus.publish('sampling', 2, 1)
+        self.assertEqual(len(subscription), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
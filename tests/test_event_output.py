@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+事件输出测试: JSON Lines 每行都是合法的JSON，文本格式与原来的终端输出一致，缓冲按阈值写出
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_output import EventOutput, JsonLinesFormatter, TextFormatter, TimestampCache  # noqa: E402
+from subnet_rollup import Sweep  # noqa: E402
+
+START_TIME = 1700000000.0
+BASE_ADDRESS = 0x0A000000
+
+SUMMARY = (2.5, 1000.0, 1500.0, 2000.0, 56, 3, 1, None, None, None)
+
+
+def local_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class FormatterTest(unittest.TestCase):
+
+    def test_json_lines_are_valid_json(self):
+        formatter = JsonLinesFormatter()
+        start = json.loads(formatter.start(BASE_ADDRESS, START_TIME + 0.5, 4))
+        self.assertEqual(start, {'event': 'start', 'ip': '10.0.0.0', 'start': start['start'],
+                                 'start_ts': START_TIME + 0.5, 'count': 1, 'sampling_rate': 4})
+        self.assertEqual(start['start'], datetime.fromtimestamp(START_TIME).astimezone().isoformat())
+
+        stop = json.loads(formatter.stop(BASE_ADDRESS, START_TIME, START_TIME + 2, 3, SUMMARY))
+        self.assertEqual((stop['event'], stop['duration'], stop['count'], stop['rate']), ('stop', 2.0, 3, 2.5))
+        self.assertEqual((stop['interval_p50_ms'], stop['size_p50'], stop['seq_gaps'], stop['reorders']),
+                         (1000.0, 56, 3, 1))
+        self.assertIsNone(stop['reply_p50_ms'])
+        self.assertIsNone(stop['unanswered_ratio'])
+        self.assertEqual(stop['sampling_rate'], 1)
+
+        session = json.loads(formatter.session(BASE_ADDRESS, None, START_TIME, 1,
+                                               (0.0, None, None, None, None, 0, 0, None, None, None)))
+        self.assertEqual(session['event'], 'session')
+        self.assertIsNone(session['start'])
+        self.assertIsNone(session['size_p50'])
+        self.assertNotIn('sampling_rate', session)
+
+    def test_json_sweep_events(self):
+        formatter = JsonLinesFormatter()
+        sweep = Sweep(2, BASE_ADDRESS, 24, START_TIME)
+        sweep.active = sweep.hosts = sweep.peak = 3
+        sweep.last_time = START_TIME + 4
+        sweep.requests = 12
+        start = json.loads(formatter.sweep_start(sweep))
+        self.assertEqual((start['event'], start['id'], start['cidr'], start['active']),
+                         ('sweep_start', 2, '10.0.0.0/24', 3))
+        stop = json.loads(formatter.sweep_stop(sweep, 2))
+        self.assertEqual((stop['event'], stop['duration'], stop['peak'], stop['count'], stop['sampling_rate']),
+                         ('sweep_stop', 4.0, 3, 12, 2))
+
+    def test_text_matches_terminal_output(self):
+        formatter = TextFormatter()
+        self.assertEqual(formatter.start(BASE_ADDRESS, START_TIME),
+                         f"[{local_time(START_TIME)}] 10.0.0.0 开始ping本机")
+        self.assertEqual(formatter.start(BASE_ADDRESS, START_TIME, 8),
+                         f"[{local_time(START_TIME)}] 10.0.0.0 开始ping本机 [采样 1/8]")
+        stop = formatter.stop(BASE_ADDRESS, START_TIME, START_TIME + 2, 3, SUMMARY)
+        self.assertTrue(stop.startswith(f"[{local_time(START_TIME + 2)}] 10.0.0.0 停止ping本机 (共 3 个请求, "))
+
+    def test_timestamp_cache_formats_each_second_once(self):
+        cache = TimestampCache()
+        self.assertEqual(cache.format(START_TIME + 0.1), local_time(START_TIME))
+        cached = cache._cached
+        self.assertEqual(cache.format(START_TIME + 0.9), local_time(START_TIME))
+        self.assertIs(cache._cached, cached)
+        self.assertEqual(cache.format(START_TIME + 1), local_time(START_TIME + 1))
+
+
+class EventOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'events.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_lines(self):
+        with open(self.path, encoding='utf-8') as f:
+            return f.read().splitlines()
+
+    def test_buffered_until_flush_or_threshold(self):
+        output = EventOutput('jsonl', self.path, flush_interval=60.0, flush_bytes=1000)
+        output.start(BASE_ADDRESS, START_TIME)
+        self.assertEqual(self.read_lines(), [])
+        for i in range(1, 10):
+            output.start(BASE_ADDRESS + i, START_TIME)
+        # 超过 flush_bytes 时整批写出
+        self.assertGreater(len(self.read_lines()), 0)
+        output.sampling(4)
+        output.stop(BASE_ADDRESS, START_TIME, START_TIME + 1, 2, SUMMARY)
+        output.close()
+        events = [json.loads(line) for line in self.read_lines()]
+        self.assertEqual(len(events), 11)
+        self.assertEqual(output.lines_written, 11)
+        self.assertEqual(events[-1]['event'], 'stop')
+        self.assertEqual(events[-1]['sampling_rate'], 4)
+        self.assertFalse(output.owns_stdout)
+
+    def test_unbuffered_without_interval(self):
+        output = EventOutput('text', self.path, flush_interval=0)
+        output.start(BASE_ADDRESS, START_TIME)
+        self.assertEqual(len(self.read_lines()), 1)
+        output.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+惰性删除堆测试
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from expiry import ExpiryHeap  # noqa: E402
+
+START_TIME = 1700000000.0
+
+
+class Item:
+    def __init__(self, address, last_time):
+        self.address = address
+        self.last_time = last_time
+        self.deadline = None
+
+
+class ExpiryHeapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.items = {}
+        self.heap = ExpiryHeap(3.0, self.items.get)
+
+    def add(self, address, last_time):
+        item = self.items[address] = Item(address, last_time)
+        self.assertTrue(self.heap.touch(item))
+        return item
+
+    def test_expires_in_deadline_order(self):
+        first = self.add(1, START_TIME)
+        second = self.add(2, START_TIME + 1)
+        self.assertEqual(len(self.heap), 2)
+        self.assertEqual(self.heap.next_deadline(), START_TIME + 3)
+        self.assertEqual(self.heap.expire(START_TIME + 3.5), [first])
+        self.assertIsNone(first.deadline)
+        self.assertEqual(self.heap.expire(START_TIME + 4.5), [second])
+        self.assertEqual(len(self.heap), 0)
+        self.assertIsNone(self.heap.next_deadline())
+
+    def test_touch_of_active_item_does_not_push(self):
+        item = self.add(1, START_TIME)
+        item.last_time = START_TIME + 2
+        self.assertFalse(self.heap.touch(item))
+        self.assertEqual(len(self.heap._heap), 1)
+
+    def test_activity_before_deadline_reschedules(self):
+        item = self.add(1, START_TIME)
+        item.last_time = START_TIME + 2
+        # 旧截止时间到期时按新的截止时间重新入堆，而不是判定为停止
+        self.assertEqual(self.heap.expire(START_TIME + 3.5), [])
+        self.assertEqual(item.deadline, START_TIME + 5)
+        self.assertEqual(self.heap.next_deadline(), START_TIME + 5)
+        self.assertEqual(self.heap.expire(START_TIME + 5.5), [item])
+
+    def test_discarded_entry_is_skipped(self):
+        item = self.add(1, START_TIME)
+        self.heap.discard(item)
+        del self.items[1]
+        self.assertEqual(len(self.heap), 0)
+        self.assertEqual(self.heap.stale, 1)
+        self.assertEqual(self.heap.expire(START_TIME + 10), [])
+        self.assertEqual(self.heap.stale, 0)
+
+    def test_stale_entry_of_reused_address_is_skipped(self):
+        old = self.add(1, START_TIME)
+        self.heap.discard(old)
+        # 同一地址的新对象在旧条目之后入堆，旧条目弹出时不能让新对象过早停止
+        new = self.add(1, START_TIME + 2)
+        self.assertEqual(self.heap.expire(START_TIME + 4), [])
+        self.assertEqual(new.deadline, START_TIME + 5)
+        self.assertEqual(self.heap.expire(START_TIME + 6), [new])
+
+    def test_compact_drops_stale_entries(self):
+        for address in range(2000):
+            self.add(address, START_TIME)
+        for address in range(1500):
+            self.heap.discard(self.items.pop(address))
+        self.assertEqual(len(self.heap), 500)
+        self.assertLessEqual(len(self.heap._heap), 2 * len(self.heap))
+        self.assertEqual(len(self.heap.expire(START_TIME + 10)), 500)
+
+    def test_wait_time(self):
+        self.assertEqual(self.heap.wait_time(START_TIME), 1.0)
+        self.add(1, START_TIME)
+        self.assertAlmostEqual(self.heap.wait_time(START_TIME + 2.5), 0.5)
+        self.assertEqual(self.heap.wait_time(START_TIME + 5), 0.01)
+
+    def test_clear(self):
+        item = self.add(1, START_TIME)
+        self.heap.clear()
+        self.assertIsNone(item.deadline)
+        self.assertEqual(len(self.heap), 0)
+        self.assertEqual(self.heap.expire(START_TIME + 10), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+过载时的自适应采样测试
+"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import load_shedder  # noqa: E402
+from load_shedder import CALM_CHECKS, IDLE_RESET, LoadShedder, parse_sampling  # noqa: E402
+from source_table import SourceTable  # noqa: E402
+
+START_TIME = 1700000000.0
+BASE_ADDRESS = 0x0A000000
+
+
+class FakeClock:
+    """按测试给定的CPU占用推进的时钟和CPU时间"""
+
+    def __init__(self):
+        self.wall = START_TIME
+        self.cpu = 0.0
+
+    def advance(self, seconds, busy):
+        self.wall += seconds
+        self.cpu += seconds * busy
+
+
+class LoadShedderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patches = [mock.patch.object(load_shedder.time, 'time', lambda: self.clock.wall),
+                   mock.patch.object(load_shedder, '_cpu_time', lambda: self.clock.cpu)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.changes = []
+        self.shedder = LoadShedder(8, 1.0, lambda *change: self.changes.append(change[:2]))
+
+    def run_seconds(self, seconds, busy):
+        """以给定的CPU占用处理 seconds 秒的请求，包没有积压"""
+        for _ in range(seconds):
+            self.clock.advance(1.0, busy)
+            self.shedder.observe(self.clock.wall)
+
+    def test_selection_is_nested_and_proportional(self):
+        addresses = range(BASE_ADDRESS, BASE_ADDRESS + 4096)
+        selected = {}
+        for rate in (2, 4, 8):
+            self.shedder._set_rate(rate)
+            selected[rate] = {address for address in addresses if self.shedder.selects(address)}
+            self.assertAlmostEqual(len(selected[rate]), 4096 / rate, delta=4096 / rate * 0.1)
+        # 倍数翻倍时选中的源是原来的子集
+        self.assertTrue(selected[8] <= selected[4] <= selected[2])
+
+    def test_overload_doubles_rate_up_to_max(self):
+        self.shedder.observe(self.clock.wall)
+        self.run_seconds(5, 1.0)
+        self.assertEqual(self.shedder.rate, 8)
+        self.assertEqual(self.changes, [(2, 1), (4, 2), (8, 4)])
+
+    def test_growing_lag_doubles_rate(self):
+        self.shedder.observe(self.clock.wall)
+        # 包的时间戳每秒推进1秒，处理时刻每次推进2秒，积压越来越多
+        for second in (1, 2):
+            self.clock.advance(2.0, 0.5)
+            self.shedder.observe(START_TIME + second)
+        self.assertEqual(self.shedder.rate, 4)
+        self.assertEqual(self.shedder.lag, 2.0)
+
+    def test_calm_lowers_rate_step_by_step(self):
+        self.shedder.observe(self.clock.wall)
+        self.run_seconds(2, 1.0)
+        self.assertEqual(self.shedder.rate, 4)
+        self.run_seconds(CALM_CHECKS - 1, 0.1)
+        self.assertEqual(self.shedder.rate, 4)
+        self.run_seconds(1, 0.1)
+        self.assertEqual(self.shedder.rate, 2)
+        self.run_seconds(CALM_CHECKS, 0.1)
+        self.assertEqual(self.shedder.rate, 1)
+        # 中等负载保持不变
+        self.run_seconds(2, 1.0)
+        self.run_seconds(10, 0.6)
+        self.assertEqual(self.shedder.rate, 4)
+
+    def test_relax_restores_full_processing_when_idle(self):
+        self.shedder.observe(self.clock.wall)
+        self.run_seconds(2, 1.0)
+        self.assertEqual(self.shedder.rate, 4)
+        now = self.clock.wall
+        self.shedder.relax(now)
+        self.shedder.relax(now + IDLE_RESET - 1)
+        self.assertEqual(self.shedder.rate, 4)
+        self.shedder.relax(now + IDLE_RESET)
+        self.assertEqual(self.shedder.rate, 1)
+        self.assertEqual(self.changes[-1], (1, 4))
+
+    def test_table_keeps_active_sources_and_sheds_new_ones(self):
+        sampled = LoadShedder(8)
+        sampled._set_rate(8)
+        addresses = range(BASE_ADDRESS, BASE_ADDRESS + 100)
+        active, unselected = [address for address in addresses if not sampled.selects(address)][:2]
+        selected = next(address for address in addresses if sampled.selects(address))
+
+        table = SourceTable(max_size=0, timeout=3.0, shedder=self.shedder)
+        table.touch(active, START_TIME)
+        self.run_seconds(3, 1.0)
+        self.assertEqual(self.shedder.rate, 8)
+        timestamp = self.clock.wall
+        # 已经活跃的源不受采样影响
+        record, started = table.touch(active, timestamp)
+        self.assertEqual((record.count, started), (2, False))
+        self.assertEqual(table.touch(unselected, timestamp), (None, False))
+        self.assertEqual(self.shedder.shed, 1)
+        record, started = table.touch(selected, timestamp)
+        self.assertTrue(started)
+        # 选中的源代表 N 个源，活跃数按采样倍数放大
+        self.assertEqual(record.weight, 8)
+        self.assertEqual(table.estimated_active, 2 + 7)
+
+    def test_parse_sampling(self):
+        self.assertEqual(parse_sampling('16'), 16)
+        for text in ('0', '3', '-2'):
+            with self.assertRaises(ValueError):
+                parse_sampling(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
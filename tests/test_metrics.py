@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+指标测试: 直方图分桶、多进程汇总和 Prometheus 文本格式
+"""
+
+import os
+import sys
+import unittest
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import LatencyHistogram, MetricsServer, MonitorMetrics, SessionCounters, MIN_EXP  # noqa: E402
+
+START_TIME = 1700000000.0
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_buckets_and_percentiles(self):
+        histogram = LatencyHistogram('test_seconds', "测试", max_exp=20)
+        self.assertIsNone(histogram.percentile(0.5))
+        # 1微秒以下都落在第一个桶
+        histogram.observe(0.0)
+        histogram.observe(500e-9)
+        for _ in range(8):
+            histogram.observe(3e-6)
+        self.assertEqual(histogram.counts[0], 2)
+        self.assertEqual(histogram.counts[2], 8)
+        self.assertEqual(histogram.percentile(0.1), (1 << MIN_EXP) / 1e9)
+        self.assertEqual(histogram.percentile(0.5), (1 << (MIN_EXP + 2)) / 1e9)
+        # 超过上限的落在最后一个不设上限的桶，分位数按上限估算
+        histogram.observe(10.0)
+        self.assertEqual(histogram.counts[-1], 1)
+        self.assertEqual(histogram.percentile(1.0), (1 << 20) / 1e9)
+        self.assertEqual(histogram.count, 11)
+
+    def test_load_sums_worker_states(self):
+        first = LatencyHistogram('test_seconds', "测试")
+        second = LatencyHistogram('test_seconds', "测试")
+        first.observe(3e-6)
+        second.observe(3e-6)
+        second.observe(1e-3)
+        merged = LatencyHistogram('test_seconds', "测试")
+        merged.load([first.state(), second.state()])
+        self.assertEqual(merged.count, 3)
+        self.assertEqual(merged.counts[2], 2)
+        self.assertEqual(merged.total_ns, first.total_ns + second.total_ns)
+
+    def test_render_is_cumulative(self):
+        histogram = LatencyHistogram('test_seconds', "测试", max_exp=12)
+        histogram.observe(2e-6)
+        histogram.observe(1.0)
+        lines = []
+        histogram.render(lines)
+        self.assertIn('test_seconds_bucket{le="1.024e-06"} 0', lines)
+        self.assertIn('test_seconds_bucket{le="2.048e-06"} 1', lines)
+        self.assertIn('test_seconds_bucket{le="4.096e-06"} 1', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('test_seconds_count 2', lines)
+
+
+class MonitorMetricsTest(unittest.TestCase):
+
+    def test_render_skips_missing_values(self):
+        metrics = MonitorMetrics()
+        metrics.add('icmp_monitor_sources', 'gauge', "源数量", lambda: 5)
+        metrics.add('icmp_monitor_kernel_drops_total', 'counter', "内核丢包", lambda: None)
+        metrics.add('icmp_monitor_broken', 'gauge', "出错的回调", lambda: 1 // 0)
+        counters = SessionCounters(metrics)
+        counters.session(1, START_TIME, START_TIME + 2, 3, None)
+        counters.session(2, None, START_TIME, 1, None)
+        metrics.handled = 7
+        text = metrics.render()
+        self.assertIn("# TYPE icmp_monitor_sources gauge\nicmp_monitor_sources 5\n", text)
+        self.assertNotIn("icmp_monitor_kernel_drops_total", text)
+        self.assertNotIn("icmp_monitor_broken", text)
+        self.assertIn("icmp_monitor_packets_handled_total 7\n", text)
+        self.assertIn("icmp_monitor_sessions_total 2\n", text)
+        self.assertIn("icmp_monitor_session_duration_seconds_count 1\n", text)
+        line = metrics.summary_line()
+        self.assertIn("处理 7 ", line)
+        self.assertIn("内核丢包 -", line)
+
+    def test_http_endpoint(self):
+        metrics = MonitorMetrics()
+        server = MetricsServer(metrics, 0)
+        server.start()
+        try:
+            host, port = server.address
+            with urlopen(f"http://{host}:{port}/metrics", timeout=5) as response:
+                self.assertEqual(response.status, 200)
+                self.assertIn(b"icmp_monitor_packets_handled_total 0", response.read())
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+pcap/pcapng 离线回放测试: 各种文件格式、字节序、时间戳精度和链路层类型都应解析出相同的Echo请求
+"""
+
+import os
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcap_reader import (LINKTYPE_ETHERNET, LINKTYPE_LINUX_SLL, LINKTYPE_LOOP, LINKTYPE_NULL,  # noqa: E402
+                         LINKTYPE_RAW, PCAP_MAGIC_NSEC, PCAP_MAGIC_USEC, PcapFormatError, PcapReplay,
+                         tsresol_scale)
+
+START_TIME = 1700000000.0
+BASE_ADDRESS = 0x0A000000
+LOCAL_ADDRESS = 0xC0A80001
+PAYLOAD = b'\0' * 56
+
+
+def echo_packet(src, dst, ident, seq, icmp_type=8):
+    """构造IPv4 ICMP Echo请求（或应答）的原始字节"""
+    icmp = struct.pack('!BBHHH', icmp_type, 0, 0, ident, seq) + PAYLOAD
+    return struct.pack('!BBHHHBBHII', 0x45, 0, 20 + len(icmp), 0, 0, 64, 1, 0, src, dst) + icmp
+
+
+def ethernet_frame(packet, vlan=False, padding=0):
+    header = b'\xff' * 12
+    if vlan:
+        header += struct.pack('!HH', 0x8100, 5)
+    return header + struct.pack('!H', 0x0800) + packet + b'\0' * padding
+
+
+def write_pcap(path, frames, linktype=LINKTYPE_RAW, endian='<', nsec=False):
+    """frames 为 [(时间戳, 帧字节), ...]"""
+    magic = PCAP_MAGIC_NSEC if nsec else PCAP_MAGIC_USEC
+    scale = 1e9 if nsec else 1e6
+    with open(path, 'wb') as f:
+        f.write(struct.pack(endian + 'IHHiIII', magic, 2, 4, 0, 0, 65535, linktype))
+        for timestamp, frame in frames:
+            sec = int(timestamp)
+            f.write(struct.pack(endian + 'IIII', sec, round((timestamp - sec) * scale), len(frame), len(frame)))
+            f.write(frame)
+
+
+def pcapng_block(block_type, body, endian='<'):
+    body += b'\0' * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack(endian + 'II', block_type, length) + body + struct.pack(endian + 'I', length)
+
+
+def pcapng_section(endian='<'):
+    return pcapng_block(0x0A0D0D0A, struct.pack(endian + 'IHHq', 0x1A2B3C4D, 1, 0, -1), endian)
+
+
+def pcapng_interface(linktype, tsresol=None, endian='<'):
+    options = b''
+    if tsresol is not None:
+        options = struct.pack(endian + 'HHB3x', 9, 1, tsresol) + struct.pack(endian + 'HH', 0, 0)
+    return pcapng_block(1, struct.pack(endian + 'HHI', linktype, 0, 65535) + options, endian)
+
+
+def pcapng_packet(interface, ticks, frame, endian='<'):
+    body = struct.pack(endian + 'IIIII', interface, ticks >> 32, ticks & 0xFFFFFFFF,
+                       len(frame), len(frame)) + frame
+    return pcapng_block(6, body, endian)
+
+
+def pcapng_simple_packet(frame, endian='<'):
+    return pcapng_block(3, struct.pack(endian + 'I', len(frame)) + frame, endian)
+
+
+class PcapReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'capture')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def replay(self, data=None):
+        if data is not None:
+            with open(self.path, 'wb') as f:
+                f.write(data)
+        requests = []
+        replies = []
+        replay = PcapReplay(self.path)
+        replay.run(lambda *request: requests.append(request),
+                   reply_handler=lambda *reply: replies.append(reply))
+        return replay, requests, replies
+
+    def assertRequests(self, requests, expected):
+        self.assertEqual(len(requests), len(expected))
+        for (src, timestamp, ident, seq, size), (expected_src, expected_time, expected_seq) in \
+                zip(requests, expected):
+            self.assertEqual((src, ident, seq, size), (expected_src, 7, expected_seq, len(PAYLOAD)))
+            self.assertAlmostEqual(timestamp, expected_time, places=6)
+
+    def test_pcap_byte_orders_and_resolutions(self):
+        frames = [(START_TIME + i * 0.25, echo_packet(BASE_ADDRESS + i, LOCAL_ADDRESS, 7, i))
+                  for i in range(4)]
+        expected = [(BASE_ADDRESS + i, START_TIME + i * 0.25, i) for i in range(4)]
+        for endian in '<>':
+            for nsec in (False, True):
+                write_pcap(self.path, frames, endian=endian, nsec=nsec)
+                replay, requests, _ = self.replay()
+                self.assertRequests(requests, expected)
+                self.assertEqual((replay.packets_seen, replay.packets_matched), (4, 4))
+                self.assertEqual(replay.bytes_read, os.path.getsize(self.path))
+
+    def test_link_layers(self):
+        packet = echo_packet(BASE_ADDRESS, LOCAL_ADDRESS, 7, 1)
+        frames = {
+            LINKTYPE_ETHERNET: [ethernet_frame(packet), ethernet_frame(packet, vlan=True),
+                                ethernet_frame(packet, padding=6)],
+            LINKTYPE_NULL: [struct.pack('<I', 2) + packet],
+            LINKTYPE_LOOP: [struct.pack('!I', 2) + packet],
+            LINKTYPE_LINUX_SLL: [b'\0' * 14 + struct.pack('!H', 0x0800) + packet],
+        }
+        for linktype, link_frames in frames.items():
+            write_pcap(self.path, [(START_TIME, frame) for frame in link_frames], linktype)
+            _, requests, _ = self.replay()
+            self.assertRequests(requests, [(BASE_ADDRESS, START_TIME, 1)] * len(link_frames))
+
+    def test_non_echo_packets_and_replies(self):
+        udp = echo_packet(BASE_ADDRESS, LOCAL_ADDRESS, 7, 3)
+        frames = [
+            (START_TIME, echo_packet(BASE_ADDRESS, LOCAL_ADDRESS, 7, 1)),
+            (START_TIME + 0.5, echo_packet(LOCAL_ADDRESS, BASE_ADDRESS, 7, 1, icmp_type=0)),
+            (START_TIME + 1, echo_packet(BASE_ADDRESS, LOCAL_ADDRESS, 7, 2, icmp_type=3)),
+            # 协议号为UDP
+            (START_TIME + 1, udp[:9] + b'\x11' + udp[10:]),
+        ]
+        write_pcap(self.path, frames)
+        replay, requests, replies = self.replay()
+        self.assertRequests(requests, [(BASE_ADDRESS, START_TIME, 1)])
+        self.assertEqual(replies, [(BASE_ADDRESS, START_TIME + 0.5, 7, 1)])
+        self.assertEqual((replay.packets_seen, replay.packets_matched), (4, 1))
+
+    def test_truncated_last_record_is_ignored(self):
+        frames = [(START_TIME + i, echo_packet(BASE_ADDRESS, LOCAL_ADDRESS, 7, i)) for i in range(2)]
+        write_pcap(self.path, frames)
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 10)
+        replay, requests, _ = self.replay()
+        self.assertRequests(requests, [(BASE_ADDRESS, START_TIME, 0)])
+        self.assertEqual(replay.packets_seen, 1)
+
+    def test_unknown_format_raises(self):
+        with self.assertRaises(PcapFormatError):
+            self.replay(b'\0' * 64)
+        with self.assertRaises(PcapFormatError):
+            self.replay(b'\0')
+
+    def test_pcapng_sections_interfaces_and_resolutions(self):
+        packet = echo_packet(BASE_ADDRESS, LOCAL_ADDRESS, 7, 1)
+        nanoseconds = int(START_TIME) * 10 ** 9 + 500000000
+        data = b''.join([
+            pcapng_section(),
+            pcapng_interface(LINKTYPE_RAW),
+            pcapng_interface(LINKTYPE_ETHERNET, tsresol=9),
+            pcapng_packet(0, int(START_TIME) * 10 ** 6 + 250000, packet),
+            pcapng_packet(1, nanoseconds, ethernet_frame(echo_packet(BASE_ADDRESS + 1, LOCAL_ADDRESS, 7, 2))),
+            # 简单包块沿用上一条记录的时间戳，使用第一个接口
+            pcapng_simple_packet(echo_packet(BASE_ADDRESS + 2, LOCAL_ADDRESS, 7, 3)),
+            # 未定义的接口编号跳过
+            pcapng_packet(5, 0, packet),
+            # 新的段使用大端字节序，接口编号重新开始；tsresol 为2的负幂
+            pcapng_section('>'),
+            pcapng_interface(LINKTYPE_RAW, tsresol=0x80 | 10, endian='>'),
+            pcapng_packet(0, int((START_TIME + 2) * 1024), echo_packet(BASE_ADDRESS + 3, LOCAL_ADDRESS, 7, 4), '>'),
+        ])
+        replay, requests, _ = self.replay(data)
+        self.assertRequests(requests, [(BASE_ADDRESS, START_TIME + 0.25, 1),
+                                       (BASE_ADDRESS + 1, START_TIME + 0.5, 2),
+                                       (BASE_ADDRESS + 2, START_TIME + 0.5, 3),
+                                       (BASE_ADDRESS + 3, START_TIME + 2, 4)])
+        self.assertEqual(replay.packets_seen, 5)
+        self.assertEqual(replay.bytes_read, len(data))
+
+    def test_tsresol_scale(self):
+        self.assertEqual(tsresol_scale(6), 1e-6)
+        self.assertEqual(tsresol_scale(9), 1e-9)
+        self.assertEqual(tsresol_scale(0x80 | 10), 2.0 ** -10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+原始套接字抓包引擎测试: 直接从IP/ICMP头部字节解析Echo请求和应答
+"""
+
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from raw_capture import parse_echo_reply, parse_echo_request  # noqa: E402
+
+BASE_ADDRESS = 0x0A000000
+LOCAL_ADDRESS = 0xC0A80001
+
+
+def ip_packet(src, dst, payload, protocol=1, options=b''):
+    ihl = (20 + len(options)) // 4
+    return struct.pack('!BBHHHBBHII', 0x40 | ihl, 0, 20 + len(options) + len(payload), 0, 0, 64,
+                       protocol, 0, src, dst) + options + payload
+
+
+def icmp(icmp_type, ident, seq, size=56):
+    return struct.pack('!BBHHH', icmp_type, 0, 0, ident, seq) + b'\0' * size
+
+
+class ParseEchoTest(unittest.TestCase):
+
+    def test_echo_request(self):
+        packet = ip_packet(BASE_ADDRESS, LOCAL_ADDRESS, icmp(8, 0x1234, 7))
+        self.assertEqual(parse_echo_request(packet, len(packet)), (BASE_ADDRESS, 0x1234, 7, 56))
+        self.assertIsNone(parse_echo_reply(packet, len(packet)))
+
+    def test_echo_reply(self):
+        packet = ip_packet(LOCAL_ADDRESS, BASE_ADDRESS, icmp(0, 0x1234, 7))
+        self.assertEqual(parse_echo_reply(packet, len(packet)), (BASE_ADDRESS, 0x1234, 7))
+        self.assertIsNone(parse_echo_request(packet, len(packet)))
+
+    def test_ip_options_are_skipped(self):
+        packet = ip_packet(BASE_ADDRESS, LOCAL_ADDRESS, icmp(8, 1, 2, size=0), options=b'\x01' * 8)
+        self.assertEqual(parse_echo_request(packet, len(packet)), (BASE_ADDRESS, 1, 2, 0))
+        # 选项之后放不下ICMP头
+        self.assertIsNone(parse_echo_request(packet, len(packet) - 1))
+
+    def test_length_limits_reused_buffer(self):
+        # 复用的接收缓冲区中有上一个更长的包留下的字节
+        buffer = bytearray(65535)
+        packet = ip_packet(BASE_ADDRESS, LOCAL_ADDRESS, icmp(8, 1, 2, size=10))
+        buffer[:len(packet)] = packet
+        self.assertEqual(parse_echo_request(buffer, len(packet)), (BASE_ADDRESS, 1, 2, 10))
+        self.assertIsNone(parse_echo_request(buffer, 27))
+
+    def test_other_packets_are_ignored(self):
+        packets = [
+            ip_packet(BASE_ADDRESS, LOCAL_ADDRESS, icmp(3, 0, 0)),
+            ip_packet(BASE_ADDRESS, LOCAL_ADDRESS, icmp(8, 1, 2), protocol=17),
+            b'\x60' + ip_packet(BASE_ADDRESS, LOCAL_ADDRESS, icmp(8, 1, 2))[1:],
+        ]
+        for packet in packets:
+            self.assertIsNone(parse_echo_request(packet, len(packet)))
+            self.assertIsNone(parse_echo_reply(packet, len(packet)))
+
+
+if __name__ == '__main__':
+    unittest.main()
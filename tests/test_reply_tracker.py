@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Echo请求/应答配对测试
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reply_tracker import InFlightIndex, echo_key  # noqa: E402
+from source_stats import SourceStats  # noqa: E402
+
+START_TIME = 1700000000.0
+BASE_ADDRESS = 0x0A000000
+
+
+class InFlightIndexTest(unittest.TestCase):
+
+    def test_echo_key_is_unique_per_field(self):
+        keys = {echo_key(BASE_ADDRESS, 1, 2), echo_key(BASE_ADDRESS, 2, 1),
+                echo_key(BASE_ADDRESS + 1, 1, 2), echo_key(BASE_ADDRESS, 0xFFFF, 0xFFFF)}
+        self.assertEqual(len(keys), 4)
+
+    def test_reply_matches_request(self):
+        index = InFlightIndex(2.0, 16)
+        stats = SourceStats()
+        index.add(BASE_ADDRESS, 7, 1, START_TIME, stats)
+        self.assertAlmostEqual(index.match(BASE_ADDRESS, 7, 1, START_TIME + 0.25), 0.25)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.matched, 1)
+        self.assertEqual((stats.replies_expected, stats.replies), (1, 1))
+        self.assertEqual(stats.unanswered_ratio(), 0.0)
+        # 同一个应答只能配对一次
+        self.assertIsNone(index.match(BASE_ADDRESS, 7, 1, START_TIME + 0.3))
+        self.assertEqual(index.unmatched, 1)
+
+    def test_reply_to_other_address_or_sequence_is_unmatched(self):
+        index = InFlightIndex(2.0, 16)
+        stats = SourceStats()
+        index.add(BASE_ADDRESS, 7, 1, START_TIME, stats)
+        self.assertIsNone(index.match(BASE_ADDRESS + 1, 7, 1, START_TIME + 0.1))
+        self.assertIsNone(index.match(BASE_ADDRESS, 8, 1, START_TIME + 0.1))
+        self.assertIsNone(index.match(BASE_ADDRESS, 7, 2, START_TIME + 0.1))
+        self.assertEqual(index.unmatched, 3)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(stats.unanswered_ratio(), 1.0)
+
+    def test_duplicate_request_keeps_first(self):
+        index = InFlightIndex(2.0, 16)
+        stats = SourceStats()
+        index.add(BASE_ADDRESS, 7, 1, START_TIME, stats)
+        index.add(BASE_ADDRESS, 7, 1, START_TIME + 0.5, stats)
+        self.assertEqual(stats.replies_expected, 1)
+        self.assertAlmostEqual(index.match(BASE_ADDRESS, 7, 1, START_TIME + 1.0), 1.0)
+
+    def test_late_reply_is_expired(self):
+        index = InFlightIndex(2.0, 16)
+        stats = SourceStats()
+        index.add(BASE_ADDRESS, 7, 1, START_TIME, stats)
+        self.assertIsNone(index.match(BASE_ADDRESS, 7, 1, START_TIME + 3.0))
+        self.assertEqual((index.expired, index.unmatched), (1, 1))
+        self.assertEqual(stats.replies, 0)
+
+    def test_old_requests_expire_on_add(self):
+        index = InFlightIndex(2.0, 16)
+        stats = SourceStats()
+        for seq in range(3):
+            index.add(BASE_ADDRESS, 7, seq, START_TIME + seq * 0.1, stats)
+        index.add(BASE_ADDRESS, 7, 3, START_TIME + 5.0, stats)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.expired, 3)
+        self.assertEqual(stats.unanswered_ratio(), 1.0)
+
+    def test_capacity_evicts_oldest(self):
+        index = InFlightIndex(2.0, 4)
+        stats = SourceStats()
+        for seq in range(6):
+            index.add(BASE_ADDRESS, 7, seq, START_TIME, stats)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.overflowed, 2)
+        self.assertIsNone(index.match(BASE_ADDRESS, 7, 0, START_TIME + 0.1))
+        self.assertIsNotNone(index.match(BASE_ADDRESS, 7, 5, START_TIME + 0.1))
+
+    def test_reordered_timestamps_clamp_to_zero(self):
+        index = InFlightIndex(2.0, 16)
+        stats = SourceStats()
+        index.add(BASE_ADDRESS, 7, 1, START_TIME, stats)
+        self.assertEqual(index.match(BASE_ADDRESS, 7, 1, START_TIME - 0.001), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+会话历史测试
+源停止后重新开始ping时，每次会话单独写入一行，开始时间、请求数和统计不累计上一次会话
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture_engine import CaptureEngine  # noqa: E402
+from session_history import SessionHistory, query_sessions  # noqa: E402
+from source_table import ip_to_int  # noqa: E402
+
+START_TIME = 1700000000.0
+
+
+class ResumedSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'history.db')
+        self.history = SessionHistory(self.path)
+        self.engine = CaptureEngine(engine='raw', timeout=3.0, max_sources=2)
+        self.engine.add_history(self.history)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def ping(self, src, first, count, seq):
+        for i in range(count):
+            self.engine.handle_echo(src, first + i, 1, seq + i, 56)
+
+    def test_stop_resume_stop_writes_separate_sessions(self):
+        src = ip_to_int('10.0.0.1')
+        self.ping(src, START_TIME, 10, 1)
+        self.engine.check_inactive_ips(START_TIME + 13)
+        # 20秒后重新开始ping，序号从100开始
+        self.ping(src, START_TIME + 20, 5, 100)
+        self.engine.check_inactive_ips(START_TIME + 28)
+        self.engine.close()
+        self.history.close()
+
+        sessions = query_sessions(self.path)
+        self.assertEqual(len(sessions), 2)
+        (first_src, first_start, first_end, first_count, first_summary), \
+            (second_src, second_start, second_end, second_count, second_summary) = sessions
+        self.assertEqual((first_src, first_start, first_end, first_count),
+                         (src, START_TIME, START_TIME + 9, 10))
+        self.assertEqual((second_src, second_start, second_end, second_count),
+                         (src, START_TIME + 20, START_TIME + 24, 5))
+        # 序号缺失只统计本次会话内的
+        self.assertEqual(first_summary[5], 0)
+        self.assertEqual(second_summary[5], 0)
+        # 间隔分位数不包含两次会话之间的20秒
+        self.assertAlmostEqual(second_summary[3], 1000.0, delta=100.0)
+
+    def test_evicted_active_source_writes_session(self):
+        sources = [ip_to_int(f'10.0.0.{i}') for i in range(1, 4)]
+        for offset, src in enumerate(sources):
+            self.ping(src, START_TIME + offset * 0.1, 2, 1)
+        # 第三个源使表超出容量，仍在ping的第一个源被淘汰，在下一次检查时报告停止
+        self.engine.check_inactive_ips(START_TIME + 1.5)
+        self.engine.close()
+        self.history.close()
+
+        sessions = query_sessions(self.path)
+        self.assertEqual([(src, start, end, count) for src, start, end, count, _ in sessions],
+                         [(sources[0], START_TIME, START_TIME + 1, 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+简化版监控测试: 从 /proc/net/snmp 和 /proc/net/raw 格式的文件读取ICMP计数和原始套接字
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from simple_icmp_monitor import ProcIcmpCounters  # noqa: E402
+
+SNMP = """Ip: Forwarding DefaultTTL InReceives
+Ip: 1 64 1000
+Icmp: InMsgs InErrors InCsumErrors InDestUnreachs InEchos InEchoReps OutMsgs
+Icmp: {msgs} 0 0 2 {echos} 0 9
+IcmpMsg: InType3 InType8
+IcmpMsg: 2 {echos}
+"""
+
+RAW = """  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode ref pointer drops
+   1: 00000000:0001 00000000:0000 07 00000000:00000000 00:00000000 00000000     0        0 1234 2 0000000000000000 {drops}
+   2: 00000000:00FF 00000000:0000 07 00000000:00000000 00:00000000 00000000     0        0 1235 2 0000000000000000 7
+   3: 0100007F:0001 00000000:0000 07 00000000:00000000 00:00000000 00000000     0        0 1236 2 0000000000000000 1
+"""
+
+
+class ProcIcmpCountersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.snmp = os.path.join(self.directory.name, 'snmp')
+        self.raw = os.path.join(self.directory.name, 'raw')
+        self.write(self.snmp, SNMP.format(msgs=10, echos=4))
+        self.write(self.raw, RAW.format(drops=0))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    @staticmethod
+    def write(path, text):
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def test_counters_follow_file_updates(self):
+        counters = ProcIcmpCounters(self.snmp, self.raw)
+        try:
+            self.assertEqual(counters.counters(), (10, 4))
+            self.assertEqual(counters.raw_sockets(), (2, 1))
+            # 文件只打开一次，之后的读取看到新的内容
+            self.write(self.snmp, SNMP.format(msgs=25, echos=19))
+            self.write(self.raw, RAW.format(drops=5))
+            self.assertEqual(counters.counters(), (25, 19))
+            self.assertEqual(counters.raw_sockets(), (2, 6))
+        finally:
+            counters.close()
+
+    def test_missing_raw_file(self):
+        counters = ProcIcmpCounters(self.snmp, os.path.join(self.directory.name, 'missing'))
+        try:
+            self.assertEqual(counters.raw_sockets(), (None, None))
+            self.assertEqual(counters.counters(), (10, 4))
+        finally:
+            counters.close()
+
+    def test_file_without_icmp_counters(self):
+        self.write(self.snmp, "Ip: Forwarding\nIp: 1\n")
+        with self.assertRaises(ValueError):
+            ProcIcmpCounters(self.snmp, self.raw)
+
+    def test_large_file_is_read_completely(self):
+        self.write(self.snmp, "Tcp: " + "x" * 70000 + "\nTcp: 1\n" + SNMP.format(msgs=3, echos=2))
+        counters = ProcIcmpCounters(self.snmp, self.raw)
+        try:
+            self.assertEqual(counters.counters(), (3, 2))
+        finally:
+            counters.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
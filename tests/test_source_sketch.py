@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+固定内存的源估算测试
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source_sketch import (CountMinSketch, SourceSketch, TopK, WindowedHyperLogLog,  # noqa: E402
+                           format_top, merge_summaries, mix64)
+from source_table import SourceTable  # noqa: E402
+
+START_TIME = 1700000000.0
+BASE_ADDRESS = 0x0A000000
+
+
+class CountMinSketchTest(unittest.TestCase):
+
+    def test_estimate_never_undercounts(self):
+        sketch = CountMinSketch(256, 4)
+        counts = {}
+        for i in range(5000):
+            address = BASE_ADDRESS + (i * 7919) % 1000
+            counts[address] = counts.get(address, 0) + 1
+            sketch.add(mix64(address))
+        self.assertEqual(sketch.total, 5000)
+        for address, count in counts.items():
+            self.assertGreaterEqual(sketch.estimate(mix64(address)), count)
+
+    def test_add_returns_current_estimate(self):
+        sketch = CountMinSketch(1024, 4)
+        hashed = mix64(BASE_ADDRESS)
+        for count in range(1, 4):
+            self.assertEqual(sketch.add(hashed), count)
+        self.assertEqual(sketch.estimate(hashed), 3)
+        self.assertEqual(sketch.estimate(mix64(BASE_ADDRESS + 1)), 0)
+
+    def test_width_must_be_power_of_two(self):
+        with self.assertRaises(ValueError):
+            CountMinSketch(1000)
+
+
+class TopKTest(unittest.TestCase):
+
+    def test_keeps_largest_estimates(self):
+        top = TopK(3)
+        for key in range(10):
+            top.offer(key, key + 1)
+        self.assertEqual(top.items(), [(9, 10), (8, 9), (7, 8)])
+
+    def test_member_growth_is_seen_by_later_offers(self):
+        top = TopK(2)
+        top.offer('a', 1)
+        top.offer('b', 2)
+        # 'a' 的估计值增长后堆中的旧值过时，新键应替换真正最小的 'b'
+        top.offer('a', 10)
+        top.offer('c', 5)
+        self.assertEqual(top.items(), [('a', 10), ('c', 5)])
+        self.assertEqual(top.items(1), [('a', 10)])
+
+
+class WindowedHyperLogLogTest(unittest.TestCase):
+
+    def test_estimate_within_error(self):
+        hll = WindowedHyperLogLog(12, 60.0, 6)
+        for i in range(20000):
+            hll.add(mix64(BASE_ADDRESS + i), START_TIME)
+        estimate = hll.estimate(START_TIME)
+        # 标准误差约1.6%，取5%的余量
+        self.assertAlmostEqual(estimate, 20000, delta=1000)
+
+    def test_small_cardinality_is_exact_enough(self):
+        hll = WindowedHyperLogLog(12, 60.0, 6)
+        for i in range(50):
+            for _ in range(3):
+                hll.add(mix64(BASE_ADDRESS + i), START_TIME)
+        self.assertAlmostEqual(hll.estimate(START_TIME), 50, delta=2)
+
+    def test_old_segments_leave_window(self):
+        hll = WindowedHyperLogLog(10, 60.0, 6)
+        for i in range(1000):
+            hll.add(mix64(BASE_ADDRESS + i), START_TIME)
+        self.assertTrue(hll.add(mix64(BASE_ADDRESS + 5000), START_TIME + 30))
+        self.assertGreater(hll.estimate(START_TIME + 30), 900)
+        # 一个窗口之后只剩后来加入的源
+        self.assertEqual(hll.estimate(START_TIME + 85), 1)
+        self.assertEqual(hll.estimate(START_TIME + 200), 0)
+
+
+class SourceSketchTest(unittest.TestCase):
+
+    def test_table_switches_to_sketch_at_threshold(self):
+        sketch = SourceSketch(100, top_k=5, width=1024, precision=10)
+        table = SourceTable(max_size=0, timeout=3.0, sketch=sketch)
+        for i in range(500):
+            table.touch(BASE_ADDRESS + i, START_TIME)
+        heavy = BASE_ADDRESS + 1000
+        for _ in range(200):
+            table.touch(heavy, START_TIME + 1)
+        # 达到阈值后新的源不再建立记录
+        self.assertEqual(len(table), 100)
+        self.assertEqual(sketch.activations, 1)
+        active, distinct, top = table.sketch_summary(START_TIME + 1)
+        self.assertTrue(active)
+        self.assertAlmostEqual(distinct, 401, delta=25)
+        self.assertEqual(top[0][0], heavy)
+        self.assertGreaterEqual(top[0][1], 200)
+        self.assertIn("10.0.3.232 (", format_top(top))
+
+    def test_sketch_deactivates_when_sources_drop(self):
+        sketch = SourceSketch(100, width=1024, precision=10, window=60.0)
+        sketch.activate(START_TIME)
+        for i in range(1000):
+            sketch.add(BASE_ADDRESS + i, START_TIME)
+        self.assertTrue(sketch.active)
+        # 窗口过后只剩少量源，进入新的一段时退出估算模式
+        sketch.add(BASE_ADDRESS, START_TIME + 61)
+        self.assertFalse(sketch.active)
+        self.assertEqual(sketch.summary(START_TIME + 61), (False, None, []))
+
+    def test_merge_summaries(self):
+        merged = merge_summaries([(True, 100, [(1, 50), (2, 10)]),
+                                  (False, None, []),
+                                  (True, 40, [(3, 30)])], n=2)
+        self.assertEqual(merged, (True, 140, [(1, 50), (3, 30)]))
+        self.assertEqual(merge_summaries([(False, None, [])]), (False, None, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
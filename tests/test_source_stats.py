@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+单个源的流式统计测试
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source_stats import SourceStats  # noqa: E402
+
+
+class SourceStatsTest(unittest.TestCase):
+
+    def test_single_request_allocates_no_histograms(self):
+        stats = SourceStats()
+        stats.update(100.0, 1, 1, 56)
+        self.assertIsNone(stats.intervals)
+        self.assertIsNone(stats.sizes)
+        rate, p50, p95, p99, size_p50, gaps, reorders, _, _, _ = stats.summary()
+        self.assertEqual((rate, p50, p95, p99, size_p50, gaps, reorders), (0.0, None, None, None, 56, 0, 0))
+
+    def test_histograms_include_first_request(self):
+        stats = SourceStats()
+        stats.update(100.0, 1, 1, 56)
+        stats.update(101.0, 1, 2, 1000)
+        stats.update(102.0, 1, 3, 1000)
+        self.assertEqual(stats.sizes.total, 3)
+        self.assertEqual(stats.intervals.total, 2)
+        summary = stats.summary()
+        self.assertAlmostEqual(summary[1], 1000.0, delta=100.0)
+        self.assertAlmostEqual(summary[4], 1000, delta=100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ping源状态表测试: 会话开始、按容量淘汰和超时堆
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source_table import SourceTable  # noqa: E402
+
+BASE_ADDRESS = 0x0A000000  # 10.0.0.0
+START_TIME = 1700000000.0
+
+
+class SessionTest(unittest.TestCase):
+
+    def test_reactivated_source_starts_new_session(self):
+        table = SourceTable(timeout=3.0)
+        record, started = table.touch(BASE_ADDRESS, START_TIME)
+        self.assertTrue(started)
+        self.assertEqual(table.touch(BASE_ADDRESS, START_TIME + 1), (record, False))
+        self.assertEqual(table.expire(START_TIME + 10), [record])
+        self.assertEqual(table.touch(BASE_ADDRESS, START_TIME + 20), (record, True))
+        self.assertEqual((record.start_time, record.count), (START_TIME + 20, 1))
+
+
+class EvictionTest(unittest.TestCase):
+
+    def test_heap_stays_bounded_when_active_sources_are_evicted(self):
+        max_size = 1000
+        table = SourceTable(max_size=max_size, timeout=3.0)
+        for i in range(20 * max_size):
+            table.touch(BASE_ADDRESS + i, START_TIME + i * 1e-4)
+        self.assertEqual(len(table), max_size)
+        self.assertEqual(table.active_count, max_size)
+        heap = table.expiry._heap
+        # 旧条目不超过活跃源数（加上重建堆的最小阈值），且只保存地址，不引用被淘汰的记录
+        self.assertLessEqual(len(heap), 2 * max_size + 1024)
+        self.assertTrue(all(len(entry) == 2 for entry in heap))
+
+    def test_evicted_active_sources_are_expired(self):
+        table = SourceTable(max_size=2, timeout=3.0)
+        for i in range(5):
+            table.touch(BASE_ADDRESS + i, START_TIME + i)
+        expired = table.expire(START_TIME + 4)
+        self.assertEqual(sorted(record.address - BASE_ADDRESS for record in expired), [0, 1, 2])
+        self.assertTrue(all(record.deadline is None for record in expired))
+        self.assertEqual(table.active_count, 2)
+        self.assertEqual(table.expire(START_TIME + 4), [])
+
+    def test_stopped_sources_are_evicted_first(self):
+        table = SourceTable(max_size=4, timeout=3.0)
+        for i in range(2):
+            table.touch(BASE_ADDRESS + i, START_TIME)
+        self.assertEqual(len(table.expire(START_TIME + 10)), 2)
+        for i in range(2, 6):
+            table.touch(BASE_ADDRESS + i, START_TIME + 10)
+        self.assertEqual(table.evicted, 2)
+        self.assertNotIn(BASE_ADDRESS, table)
+        self.assertNotIn(BASE_ADDRESS + 1, table)
+        # 被淘汰的都是已停止的源，不再报告停止
+        self.assertEqual(table.expire(START_TIME + 11), [])
+        self.assertEqual(table.active_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
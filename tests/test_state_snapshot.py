@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+源状态快照测试: 保存后热启动应延续正在进行的会话，不活跃的源按需取出，并按当前的最大源数量淘汰
+"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture_engine import CaptureEngine  # noqa: E402
+from source_table import SourceTable  # noqa: E402
+from state_snapshot import StateSnapshots, load_snapshot, save_snapshot  # noqa: E402
+
+START_TIME = 1700000000.0
+BASE_ADDRESS = 0x0A000000
+
+
+class SnapshotRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'state.bin')
+        # 3个活跃的源和5个已停止的源
+        self.table = SourceTable(max_size=0, timeout=3.0)
+        for i in range(5):
+            self.table.touch(BASE_ADDRESS + 100 + i, START_TIME)
+        self.table.expire(START_TIME + 10)
+        for i in range(3):
+            for seq in range(1, 4):
+                record, _ = self.table.touch(BASE_ADDRESS + i, START_TIME + 10 + seq)
+                record.stats.update(START_TIME + 10 + seq, 7, seq * 2, 56)
+        self.assertEqual(save_snapshot(self.table, self.path, START_TIME + 14), 8)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_load_restores_active_records(self):
+        saved, records, dormant = load_snapshot(self.path)
+        self.assertEqual(saved, START_TIME + 14)
+        self.assertEqual([record.address for record in records], [BASE_ADDRESS + i for i in range(3)])
+        for record, original in zip(records, self.table.records()[-3:]):
+            self.assertEqual((record.start_time, record.last_time, record.active_since, record.count),
+                             (original.start_time, original.last_time, original.active_since,
+                              original.count))
+            self.assertEqual((record.stats.last_ident, record.stats.last_seq, record.stats.seq_gaps),
+                             (7, 6, 2))
+            self.assertAlmostEqual(record.stats.rate, original.stats.rate, places=4)
+            self.assertIsNone(record.deadline)
+        self.assertEqual(len(dormant), 5)
+
+    def test_warm_start_continues_sessions(self):
+        table = SourceTable(max_size=0, timeout=3.0)
+        message = StateSnapshots(self.path).warm_start(table)
+        self.assertIn("3 个正在ping的源和 5 个不活跃的源", message)
+        self.assertEqual((len(table), table.active_count), (8, 3))
+        # 仍在超时时间内的会话继续，不重新开始
+        record, started = table.touch(BASE_ADDRESS, START_TIME + 15)
+        self.assertFalse(started)
+        self.assertEqual((record.start_time, record.count), (START_TIME + 11, 4))
+        # 停机期间超时的源照常报告停止
+        self.assertEqual([record.address for record in table.expire(START_TIME + 18)],
+                         [BASE_ADDRESS + 1, BASE_ADDRESS + 2])
+
+    def test_dormant_records_are_taken_on_demand(self):
+        table = SourceTable(max_size=0, timeout=3.0)
+        StateSnapshots(self.path).warm_start(table)
+        record, started = table.touch(BASE_ADDRESS + 102, START_TIME + 20)
+        self.assertTrue(started)
+        self.assertIn(BASE_ADDRESS + 102, table)
+        self.assertEqual(len(table.dormant), 4)
+        self.assertEqual(len(table), 8)
+        # 再次保存时合并尚未取出的记录
+        self.assertEqual(save_snapshot(table, self.path, START_TIME + 21), 8)
+        _, records, dormant = load_snapshot(self.path)
+        self.assertEqual(len(records), 4)
+        self.assertEqual(len(dormant), 4)
+        self.assertIsNone(dormant.take(BASE_ADDRESS + 102))
+        self.assertEqual(dormant.take(BASE_ADDRESS + 103).address, BASE_ADDRESS + 103)
+
+    def test_invalid_snapshot_starts_empty(self):
+        with open(self.path, 'r+b') as f:
+            f.truncate(100)
+        with self.assertRaises(ValueError):
+            load_snapshot(self.path)
+        table = SourceTable(max_size=0, timeout=3.0)
+        self.assertIn("无法读取快照", StateSnapshots(self.path).warm_start(table))
+        self.assertEqual(len(table), 0)
+        missing = os.path.join(self.directory.name, 'missing.bin')
+        self.assertIn("不存在", StateSnapshots(missing).warm_start(table))
+
+    def test_writer_saves_on_close(self):
+        snapshots = StateSnapshots(self.path, interval=60.0).start(SourceTable(max_size=0))
+        self.assertTrue(snapshots.close())
+        self.assertEqual((snapshots.written, snapshots.records), (1, 0))
+        self.assertEqual(load_snapshot(self.path)[1:], ([], None))
+
+
+class WarmStartTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'state.bin')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_restore_evicts_beyond_max_sources_and_reports_stop(self):
+        now = time.time()
+        table = SourceTable(max_size=0, timeout=3.0)
+        for i in range(10):
+            table.touch(BASE_ADDRESS + i, now - 1 + i * 0.01)
+        save_snapshot(table, self.path, now)
+
+        engine = CaptureEngine(engine='raw', timeout=3.0, max_sources=4)
+        stops = []
+        engine.bus.subscribe('test', {'stop': lambda src, *args: stops.append(src)}, policy='block')
+        message = StateSnapshots(self.path).warm_start(engine.sources)
+        self.assertIn("6", message)
+        self.assertEqual(len(engine.sources), 4)
+        self.assertEqual(engine.sources.active_count, 4)
+        engine.check_inactive_ips(now)
+        engine.close()
+        # 最久未活动的6个源被淘汰，报告停止；其余4个仍在ping
+        self.assertEqual(sorted(stops), [BASE_ADDRESS + i for i in range(6)])
+        self.assertEqual(sorted(record.address for record in engine.sources.records()),
+                         [BASE_ADDRESS + i for i in range(6, 10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+网段汇总与扫描检测测试
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source_table import ip_to_int  # noqa: E402
+from subnet_rollup import RadixTrie, SubnetRollup, parse_prefix_range  # noqa: E402
+
+START_TIME = 1700000000.0
+BASE_ADDRESS = 0x0A000000
+
+
+class RadixTrieTest(unittest.TestCase):
+
+    def test_insert_remove_and_counts(self):
+        trie = RadixTrie()
+        addresses = [BASE_ADDRESS + i for i in (1, 2, 3, 200)] + [ip_to_int('10.0.1.5')]
+        for address in addresses:
+            trie.insert(address)
+        self.assertEqual(len(trie), 5)
+        for address in addresses:
+            self.assertIn(address, trie)
+        self.assertNotIn(BASE_ADDRESS + 4, trie)
+        self.assertEqual(sorted(trie.addresses(BASE_ADDRESS, 24)), addresses[:4])
+        self.assertEqual(len(trie.addresses(BASE_ADDRESS, 16)), 5)
+        self.assertEqual(trie.addresses(ip_to_int('192.168.0.0'), 16), [])
+
+        self.assertTrue(trie.remove(BASE_ADDRESS + 2))
+        self.assertFalse(trie.remove(BASE_ADDRESS + 2))
+        self.assertFalse(trie.remove(ip_to_int('192.168.0.1')))
+        self.assertEqual(len(trie), 4)
+        self.assertNotIn(BASE_ADDRESS + 2, trie)
+        for address in addresses:
+            if address != BASE_ADDRESS + 2:
+                self.assertTrue(trie.remove(address))
+        self.assertEqual(len(trie), 0)
+        self.assertIsNone(trie.root.zero)
+        self.assertIsNone(trie.root.one)
+
+    def test_insert_path_counts_prefix(self):
+        trie = RadixTrie()
+        for i in range(4):
+            trie.insert(BASE_ADDRESS + i)
+        path = trie.insert(BASE_ADDRESS + 100)
+        # 路径上第一个不短于/16的节点包含该网段内全部5个地址
+        node = next(node for node in path if node.length >= 16)
+        self.assertEqual(node.count, 5)
+        self.assertEqual(node.length, 25)
+
+
+class SubnetRollupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.rollup = SubnetRollup(
+            lambda src, timestamp: self.events.append(('start', src)),
+            lambda src, start_time, last_time, count, summary: self.events.append(('stop', src)),
+            lambda sweep: self.events.append(('sweep-start', sweep.cidr, sweep.active)),
+            lambda sweep: self.events.append(('sweep-stop', sweep.cidr, sweep.hosts, sweep.peak,
+                                              sweep.requests)),
+            threshold=3)
+
+    def stop(self, address, count=1):
+        self.rollup.stop(address, START_TIME, START_TIME + 1, count, None)
+
+    def test_sources_below_threshold_pass_through(self):
+        self.rollup.start(BASE_ADDRESS + 1, START_TIME)
+        self.rollup.start(ip_to_int('10.1.0.1'), START_TIME)
+        self.rollup.start(BASE_ADDRESS + 2, START_TIME)
+        self.stop(BASE_ADDRESS + 1)
+        self.assertEqual(self.events, [('start', BASE_ADDRESS + 1), ('start', ip_to_int('10.1.0.1')),
+                                       ('start', BASE_ADDRESS + 2), ('stop', BASE_ADDRESS + 1)])
+        self.assertEqual(self.rollup.sweeps_started, 0)
+
+    def test_sweep_summarizes_subnet(self):
+        for i in range(1, 3):
+            self.rollup.start(BASE_ADDRESS + i, START_TIME)
+        self.rollup.start(BASE_ADDRESS + 3, START_TIME)
+        self.assertEqual(self.events[-1], ('sweep-start', '10.0.0.0/24', 3))
+        for i in range(4, 10):
+            self.rollup.start(BASE_ADDRESS + i, START_TIME)
+        self.assertEqual(len(self.events), 3)
+        self.assertIs(self.rollup.sweep_of(BASE_ADDRESS + 9), self.rollup.sweep_of(BASE_ADDRESS + 1))
+        for i in range(1, 10):
+            self.stop(BASE_ADDRESS + i, count=2)
+        # 汇总前已单独输出开始的两个源照常输出停止，其余只计入扫描
+        self.assertEqual(self.events, [
+            ('start', BASE_ADDRESS + 1), ('start', BASE_ADDRESS + 2),
+            ('sweep-start', '10.0.0.0/24', 3),
+            ('stop', BASE_ADDRESS + 1), ('stop', BASE_ADDRESS + 2),
+            ('sweep-stop', '10.0.0.0/24', 9, 9, 18)])
+        self.assertEqual(self.rollup.suppressed, 14)
+        self.assertIsNone(self.rollup.sweep_of(BASE_ADDRESS + 1))
+        self.assertEqual(self.rollup.sweeps, {})
+
+    def test_sweep_widens_to_include_members(self):
+        for i in range(3):
+            self.rollup.start(BASE_ADDRESS + i, START_TIME)
+        self.rollup.start(ip_to_int('10.0.7.1'), START_TIME + 1)
+        sweep = self.rollup.sweep_of(ip_to_int('10.0.7.1'))
+        self.assertEqual(sweep.cidr, '10.0.0.0/21')
+        self.assertEqual(sweep.last_time, START_TIME + 1)
+
+    def test_restart_after_sweep_ends_is_reported(self):
+        for i in range(3):
+            self.rollup.start(BASE_ADDRESS + i, START_TIME)
+        for i in range(3):
+            self.stop(BASE_ADDRESS + i)
+        del self.events[:]
+        self.rollup.start(BASE_ADDRESS, START_TIME + 10)
+        self.assertEqual(self.events, [('start', BASE_ADDRESS)])
+
+    def test_stop_without_start_is_reported(self):
+        self.stop(BASE_ADDRESS)
+        self.assertEqual(self.events, [('stop', BASE_ADDRESS)])
+
+    def test_parse_prefix_range(self):
+        self.assertEqual(parse_prefix_range('16-24'), (16, 24))
+        self.assertEqual(parse_prefix_range('24'), (24, 24))
+        for text in ('24-16', '0', '16-33'):
+            with self.assertRaises(ValueError):
+                parse_prefix_range(text)
+
+
+if __name__ == '__main__':
+    unittest.main()